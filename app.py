@@ -1,6 +1,27 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g, send_from_directory
 from study_assistant import StudyAssistant
+from response_cache import ResponseCache
+from coalesce import SingleFlight
+from context_cache import ContextCache
+from question_bank import DEFAULT_TYPES, MAX_EXCLUDE, TYPE_LABELS, QuestionBank
+from topic_index import TopicIndex
+from extractors import Extractor
+from upload_store import UploadStore
+from retrieval import ReferenceRetriever
+from resilience import UpstreamError
+from jobs import JobQueue, QueueFull
+from metrics import REGISTRY, HTTP_REQUESTS, HTTP_LATENCY, HTTP_REQUEST_BYTES, HTTP_RESPONSE_BYTES, stats_samples
+from profiler import RequestProfile, profiling_enabled, load_profile
+from compression import CompressedBodies, compression_enabled, is_compressible, negotiate, compress, MIN_SIZE
+from assets import AssetManifest, IMMUTABLE
 import os
+import json
+import hashlib
+import threading
+import time
+import math
+import uuid
+from itertools import chain
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 
@@ -10,187 +31,818 @@ load_dotenv()
 app = Flask(__name__)
 
 # Configure upload settings
-UPLOAD_FOLDER = 'uploads'
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'doc'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Create upload directory if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Uploads are stored once per content hash, within a disk quota (see upload_store.py)
+upload_store = UploadStore.from_env(UPLOAD_FOLDER)
+
+# Seconds each generation endpoint may take before it is stopped with a 504
+# (0 disables). The deadline covers every model call the request makes,
+# including retries and rate limit waits; background jobs have none.
+DEADLINES = {
+    '/create_guide': float(os.getenv('STUDY_DEADLINE_GUIDE', '120')),
+    '/generate_questions': float(os.getenv('STUDY_DEADLINE_QUESTIONS', '90')),
+    '/explain_topic': float(os.getenv('STUDY_DEADLINE_EXPLAIN', '90')),
+    '/summarize_text': float(os.getenv('STUDY_DEADLINE_SUMMARIZE', '300')),
+    '/submit_assignment': float(os.getenv('STUDY_DEADLINE_ASSIGNMENT', '300')),
+    '/grade_answers': float(os.getenv('STUDY_DEADLINE_GRADE', '60')),
+}
+
+def deadline_for(path):
+    """The time.monotonic() deadline for a request to a generation endpoint starting now, or None"""
+    seconds = DEADLINES.get(path)
+    return time.monotonic() + seconds if seconds else None
+
+# Static files are also served under content-hashed names (see assets.py)
+assets = AssetManifest(app.static_folder)
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = assets.hashed_name(values['filename'])
+
+def static_file(filename):
+    """Serve a static file; fingerprinted names are cached by browsers for a year"""
+    original = assets.resolve(filename)
+    if original is None:
+        # Plain names still work, revalidated on every use
+        return app.send_static_file(filename)
+    encoding = negotiate(request.headers.get('Accept-Encoding')) if compression_enabled() else None
+    body = assets.compressed(original, encoding) if encoding else None
+    if body is not None:
+        response = Response(body, mimetype=assets.content_type(original))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    else:
+        response = send_from_directory(app.static_folder, original)
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+app.view_functions['static'] = static_file
+
+# Reference file text extraction (process pool, started on first upload)
+extractor = Extractor.from_env()
+# Relevance-ranked selection of reference text within a token budget
+retriever = ReferenceRetriever.from_env()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Initialize Study Assistant
-try:
-    assistant = StudyAssistant()
-    print("✅ Study Assistant initialized successfully!")
-except Exception as e:
-    print(f"❌ Error initializing Study Assistant: {str(e)}")
-    assistant = None
+def wants_stream():
+    """True when the client asked for Server-Sent Events instead of a JSON body"""
+    return request.accept_mimetypes.best == 'text/event-stream' or request.args.get('stream') == '1'
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def error_payload(e):
+    """JSON body and HTTP status for an exception raised while generating"""
+    if isinstance(e, UpstreamError):
+        return e.to_dict(), e.status
+    if isinstance(e, QueueFull):
+        return {'error': str(e), 'type': 'queue_full', 'retryable': True, 'retry_after': e.retry_after}, 503
+    return {'error': str(e)}, 500
+
+def error_response(e):
+    """JSON error response; upstream failures keep their status code and Retry-After"""
+    payload, status = error_payload(e)
+    response = jsonify(payload)
+    response.status_code = status
+    if payload.get('retry_after') is not None:
+        response.headers['Retry-After'] = str(math.ceil(payload['retry_after']))
+    return response
+
+def stream_response(chunks, meta=None, progress=None):
+    """Forward generated text chunks to the browser as Server-Sent Events
+
+    progress is an optional list the generator appends progress dicts to; they
+    are sent as `progress` events before the next chunk. Empty chunks carry no
+    text and only give pending progress a chance to go out.
+
+    The first chunk is pulled before answering, so a failure before any output
+    gets a proper error status; later failures are sent as an `error` event.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    
+    def generate():
+        if meta:
+            yield sse_event('meta', meta)
+        try:
+            for chunk in chain([first] if first is not None else [], chunks):
+                while progress:
+                    yield sse_event('progress', progress.pop(0))
+                if chunk:
+                    yield sse_event('chunk', {'text': chunk})
+        except Exception as e:
+            yield sse_event('error', error_payload(e)[0])
+            return
+        yield sse_event('done', {})
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Request parsing shared by the Flask routes and the ASGI app (asgi.py).
+# Each parser returns StudyAssistant keyword arguments or raises ValueError
+# with the message to send back as a 400 error.
+
+def guide_request(data):
+    topic = data.get('topic', '')
+    level = data.get('level', 'intermediate')
+    focus_areas = data.get('focus_areas', '')
+    if not topic:
+        raise ValueError('Topic is required')
+    args = {'topic': topic, 'level': level, 'focus_areas': focus_areas if focus_areas else None}
+    if 'sectional' in data:
+        # Generate the sections as concurrent calls (default: STUDY_GUIDE_SECTIONAL)
+        args['sectional'] = bool(data['sectional'])
+    return args
+
+MAX_QUESTIONS = 50
+
+def questions_request(data):
+    topic = data.get('topic', '')
+    try:
+        num_questions = min(MAX_QUESTIONS, max(1, int(data.get('num_questions', 5))))
+    except (TypeError, ValueError):
+        raise ValueError('num_questions must be a number')
+    question_types = data.get('question_types', list(DEFAULT_TYPES))
+    if (not isinstance(question_types, list) or not question_types
+            or not all(isinstance(qtype, str) and qtype in TYPE_LABELS for qtype in question_types)):
+        raise ValueError(f"question_types must be a list of: {', '.join(TYPE_LABELS)}")
+    # Question bank ids the client has already seen
+    exclude = data.get('exclude') or []
+    if not isinstance(exclude, list) or len(exclude) > MAX_EXCLUDE:
+        raise ValueError(f'exclude must be a list of at most {MAX_EXCLUDE} question ids')
+    try:
+        exclude = [int(question_id) for question_id in exclude]
+    except (TypeError, ValueError):
+        raise ValueError('exclude must be a list of question ids')
+    if not topic:
+        raise ValueError('Topic is required')
+    return {'topic': topic, 'num_questions': num_questions, 'question_types': list(dict.fromkeys(question_types)),
+            'exclude': exclude}
+
+# Most answers one grading request may carry
+MAX_GRADED_ANSWERS = int(os.getenv('STUDY_GRADE_MAX_ANSWERS', '200'))
+
+def grade_request(data):
+    answers = data.get('answers')
+    if not isinstance(answers, list) or not answers:
+        raise ValueError('Answers are required')
+    if len(answers) > MAX_GRADED_ANSWERS:
+        raise ValueError(f'At most {MAX_GRADED_ANSWERS} answers can be graded per request')
+    items = []
+    for item in answers:
+        if not isinstance(item, dict) or item.get('question_id') is None:
+            raise ValueError('Each answer needs a question_id and an answer')
+        try:
+            question_id = int(item['question_id'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid question_id {item['question_id']!r}")
+        items.append({'question_id': question_id, 'answer': str(item.get('answer') or '')})
+    return {'answers': items}
+
+def explain_request(data):
+    topic = data.get('topic', '')
+    difficulty_level = data.get('difficulty_level', 'beginner')
+    if not topic:
+        raise ValueError('Topic is required')
+    return {'topic': topic, 'difficulty_level': difficulty_level}
+
+def summarize_request(data):
+    text = data.get('text', '')
+    summary_type = data.get('summary_type', 'comprehensive')
+    if not text:
+        raise ValueError('Text is required')
+    return {'text': text, 'summary_type': summary_type}
+
+def assignment_request(form):
+    assignment_name = form.get('assignment_name', '')
+    details = form.get('details', '')
+    output_format = form.get('output_format', 'Report')
+    word_count = form.get('word_count', '')
+    if not assignment_name or not details:
+        raise ValueError('Assignment name and details are required')
+    return {
+        'assignment_name': assignment_name,
+        'details': details,
+        'output_format': output_format,
+        'word_count': word_count
+    }
+
+def save_reference_files(files, ref):
+    """Store allowed uploads, referenced by ref, and return their stored records"""
+    uploads = []
+    for file in files:
+        if file and file.filename != '' and allowed_file(file.filename):
+            uploads.append(upload_store.save(file.stream, secure_filename(file.filename), ref))
+    return uploads
+
+def load_reference_files(files, query=""):
+    """Store the uploads and read them for the prompt; the files are only referenced while they are read
+
+    Returns (uploaded filenames, reference_content, extraction, retrieval).
+    """
+    ref = uuid.uuid4().hex
+    try:
+        uploads = save_reference_files(files, ref)
+        reference_content, extraction, retrieval = read_reference_files(uploads, query)
+    finally:
+        upload_store.release(ref)
+    return [upload['filename'] for upload in uploads], reference_content, extraction, retrieval
+
+def read_reference_files(uploads, query=""):
+    """Extract stored reference files and pick the parts relevant to the query for the prompt
+
+    Returns (reference_content, extraction, retrieval): extraction holds
+    per-file timing metadata and retrieval describes what was selected.
+    """
+    documents = []
+    errors = ""
+    extraction = []
+    results = extractor.extract_many([upload['path'] for upload in uploads],
+                                     names=[upload['filename'] for upload in uploads],
+                                     digests=[upload['sha256'] for upload in uploads])
+    for result in results:
+        filename = result['filename']
+        if result['error']:
+            errors += f"\n\n--- Error reading {filename}: {result['error']} ---\n"
+        else:
+            documents.append(result)
+        extraction.append({
+            'filename': filename,
+            'seconds': result['seconds'],
+            'cached': result['cached'],
+            'chars': len(result['text']),
+            'error': result['error']
+        })
+    
+    chunks, retrieval = retriever.retrieve(documents, query) if documents else ([], None)
+    reference_content = ""
+    current = None
+    for chunk in chunks:
+        if chunk['filename'] != current:
+            current = chunk['filename']
+            label = "Content from" if retrieval['mode'] == 'full' else "Relevant excerpts from"
+            reference_content += f"\n\n--- {label} {current} ---\n"
+        else:
+            reference_content += "\n[...]\n"
+        reference_content += chunk['text']
+    return reference_content + errors, extraction, retrieval
+
+# The Study Assistant is built on first use, so importing the app (worker boot,
+# tests, CLI tools) doesn't pay for the model SDK import and configuration
+_assistant = None
+_assistant_lock = threading.Lock()
+
+def get_assistant():
+    """Return the shared Study Assistant, or None if it could not be initialized"""
+    global _assistant
+    if _assistant is None:
+        with _assistant_lock:
+            if _assistant is None:
+                try:
+                    _assistant = StudyAssistant(
+                        cache=ResponseCache.from_env(),
+                        coalescer=SingleFlight.from_env(),
+                        context_cache=ContextCache.from_env(),
+                        question_bank=QuestionBank.from_env(),
+                        topic_index=TopicIndex.from_env()
+                    )
+                    print("✅ Study Assistant initialized successfully!")
+                except Exception as e:
+                    print(f"❌ Error initializing Study Assistant: {str(e)}")
+                    _assistant = False
+    return _assistant or None
+
+# Long generations can run as background jobs (see jobs.py). The queue and its
+# workers start with the server (see __main__ and asgi.lifespan), so jobs left
+# over from a restart resume, or else with the first request to a job route
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def run_assignment_job(params):
+    """Job handler: generate an assignment, yielding text chunks"""
+    assistant = get_assistant()
+    if not assistant:
+        raise RuntimeError('Study Assistant not available')
+    return assistant.generate_assignment(**params, stream=True)
+
+def get_job_queue():
+    """Return the shared job queue, starting its workers on first use"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                queue = JobQueue.from_env()
+                queue.register('assignment', run_assignment_job)
+                _job_queue = queue.start()
+    return _job_queue
+
+def wants_async(req):
+    """True when the client asked for a job id instead of waiting for the result"""
+    return req.values.get('async') == '1' or 'respond-async' in req.headers.get('Prefer', '')
+
+def job_links(job_id):
+    return {'status_url': f'/jobs/{job_id}', 'events_url': f'/jobs/{job_id}/events'}
+
+def submit_assignment_job(args, reference_content, meta):
+    """Queue an assignment job and return the 202 response body; raises QueueFull"""
+    job, created = get_job_queue().submit('assignment', {**args, 'reference_content': reference_content}, meta=meta)
+    return {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'deduplicated': not created,
+        **job_links(job['id']),
+        **meta
+    }
+
+def collect_job_metrics():
+    if _job_queue is None:
+        return []
+    return stats_samples('study_jobs', 'Background jobs', _job_queue.stats())
+
+REGISTRY.register_collector(collect_job_metrics)
+
+def collect_upload_metrics():
+    return stats_samples('study_uploads', 'Upload store', upload_store.stats())
+
+REGISTRY.register_collector(collect_upload_metrics)
+
+# Request metrics and the opt-in per-request profiler
+
+def wants_profile():
+    return profiling_enabled() and (request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1')
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.profile = RequestProfile(f"{request.method} {request.path}") if wants_profile() else None
+
+@app.after_request
+def finish_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, str(response.status_code)
+    start, profile = g.get('request_start'), g.get('profile')
+    request_bytes = request.content_length or 0
+    response_bytes = response.calculate_content_length()
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.id
+    
+    def finish():
+        if start is not None:
+            HTTP_LATENCY.observe(time.perf_counter() - start, route=route)
+        HTTP_REQUESTS.inc(route=route, method=method, status=status)
+        HTTP_REQUEST_BYTES.observe(request_bytes, route=route)
+        if response_bytes is not None:
+            HTTP_RESPONSE_BYTES.observe(response_bytes, route=route)
+        if profile is not None:
+            profile.finish()
+    if response.is_streamed:
+        # The body is still being generated; count its time too
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+# Registered after the metrics hook so it runs first: metrics see the bytes actually sent
+compressed_bodies = CompressedBodies()
+
+@app.after_request
+def conditional_and_compressed(response):
+    """ETag and conditional GET for GET results; gzip or brotli for text bodies"""
+    if response.is_streamed or response.direct_passthrough or response.status_code != 200:
+        return response
+    if 'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    encoding = None
+    if compression_enabled() and len(data) >= MIN_SIZE and is_compressible(response.mimetype):
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        response.vary.add('Accept-Encoding')
+    etag = None
+    if request.method in ('GET', 'HEAD'):
+        # One ETag per representation: the compressed body differs from the plain one
+        etag = hashlib.sha256(data).hexdigest()[:32] + (f'-{encoding}' if encoding else '')
+        response.set_etag(etag)
+        if not response.headers.get('Cache-Control'):
+            response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    if encoding:
+        response.set_data(compressed_bodies.get(etag, data, encoding) if etag else compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.teardown_request
+def stop_failed_profile(exc):
+    # after_request is skipped for unhandled errors; don't leave the sampler running
+    profile = g.get('profile')
+    if exc is not None and profile is not None:
+        profile.finish()
+
+KEY_TOTALS = ('calls', 'calls_last_minute', 'in_flight', 'errors', 'quota_errors', 'drains',
+              'prompt_tokens', 'output_tokens')
+
+def model_backends(assistant):
+    """model -> backend: the primary backend and every backend the router has built"""
+    backends = {assistant.model_name: assistant.backend}
+    if assistant.router is not None:
+        backends.update(assistant.router.backends())
+    return backends
+
+def key_pool_stats(assistant):
+    """model -> per-key stats, for the model backends that spread calls over an API key pool"""
+    return {model: backend.key_stats() for model, backend in model_backends(assistant).items()
+            if hasattr(backend, 'key_stats')}
+
+def key_totals(pools):
+    """key -> its counts summed over every model's pool, and whether any of them has it drained"""
+    totals = {}
+    for keys in pools.values():
+        for key, stats in keys.items():
+            total = totals.setdefault(key, {**{name: 0 for name in KEY_TOTALS}, 'drained': False})
+            for name in KEY_TOTALS:
+                total[name] += stats[name]
+            total['drained'] = total['drained'] or stats['drained']
+    return totals
+
+def collect_assistant_metrics():
+    """Gauges from the assistant's caches and upstream client, read at scrape time"""
+    if not _assistant:
+        return []
+    samples = []
+    if _assistant.cache is not None:
+        samples += stats_samples('study_cache', 'Response cache', _assistant.cache.stats())
+    if _assistant.coalescer is not None:
+        samples += stats_samples('study_coalesce', 'Request coalescing', _assistant.coalescer.stats())
+    if _assistant.context_cache is not None:
+        samples += stats_samples('study_context_cache', 'Provider context cache', _assistant.context_cache.stats())
+    if _assistant.topic_index is not None:
+        samples += stats_samples('study_topics', 'Topic matching', _assistant.topic_index.stats())
+    if _assistant.question_bank is not None:
+        samples += stats_samples('study_question_bank', 'Question bank', _assistant.question_bank.stats())
+    for model, backend in model_backends(_assistant).items():
+        if hasattr(backend, 'stats'):
+            upstream = backend.stats()
+            samples += stats_samples('study_upstream', 'Upstream client', upstream, {'model': model})
+            samples.append(('study_upstream_circuit_open', 'Circuit breaker open (1) or not (0)', {'model': model},
+                            1 if upstream.get('circuit') == 'open' else 0))
+    if _assistant.router is not None:
+        for model, model_stats in _assistant.router.stats()['models'].items():
+            samples += stats_samples('study_route_model', 'Model routing', model_stats, {'model': model})
+        samples += [('study_route_latency_seconds', 'Moving average model latency (streams: time to first chunk)',
+                     {'model': model, 'feature': feature, 'operation': operation}, average)
+                    for model, feature, operation, average, _ in _assistant.router.latency_samples()]
+    for model, keys in key_pool_stats(_assistant).items():
+        for key, key_stats in keys.items():
+            samples += stats_samples('study_api_key', 'API key pool', key_stats, {'model': model, 'key': key})
+    return samples
+
+REGISTRY.register_collector(collect_assistant_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiles/<profile_id>')
+def profile(profile_id):
+    """Return a saved request profile in folded-stack format"""
+    text = load_profile(profile_id) if profiling_enabled() else None
+    if text is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(text, mimetype='text/plain')
+
+# The page templates have no per-request content, so each is rendered once
+PAGE_TEMPLATES = (
+    'index.html',
+    'study_guide_page.html',
+    'practice_questions_page.html',
+    'explain_topic_page.html',
+    'summarize_page.html',
+    'assignment_input_page.html',
+)
+_pages = {}
+
+def render_page(template):
+    """Return a page's pre-rendered HTML (rendered fresh in debug mode, to pick up edits)"""
+    if app.debug:
+        return render_template(template)
+    if not _pages:
+        prerender_pages()
+    return _pages[template]
+
+def prerender_pages():
+    """Render every page template once; the ASGI app does this at startup, Flask on the first page view"""
+    global _pages
+    with app.test_request_context('/'):
+        _pages = {template: render_template(template) for template in PAGE_TEMPLATES}
 
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('index.html')
+    return render_page('index.html')
 
 @app.route('/study-guide')
 def study_guide_page():
-    return render_template('study_guide_page.html')
+    return render_page('study_guide_page.html')
 
 @app.route('/practice-questions')
 def practice_questions_page():
-    return render_template('practice_questions_page.html')
+    return render_page('practice_questions_page.html')
 
 @app.route('/explain-topic')
 def explain_topic_page():
-    return render_template('explain_topic_page.html')
+    return render_page('explain_topic_page.html')
 
 @app.route('/summarize')
 def summarize_page():
-    return render_template('summarize_page.html')
+    return render_page('summarize_page.html')
 
 @app.route('/assignment-input')
 def assignment_input_page():
-    return render_template('assignment_input_page.html')
+    return render_page('assignment_input_page.html')
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Report response cache hit/miss counters"""
+    assistant = get_assistant()
+    if not assistant or assistant.cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.cache.stats()})
+
+@app.route('/coalesce_stats')
+def coalesce_stats():
+    """Report how many identical concurrent requests shared one model call"""
+    assistant = get_assistant()
+    if not assistant or assistant.coalescer is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.coalescer.stats()})
+
+@app.route('/topic_stats')
+def topic_stats():
+    """Report how many topics were mapped to an equivalent known topic"""
+    assistant = get_assistant()
+    if not assistant or assistant.topic_index is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.topic_index.stats()})
+
+@app.route('/context_cache_stats')
+def context_cache_stats():
+    """Report provider context-cache handles created, reused and refreshed"""
+    assistant = get_assistant()
+    if not assistant or assistant.context_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.context_cache.stats()})
+
+@app.route('/question_bank_stats')
+def question_bank_stats():
+    """Report stored questions and how many requests the question bank served without the model"""
+    assistant = get_assistant()
+    if not assistant or assistant.question_bank is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.question_bank.stats()})
+
+@app.route('/upstream_stats')
+def upstream_stats():
+    """Report retries, throttling and circuit breaker state of the model client"""
+    assistant = get_assistant()
+    if not assistant or not hasattr(assistant.backend, 'stats'):
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.backend.stats()})
+
+@app.route('/route_stats')
+def route_stats():
+    """Report model routing rules, and per-model calls, latency and token usage"""
+    assistant = get_assistant()
+    if not assistant or assistant.router is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **assistant.router.stats()})
+
+@app.route('/key_stats')
+def key_stats():
+    """Report per-key calls, quota errors, drained keys and quota utilization of the API key pool"""
+    assistant = get_assistant()
+    pools = key_pool_stats(assistant) if assistant else {}
+    if not pools:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'keys': key_totals(pools), 'models': pools})
+
+@app.route('/upload_stats')
+def upload_stats():
+    """Report stored reference files, deduplicated uploads and evictions"""
+    return jsonify({'enabled': True, **upload_store.stats()})
+
+@app.route('/job_stats')
+def job_stats():
+    """Report background job queue depth and waiting times"""
+    return jsonify(get_job_queue().stats())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Poll a background job; the result is included once it is done"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({**job, **job_links(job_id)})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Follow a background job as Server-Sent Events"""
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        for event, data in queue.follow(job_id):
+            yield sse_event(event, data)
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/create_guide', methods=['POST'])
 def create_guide():
     """Create a study guide"""
+    assistant = get_assistant()
     if not assistant:
         return jsonify({'error': 'Study Assistant not available'}), 500
     
     try:
-        data = request.get_json()
-        topic = data.get('topic', '')
-        level = data.get('level', 'intermediate')
-        focus_areas = data.get('focus_areas', '')
-        
-        if not topic:
-            return jsonify({'error': 'Topic is required'}), 400
+        args = guide_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    deadline = deadline_for(request.path)
+    try:
+        if wants_stream():
+            return stream_response(assistant.create_study_guide(**args, stream=True, deadline=deadline))
         
-        guide = assistant.create_study_guide(topic, level, focus_areas if focus_areas else None)
+        guide = assistant.create_study_guide(**args, deadline=deadline)
         return jsonify({'guide': guide})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/generate_questions', methods=['POST'])
 def generate_questions():
     """Generate practice questions"""
+    assistant = get_assistant()
     if not assistant:
         return jsonify({'error': 'Study Assistant not available'}), 500
     
     try:
-        data = request.get_json()
-        topic = data.get('topic', '')
-        num_questions = int(data.get('num_questions', 5))
-        question_types = data.get('question_types', ['multiple_choice', 'true_false', 'short_answer'])
-        
-        if not topic:
-            return jsonify({'error': 'Topic is required'}), 400
+        args = questions_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    deadline = deadline_for(request.path)
+    try:
+        if wants_stream():
+            return stream_response(assistant.generate_practice_questions(**args, stream=True, deadline=deadline))
         
-        questions = assistant.generate_practice_questions(topic, num_questions, question_types)
+        questions = assistant.generate_practice_questions(**args, deadline=deadline)
         return jsonify({'questions': questions})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+@app.route('/grade_answers', methods=['POST'])
+def grade_answers():
+    """Grade answers to question bank questions"""
+    assistant = get_assistant()
+    if not assistant:
+        return jsonify({'error': 'Study Assistant not available'}), 500
+    
+    try:
+        args = grade_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return jsonify(assistant.grade_answers(**args, deadline=deadline_for(request.path)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return error_response(e)
 
 @app.route('/explain_topic', methods=['POST'])
 def explain_topic():
     """Explain a complex topic"""
+    assistant = get_assistant()
     if not assistant:
         return jsonify({'error': 'Study Assistant not available'}), 500
     
     try:
-        data = request.get_json()
-        topic = data.get('topic', '')
-        difficulty_level = data.get('difficulty_level', 'beginner')
-        
-        if not topic:
-            return jsonify({'error': 'Topic is required'}), 400
+        args = explain_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    deadline = deadline_for(request.path)
+    try:
+        if wants_stream():
+            return stream_response(assistant.explain_complex_topic(**args, stream=True, deadline=deadline))
         
-        explanation = assistant.explain_complex_topic(topic, difficulty_level)
+        explanation = assistant.explain_complex_topic(**args, deadline=deadline)
         return jsonify({'explanation': explanation})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/summarize_text', methods=['POST'])
 def summarize_text():
     """Summarize text"""
+    assistant = get_assistant()
     if not assistant:
         return jsonify({'error': 'Study Assistant not available'}), 500
     
     try:
-        data = request.get_json()
-        text = data.get('text', '')
-        summary_type = data.get('summary_type', 'comprehensive')
-        
-        if not text:
-            return jsonify({'error': 'Text is required'}), 400
+        args = summarize_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    deadline = deadline_for(request.path)
+    try:
+        if wants_stream():
+            progress = []
+            chunks = assistant.summarize_text(
+                **args,
+                stream=True,
+                deadline=deadline,
+                progress=lambda done, total: progress.append({'done': done, 'total': total})
+            )
+            return stream_response(chunks, progress=progress)
         
-        summary = assistant.summarize_text(text, summary_type)
+        summary = assistant.summarize_text(**args, deadline=deadline)
         return jsonify({'summary': summary})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/submit_assignment', methods=['POST'])
 def submit_assignment():
     """Handle assignment form submission"""
+    assistant = get_assistant()
     if not assistant:
         return jsonify({'error': 'Study Assistant not available'}), 500
     
     try:
-        # Get form data
-        assignment_name = request.form.get('assignment_name', '')
-        details = request.form.get('details', '')
-        output_format = request.form.get('output_format', 'Report')
-        word_count = request.form.get('word_count', '')
-        
-        if not assignment_name or not details:
-            return jsonify({'error': 'Assignment name and details are required'}), 400
+        args = assignment_request(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    deadline = deadline_for(request.path)
+    try:
+        # Handle file upload and read reference files content if any
+        uploaded_files, reference_content, extraction, retrieval = load_reference_files(
+            request.files.getlist('reference_files'), query=f"{args['assignment_name']} {args['details']}")
         
-        # Handle file upload
-        uploaded_files = []
-        if 'reference_files' in request.files:
-            files = request.files.getlist('reference_files')
-            for file in files:
-                if file and file.filename != '' and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    uploaded_files.append(filename)
+        if wants_async(request):
+            payload = submit_assignment_job(args, reference_content, meta={
+                'assignment_name': args['assignment_name'],
+                'output_format': args['output_format'],
+                'uploaded_files': uploaded_files,
+                'extraction': extraction,
+                'retrieval': retrieval
+            })
+            return jsonify(payload), 202, {'Location': payload['status_url']}
         
-        # Read reference files content if any
-        reference_content = ""
-        if uploaded_files:
-            for filename in uploaded_files:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        reference_content += f"\n\n--- Content from {filename} ---\n"
-                        reference_content += f.read()
-                except Exception as e:
-                    reference_content += f"\n\n--- Error reading {filename}: {str(e)} ---\n"
+        if wants_stream():
+            chunks = assistant.generate_assignment(**args, reference_content=reference_content, stream=True, deadline=deadline)
+            return stream_response(chunks, meta={
+                'assignment_name': args['assignment_name'],
+                'output_format': args['output_format'],
+                'uploaded_files': uploaded_files,
+                'extraction': extraction,
+                'retrieval': retrieval
+            })
         
         # Generate the assignment using the proper method
-        result = assistant.generate_assignment(
-            assignment_name=assignment_name,
-            details=details,
-            output_format=output_format,
-            word_count=word_count,
-            reference_content=reference_content
-        )
+        result = assistant.generate_assignment(**args, reference_content=reference_content, deadline=deadline)
         
         return jsonify({
             'success': True,
-            'assignment_name': assignment_name,
-            'output_format': output_format,
+            'assignment_name': args['assignment_name'],
+            'output_format': args['output_format'],
             'result': result,
-            'uploaded_files': uploaded_files
+            'uploaded_files': uploaded_files,
+            'extraction': extraction,
+            'retrieval': retrieval
         })
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 if __name__ == '__main__':
+    # With the reloader, only the child process that serves requests runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_job_queue()
     app.run(debug=True, host='0.0.0.0', port=8000) 
\ No newline at end of file
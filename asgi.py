@@ -0,0 +1,504 @@
+"""
+ASGI entry point for Study Assistant
+Serves the generation endpoints with the async StudyAssistant API, so hundreds
+of slow model calls can wait on a single event loop instead of holding one OS
+thread each. A generation is cancelled, model calls included, as soon as its
+client disconnects. Pages, static files and every other route are handed to the Flask
+app in a worker thread, so routes and response shapes match app.py.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+
+import asyncio
+import io
+import json
+import math
+import os
+import re
+import sys
+import time
+
+from werkzeug.wrappers import Request
+
+from metrics import REGISTRY, HTTP_REQUESTS, HTTP_LATENCY, HTTP_REQUEST_BYTES, HTTP_RESPONSE_BYTES, HTTP_DISCONNECTS
+from profiler import RequestProfile, profiling_enabled
+from compression import compression_enabled, is_compressible, negotiate, compress, MIN_SIZE
+from app import (
+    app as flask_app,
+    get_assistant,
+    deadline_for,
+    get_job_queue,
+    prerender_pages,
+    wants_async,
+    submit_assignment_job,
+    guide_request,
+    questions_request,
+    grade_request,
+    explain_request,
+    summarize_request,
+    assignment_request,
+    load_reference_files,
+    sse_event,
+    error_payload,
+)
+
+# Maximum number of generation requests in flight before answering 429
+MAX_CONCURRENCY = int(os.getenv("STUDY_MAX_CONCURRENCY", "500"))
+# Seconds a rejected client is asked to wait before retrying
+RETRY_AFTER = int(os.getenv("STUDY_RETRY_AFTER", "5"))
+
+# path -> (request parser, async StudyAssistant method, JSON result key, reports progress);
+# a result key of None sends the method's result as the body and never streams
+API_ROUTES = {
+    "/create_guide": (guide_request, "acreate_study_guide", "guide", False),
+    "/generate_questions": (questions_request, "agenerate_practice_questions", "questions", False),
+    "/grade_answers": (grade_request, "agrade_answers", None, False),
+    "/explain_topic": (explain_request, "aexplain_complex_topic", "explanation", False),
+    "/summarize_text": (summarize_request, "asummarize_text", "summary", True),
+}
+
+# Job event streams are served here; through call_flask they would be buffered
+JOB_EVENTS = re.compile(r"^/jobs/([^/]+)/events$")
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the request body was received"""
+
+
+class ConcurrencyLimiter:
+    """Admit at most `limit` in-flight generations; anything beyond is rejected"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        # Runs on the event loop thread only, so plain counters are safe
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENCY)
+
+REGISTRY.register_collector(lambda: [
+    ("study_asgi_in_flight", "Generation requests in flight", {}, limiter.in_flight),
+    ("study_asgi_concurrency_limit", "Maximum generation requests in flight", {}, limiter.limit),
+    ("study_asgi_rejected", "Generation requests rejected with 429", {}, limiter.rejected),
+])
+
+
+class ResponseRecorder:
+    """Wraps ASGI send to record the status and body size, and add the profile id header"""
+
+    def __init__(self, send, profile_id=None):
+        self.send = send
+        self.profile_id = profile_id
+        self.status = None
+        self.bytes = 0
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            if self.profile_id:
+                message = dict(message, headers=[*message.get("headers", []), (b"x-profile-id", self.profile_id.encode("latin-1"))])
+        elif message["type"] == "http.response.body":
+            self.bytes += len(message.get("body", b""))
+        await self.send(message)
+
+
+class CompressingSend:
+    """Wraps ASGI send to gzip or brotli complete text bodies (see compression.py)
+
+    The response start is held back until the first body message: a body
+    sent in one piece can be compressed, a streamed one passes through as is.
+    """
+
+    def __init__(self, send, scope):
+        self.send = send
+        accept = dict(scope.get("headers", [])).get(b"accept-encoding", b"").decode("latin-1")
+        self.encoding = negotiate(accept) if compression_enabled() else None
+        self.start = None
+
+    async def __call__(self, message):
+        if self.encoding is None:
+            await self.send(message)
+            return
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] == "http.response.body" and self.start is not None:
+            start, self.start = self.start, None
+            body = message.get("body", b"")
+            headers = start.get("headers", [])
+            content_type = dict(headers).get(b"content-type", b"").decode("latin-1")
+            if not message.get("more_body", False) and len(body) >= MIN_SIZE and is_compressible(content_type):
+                body = compress(body, self.encoding)
+                headers = [(name, value) for name, value in headers if name != b"content-length"] + [
+                    (b"content-encoding", self.encoding.encode("latin-1")),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"vary", b"accept-encoding"),
+                ]
+                start = dict(start, headers=headers)
+                message = dict(message, body=body)
+            await self.send(start)
+        await self.send(message)
+
+
+def wants_profile(scope):
+    """Same opt-in as app.wants_profile: STUDY_PROFILING plus X-Profile: 1 or ?profile=1"""
+    if not profiling_enabled():
+        return False
+    headers = dict(scope.get("headers", []))
+    return headers.get(b"x-profile") == b"1" or b"profile=1" in scope.get("query_string", b"").split(b"&")
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope and body into a WSGI environ"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0] if client else "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").lower()
+        value = value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            continue
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive, limit):
+    """Read the full request body; returns None if it exceeds limit bytes"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    """Return once the client has gone away (the request body has already been read)"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_error(send, e):
+    """Send the JSON error for an exception, with Retry-After when the upstream suggests one"""
+    payload, status = error_payload(e)
+    headers = []
+    if payload.get("retry_after") is not None:
+        headers.append((b"retry-after", str(math.ceil(payload["retry_after"])).encode("latin-1")))
+    await send_json(send, status, payload, headers=headers)
+
+
+async def send_event_stream(send, chunks, meta=None, progress=None):
+    """Forward an async iterator of text chunks as Server-Sent Events (see app.stream_response)
+
+    The first chunk is awaited before the response starts, so a failure before
+    any output raises (and gets an error status); later failures become an
+    `error` event.
+    """
+    chunks = chunks.__aiter__()
+    try:
+        first = [await chunks.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    if meta:
+        await send({"type": "http.response.body", "body": sse_event("meta", meta).encode("utf-8"), "more_body": True})
+
+    async def remaining():
+        for chunk in first:
+            yield chunk
+        async for chunk in chunks:
+            yield chunk
+
+    try:
+        async for chunk in remaining():
+            while progress:
+                await send({"type": "http.response.body", "body": sse_event("progress", progress.pop(0)).encode("utf-8"), "more_body": True})
+            if chunk:
+                await send({"type": "http.response.body", "body": sse_event("chunk", {"text": chunk}).encode("utf-8"), "more_body": True})
+    except Exception as e:
+        await send({"type": "http.response.body", "body": sse_event("error", error_payload(e)[0]).encode("utf-8")})
+        return
+    await send({"type": "http.response.body", "body": sse_event("done", {}).encode("utf-8")})
+
+
+def wants_stream(req):
+    """Same negotiation as app.wants_stream, for a werkzeug request"""
+    return req.accept_mimetypes.best == "text/event-stream" or req.args.get("stream") == "1"
+
+
+async def handle_generation(assistant, scope, req, send):
+    """Serve one of the generation endpoints with the async StudyAssistant API"""
+    path = scope["path"]
+    deadline = deadline_for(path)
+    if path == "/submit_assignment":
+        try:
+            args = assignment_request(req.form)
+        except ValueError as e:
+            await send_json(send, 400, {"error": str(e)})
+            return
+        # File I/O stays off the event loop
+        uploaded_files, reference_content, extraction, retrieval = await asyncio.to_thread(
+            load_reference_files, req.files.getlist("reference_files"), f"{args['assignment_name']} {args['details']}")
+        if wants_async(req):
+            payload = await asyncio.to_thread(submit_assignment_job, args, reference_content, {
+                "assignment_name": args["assignment_name"],
+                "output_format": args["output_format"],
+                "uploaded_files": uploaded_files,
+                "extraction": extraction,
+                "retrieval": retrieval,
+            })
+            await send_json(send, 202, payload, headers=[(b"location", payload["status_url"].encode("latin-1"))])
+            return
+        if wants_stream(req):
+            chunks = await assistant.agenerate_assignment(**args, reference_content=reference_content, stream=True, deadline=deadline)
+            await send_event_stream(send, chunks, meta={
+                "assignment_name": args["assignment_name"],
+                "output_format": args["output_format"],
+                "uploaded_files": uploaded_files,
+                "extraction": extraction,
+                "retrieval": retrieval,
+            })
+            return
+        result = await assistant.agenerate_assignment(**args, reference_content=reference_content, deadline=deadline)
+        await send_json(send, 200, {
+            "success": True,
+            "assignment_name": args["assignment_name"],
+            "output_format": args["output_format"],
+            "result": result,
+            "uploaded_files": uploaded_files,
+            "extraction": extraction,
+            "retrieval": retrieval,
+        })
+        return
+
+    parse, method_name, result_key, reports_progress = API_ROUTES[path]
+    try:
+        args = parse(req.get_json(silent=True) or {})
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    method = getattr(assistant, method_name)
+    if result_key is None:
+        try:
+            result = await method(**args, deadline=deadline)
+        except ValueError as e:
+            await send_json(send, 400, {"error": str(e)})
+            return
+        await send_json(send, 200, result)
+        return
+    if wants_stream(req):
+        progress = []
+        if reports_progress:
+            args["progress"] = lambda done, total: progress.append({"done": done, "total": total})
+        await send_event_stream(send, await method(**args, stream=True, deadline=deadline), progress=progress)
+        return
+    await send_json(send, 200, {result_key: await method(**args, deadline=deadline)})
+
+
+async def send_job_events(send, job_id):
+    """Follow a background job as Server-Sent Events (see app.job_events)"""
+    queue = await asyncio.to_thread(get_job_queue)
+    if await asyncio.to_thread(queue.get, job_id) is None:
+        await send_json(send, 404, {"error": "Job not found"})
+        return
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    async for event, data in queue.afollow(job_id):
+        await send({"type": "http.response.body", "body": sse_event(event, data).encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def call_flask(scope, body, send):
+    """Run a request through the Flask WSGI app in a worker thread"""
+    environ = build_environ(scope, body)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    def run():
+        result = flask_app(environ, start_response)
+        try:
+            return b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    content = await asyncio.to_thread(run)
+    await send({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Warm up in the background: the worker is ready at once and the
+            # model client is usually built before the first request arrives
+            asyncio.get_running_loop().run_in_executor(None, get_assistant)
+            # Resume jobs left queued or running by the previous process
+            asyncio.get_running_loop().run_in_executor(None, get_job_queue)
+            asyncio.get_running_loop().run_in_executor(None, prerender_pages)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    try:
+        body = await read_body(receive, flask_app.config.get("MAX_CONTENT_LENGTH"))
+    except ClientDisconnected:
+        return
+    if body is None:
+        await send_json(send, 413, {"error": "Request body too large"})
+        return
+
+    job_events = JOB_EVENTS.match(scope["path"]) if scope["method"] == "GET" else None
+    if job_events:
+        start = time.perf_counter()
+        recorder = ResponseRecorder(send, None)
+        try:
+            await send_job_events(recorder, job_events.group(1))
+        finally:
+            route = "/jobs/<job_id>/events"
+            HTTP_LATENCY.observe(time.perf_counter() - start, route=route)
+            HTTP_REQUESTS.inc(route=route, method="GET", status=str(recorder.status or 500))
+        return
+
+    is_generation = scope["method"] == "POST" and (scope["path"] in API_ROUTES or scope["path"] == "/submit_assignment")
+    if not is_generation:
+        # Flask's request hooks record metrics and profiles for these
+        await call_flask(scope, body, send)
+        return
+
+    profile = RequestProfile(f"{scope['method']} {scope['path']}") if wants_profile(scope) else None
+    recorder = ResponseRecorder(send, profile.id if profile else None)
+    start = time.perf_counter()
+    disconnected = False
+    try:
+        disconnected = await serve_generation(scope, body, CompressingSend(recorder, scope), receive)
+    finally:
+        route = scope["path"]
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=route)
+        # 499: nginx's status for a request the client closed
+        status = "499" if disconnected else str(recorder.status or 500)
+        HTTP_REQUESTS.inc(route=route, method=scope["method"], status=status)
+        HTTP_REQUEST_BYTES.observe(len(body), route=route)
+        HTTP_RESPONSE_BYTES.observe(recorder.bytes, route=route)
+        if profile is not None:
+            profile.finish()
+
+
+async def serve_generation(scope, body, send, receive):
+    """Admission control, disconnect handling and error handling around one generation request
+
+    Returns True if the client disconnected and the generation was cancelled.
+    """
+    # Only the first call builds it (SDK import and configuration); keep that off the loop
+    assistant = await asyncio.to_thread(get_assistant)
+    if not assistant:
+        await send_json(send, 500, {"error": "Study Assistant not available"})
+        return False
+    if not limiter.try_acquire():
+        await send_json(
+            send, 429,
+            {"error": "Server is busy, please retry shortly"},
+            headers=[(b"retry-after", str(RETRY_AFTER).encode("latin-1"))],
+        )
+        return False
+    handler = asyncio.ensure_future(handle_generation(assistant, scope, Request(build_environ(scope, body)), send))
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not handler.done():
+            # Nobody is waiting for the answer: stop generating, which cancels the model calls
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
+            HTTP_DISCONNECTS.inc(route=scope["path"])
+            return True
+        handler.result()
+    except Exception as e:
+        await send_error(send, e)
+    finally:
+        handler.cancel()
+        watcher.cancel()
+        limiter.release()
+    return False
@@ -0,0 +1,74 @@
+"""
+Fingerprinted static assets for Study Assistant
+Every file in static/ is also served under a content-hashed name
+(style.css -> style.3f9c2a1b7d.css) with a one-year immutable Cache-Control
+header: browsers never revalidate it, and a changed file gets a new name.
+url_for('static', ...) in templates produces the hashed names. Text assets are
+compressed once, when the manifest is built.
+"""
+
+import hashlib
+import os
+import threading
+
+from compression import available_encodings, compress, is_compressible
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+CONTENT_TYPES = {
+    ".css": "text/css",
+    ".js": "text/javascript",
+    ".html": "text/html",
+    ".svg": "image/svg+xml",
+    ".json": "application/json",
+}
+
+
+class AssetManifest:
+    """Maps static files to content-hashed names; built on first use"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._hashed = {}  # original name -> hashed name
+        self._originals = {}  # hashed name -> original name
+        self._compressed = {}  # original name -> {encoding: bytes}
+        self._built = False
+        self._lock = threading.Lock()
+
+    def _build(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            for root, _, files in os.walk(self.static_folder):
+                for name in files:
+                    path = os.path.join(root, name)
+                    original = os.path.relpath(path, self.static_folder).replace(os.sep, "/")
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    stem, ext = os.path.splitext(original)
+                    hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+                    self._hashed[original] = hashed
+                    self._originals[hashed] = original
+                    if is_compressible(CONTENT_TYPES.get(ext.lower())):
+                        self._compressed[original] = {encoding: compress(data, encoding) for encoding in available_encodings()}
+            self._built = True
+
+    def hashed_name(self, filename):
+        """The fingerprinted name for a static file (unknown files keep their name)"""
+        self._build()
+        return self._hashed.get(filename, filename)
+
+    def resolve(self, filename):
+        """The original file for a fingerprinted name, or None"""
+        self._build()
+        return self._originals.get(filename)
+
+    def compressed(self, original, encoding):
+        """Precompressed bytes of a text asset, or None"""
+        self._build()
+        return self._compressed.get(original, {}).get(encoding)
+
+    def content_type(self, original):
+        return CONTENT_TYPES.get(os.path.splitext(original)[1].lower())
@@ -0,0 +1,473 @@
+"""
+Model backends for Study Assistant
+A backend turns a prompt into text. GeminiBackend talks to the Gemini API;
+StubBackend is a deterministic local stand-in with configurable latency,
+output size, streaming cadence and error rate, for tests and load tests.
+
+Every backend provides:
+    model_name            name used in cache and coalescing keys
+    generate(prompt)      -> str
+    stream(prompt)        -> iterator of str chunks
+    agenerate(prompt)     -> awaitable str
+    astream(prompt)       -> async iterator of str chunks
+The four calls accept timeout=seconds; a call that runs out of time raises.
+
+Backends that support provider-side context caching also provide
+create_context(content, ttl) -> name, refresh_context(name, ttl) and
+delete_context(name), and accept context=name in the four calls above.
+They may provide forget_context(name) to drop client-side state for a
+handle that is no longer used.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from metrics import record_usage, record_usage_metadata
+from text_chunks import estimate_tokens
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+
+def request_options(timeout):
+    """Gemini SDK keyword arguments for a per-call timeout"""
+    return {"request_options": {"timeout": timeout}} if timeout is not None else {}
+
+
+class GeminiBackend:
+    """Google Gemini backend"""
+
+    def __init__(self, model_name=DEFAULT_MODEL, api_key=None, system_instruction=None, configure_global=True):
+        self.api_key = api_key or os.getenv('GOOGLE_API_KEY')
+        if not self.api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment variables")
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        # Context caching only uses the SDK's process-wide key; in a key pool
+        # (see keypool.py) that is the first key's
+        self.configure_global = configure_global
+        self._genai = None
+        self._clients = None
+        self._model = None
+        self._lock = threading.Lock()
+        # context cache name -> (CachedContent, model bound to it)
+        self._contexts = {}
+
+    @property
+    def genai(self):
+        """The Gemini SDK, imported and configured on first use (importing it takes about a second)"""
+        if self._genai is None:
+            with self._lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    from google.generativeai.client import _ClientManager
+
+                    if self.configure_global:
+                        genai.configure(api_key=self.api_key)
+                    # Generation goes through clients of our own, so several keys can be used side by side
+                    self._clients = _ClientManager()
+                    self._clients.configure(api_key=self.api_key)
+                    self._model = self._bind(genai.GenerativeModel(self.model_name, system_instruction=self.system_instruction))
+                    self._genai = genai
+        return self._genai
+
+    def _bind(self, model):
+        """Make a model call with this backend's API key rather than the process-wide one
+
+        The SDK has no public way to give a model its own client: this sets the
+        private _client / _async_client of google-generativeai 0.8.5, the
+        version pinned in requirements.txt (quick_test.py checks they exist).
+        """
+        if not hasattr(model, "_client") or not hasattr(model, "_async_client"):
+            raise RuntimeError(
+                "This google-generativeai has no GenerativeModel._client; "
+                "install the version pinned in requirements.txt"
+            )
+        model._client = self._clients.get_default_client("generative")
+        return model
+
+    @property
+    def model(self):
+        self.genai
+        return self._model
+
+    def _model_for(self, context):
+        if context is None:
+            return self.model
+        entry = self._contexts.get(context)
+        if entry is None:
+            cached = self.genai.caching.CachedContent.get(context)
+            entry = self._contexts[context] = (cached, self._bind(self.genai.GenerativeModel.from_cached_content(cached)))
+        return entry[1]
+
+    def _amodel_for(self, context):
+        model = self._model_for(context)
+        if model._async_client is None:
+            # Created on first async use, inside the event loop, as the SDK does for its own
+            model._async_client = self._clients.get_default_client("generative_async")
+        return model
+
+    def create_context(self, content, ttl):
+        """Register content (plus the system instruction) with Gemini context caching; returns its name"""
+        cached = self.genai.caching.CachedContent.create(
+            model=self.model_name,
+            system_instruction=self.system_instruction,
+            contents=[content],
+            ttl=timedelta(seconds=ttl),
+        )
+        self._contexts[cached.name] = (cached, self._bind(self.genai.GenerativeModel.from_cached_content(cached)))
+        return cached.name
+
+    def refresh_context(self, name, ttl):
+        cached = self._contexts[name][0] if name in self._contexts else self.genai.caching.CachedContent.get(name)
+        cached.update(ttl=timedelta(seconds=ttl))
+
+    def delete_context(self, name):
+        entry = self._contexts.pop(name, None)
+        cached = entry[0] if entry else self.genai.caching.CachedContent.get(name)
+        cached.delete()
+
+    def forget_context(self, name):
+        """Drop the client-side state for a context handle that is no longer used (it expires on the provider)"""
+        self._contexts.pop(name, None)
+
+    def generate(self, prompt, context=None, timeout=None):
+        response = self._model_for(context).generate_content(prompt, **request_options(timeout))
+        record_usage_metadata(self.model_name, getattr(response, "usage_metadata", None))
+        return response.text
+
+    def stream(self, prompt, context=None, timeout=None):
+        chunk = None
+        for chunk in self._model_for(context).generate_content(prompt, stream=True, **request_options(timeout)):
+            if chunk.text:
+                yield chunk.text
+        # The final chunk carries the usage totals for the whole response
+        record_usage_metadata(self.model_name, getattr(chunk, "usage_metadata", None))
+
+    async def agenerate(self, prompt, context=None, timeout=None):
+        response = await self._amodel_for(context).generate_content_async(prompt, **request_options(timeout))
+        record_usage_metadata(self.model_name, getattr(response, "usage_metadata", None))
+        return response.text
+
+    async def astream(self, prompt, context=None, timeout=None):
+        response = await self._amodel_for(context).generate_content_async(prompt, stream=True, **request_options(timeout))
+        chunk = None
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+        record_usage_metadata(self.model_name, getattr(chunk, "usage_metadata", None))
+
+
+class StubBackendError(Exception):
+    """Simulated upstream failure raised by StubBackend"""
+
+    def __init__(self, message, code=503):
+        super().__init__(message)
+        self.code = code
+
+
+STUB_WORDS = (
+    "learning concept example theory practice method analysis model process "
+    "system principle definition structure function result evidence review "
+    "question answer summary detail context approach study topic key idea"
+).split()
+
+# Question bank top-ups ask for JSON records instead of HTML
+STUB_QUESTION_COUNTS = re.compile(r"Number of questions to write for each type: (.*)")
+# ... and grading prompts a JSON array of grades
+STUB_GRADING_ITEMS = "Answers to grade:\n"
+
+
+class StubBackend:
+    """Deterministic local backend with configurable latency, size, cadence and errors
+
+    latency_ms / latency_dist control time to first chunk:
+        "fixed"      always latency_ms
+        "uniform"    uniform in [latency_ms - jitter_ms, latency_ms + jitter_ms]
+        "normal"     gaussian with mean latency_ms and stddev jitter_ms
+        "lognormal"  long-tailed, median latency_ms, sigma = jitter_ms / latency_ms
+    The rest of the output follows as chunks of chunk_chars every chunk_interval_ms.
+    With quota_rpm set, calls beyond quota_rpm per quota_window seconds fail with
+    a 429, like an API key over its per-minute quota.
+    The text only depends on the prompt, so identical prompts give identical output.
+    Question bank top-up prompts get a JSON array of question records instead,
+    and grading prompts a JSON array of grades scored by word overlap.
+    """
+
+    def __init__(self, model_name="stub", latency_ms=200, latency_dist="fixed", jitter_ms=0,
+                 output_chars=2000, chunk_chars=200, chunk_interval_ms=20, error_rate=0.0, seed=0,
+                 system_instruction=None, quota_rpm=0, quota_window=60.0):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.jitter_ms = jitter_ms
+        self.output_chars = output_chars
+        self.chunk_chars = max(1, chunk_chars)
+        self.chunk_interval_ms = chunk_interval_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        # Simulated API key quota: at most quota_rpm calls per quota_window seconds
+        self.quota_rpm = quota_rpm
+        self.quota_window = quota_window
+        self._quota_calls = deque()
+        self.quota_rejections = 0
+        # context name -> (content, expiry timestamp), like a provider-side context cache
+        self.contexts = {}
+        self.context_calls = 0
+
+    @classmethod
+    def from_env(cls, system_instruction=None, model_name="stub"):
+        """Create a stub backend from STUDY_STUB_* environment variables"""
+        return cls(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            latency_ms=float(os.getenv("STUDY_STUB_LATENCY_MS", "200")),
+            latency_dist=os.getenv("STUDY_STUB_LATENCY_DIST", "fixed"),
+            jitter_ms=float(os.getenv("STUDY_STUB_JITTER_MS", "0")),
+            output_chars=int(os.getenv("STUDY_STUB_OUTPUT_CHARS", "2000")),
+            chunk_chars=int(os.getenv("STUDY_STUB_CHUNK_CHARS", "200")),
+            chunk_interval_ms=float(os.getenv("STUDY_STUB_CHUNK_MS", "20")),
+            error_rate=float(os.getenv("STUDY_STUB_ERROR_RATE", "0")),
+            seed=int(os.getenv("STUDY_STUB_SEED", "0")),
+            quota_rpm=int(os.getenv("STUDY_STUB_KEY_RPM", "0")),
+        )
+
+    def _sample(self):
+        """Return (first chunk delay in seconds, whether this call fails)"""
+        with self._lock:
+            self.calls += 1
+            rng = self._random
+            if self.latency_dist == "uniform":
+                delay = rng.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+            elif self.latency_dist == "normal":
+                delay = rng.gauss(self.latency_ms, self.jitter_ms)
+            elif self.latency_dist == "lognormal":
+                sigma = self.jitter_ms / self.latency_ms if self.latency_ms else 0
+                delay = self.latency_ms * rng.lognormvariate(0, sigma)
+            else:
+                delay = self.latency_ms
+            fails = rng.random() < self.error_rate
+        return max(0.0, delay) / 1000.0, fails
+
+    def _check_quota(self):
+        """Raise a 429, like an API key over its per-minute quota, once quota_rpm calls are in the window"""
+        if not self.quota_rpm:
+            return
+        now = time.monotonic()
+        with self._lock:
+            while self._quota_calls and self._quota_calls[0] <= now - self.quota_window:
+                self._quota_calls.popleft()
+            if len(self._quota_calls) >= self.quota_rpm:
+                self.quota_rejections += 1
+                raise StubBackendError("Simulated quota exceeded (429 Resource Exhausted)", code=429)
+            self._quota_calls.append(now)
+
+    def create_context(self, content, ttl):
+        name = "cachedContents/stub-" + hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self.contexts[name] = (content, time.time() + ttl)
+        return name
+
+    def refresh_context(self, name, ttl):
+        with self._lock:
+            if name not in self.contexts:
+                raise StubBackendError(f"Cached content {name} not found", code=404)
+            self.contexts[name] = (self.contexts[name][0], time.time() + ttl)
+
+    def delete_context(self, name):
+        with self._lock:
+            self.contexts.pop(name, None)
+
+    def _check_context(self, context):
+        """Return the cached context's content ("" for none); raises if it expired"""
+        if context is None:
+            return ""
+        with self._lock:
+            entry = self.contexts.get(context)
+            if entry is None or entry[1] < time.time():
+                raise StubBackendError(f"Cached content {context} not found or expired", code=404)
+            self.context_calls += 1
+            return entry[0]
+
+    def _record_usage(self, prompt, cached, text):
+        """Report estimated token usage, like usage_metadata from a real model"""
+        record_usage(self.model_name, estimate_tokens(prompt), estimate_tokens(text), estimate_tokens(cached))
+
+    def render(self, prompt):
+        """Deterministic HTML output of output_chars characters for a prompt"""
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        rng = random.Random(digest)
+        counts = STUB_QUESTION_COUNTS.search(prompt)
+        if counts:
+            return self._render_questions(rng, counts.group(1))
+        if STUB_GRADING_ITEMS in prompt:
+            return self._render_grades(prompt[prompt.index(STUB_GRADING_ITEMS) + len(STUB_GRADING_ITEMS):])
+        title = " ".join(prompt.split()[:8])
+        parts = [f"<h2>Stub response: {title}</h2>"]
+        size = len(parts[0])
+        while size < self.output_chars:
+            sentence = " ".join(rng.choice(STUB_WORDS) for _ in range(12)).capitalize()
+            paragraph = f"<p>{sentence}.</p>"
+            parts.append(paragraph)
+            size += len(paragraph)
+        return "".join(parts)[:max(self.output_chars, len(parts[0]))]
+
+    @staticmethod
+    def _render_questions(rng, counts):
+        """JSON question records for a question bank top-up prompt"""
+        records = []
+        for qtype, count in re.findall(r"(\w+): (\d+)", counts):
+            for _ in range(int(count)):
+                stem = " ".join(rng.choice(STUB_WORDS) for _ in range(10)).capitalize() + "?"
+                options = {"multiple_choice": [rng.choice(STUB_WORDS) for _ in range(4)], "true_false": ["True", "False"]}.get(qtype, [])
+                records.append({
+                    "type": qtype,
+                    "stem": stem,
+                    "options": options,
+                    "answer": options[0] if options else " ".join(rng.choice(STUB_WORDS) for _ in range(8)),
+                    "explanation": " ".join(rng.choice(STUB_WORDS) for _ in range(12)).capitalize() + ".",
+                    "difficulty": rng.choice(["easy", "medium", "hard"]),
+                })
+        return json.dumps(records)
+
+    @staticmethod
+    def _render_grades(items):
+        """JSON grades for a grading prompt: the share of the reference answer's words in the answer"""
+        grades = []
+        for item in json.JSONDecoder().raw_decode(items)[0]:
+            reference = set(re.findall(r"\w+", item["reference"].lower()))
+            answer = set(re.findall(r"\w+", item["answer"].lower()))
+            score = round(len(reference & answer) / len(reference), 2) if reference else 0.0
+            grades.append({
+                "n": item["n"],
+                "score": score,
+                "correct": score >= 0.5,
+                "feedback": "Covers the reference answer." if score >= 0.5 else "Misses most of the reference answer.",
+            })
+        return json.dumps(grades)
+
+    def _chunks(self, prompt):
+        text = self.render(prompt)
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+
+    def _total_delay(self, first_delay, chunk_count):
+        return first_delay + max(0, chunk_count - 1) * self.chunk_interval_ms / 1000.0
+
+    @staticmethod
+    def _budget(seconds, deadline):
+        """How long to sleep, and whether the call runs out of time during it"""
+        if deadline is None:
+            return seconds, False
+        left = max(0.0, deadline - time.monotonic())
+        return min(seconds, left), seconds > left
+
+    def _sleep(self, seconds, deadline):
+        seconds, timed_out = self._budget(seconds, deadline)
+        time.sleep(seconds)
+        if timed_out:
+            raise StubBackendError("Simulated deadline exceeded (504 Gateway Timeout)", code=504)
+
+    async def _asleep(self, seconds, deadline):
+        seconds, timed_out = self._budget(seconds, deadline)
+        await asyncio.sleep(seconds)
+        if timed_out:
+            raise StubBackendError("Simulated deadline exceeded (504 Gateway Timeout)", code=504)
+
+    def generate(self, prompt, context=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cached = self._check_context(context)
+        self._check_quota()
+        delay, fails = self._sample()
+        chunks = self._chunks(prompt)
+        self._sleep(self._total_delay(delay, len(chunks)), deadline)
+        if fails:
+            raise StubBackendError("Simulated upstream error (503 Service Unavailable)")
+        text = "".join(chunks)
+        self._record_usage(prompt, cached, text)
+        return text
+
+    def stream(self, prompt, context=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cached = self._check_context(context)
+        self._check_quota()
+        delay, fails = self._sample()
+        self._sleep(delay, deadline)
+        if fails:
+            raise StubBackendError("Simulated upstream error (503 Service Unavailable)")
+        chunks = self._chunks(prompt)
+        for index, chunk in enumerate(chunks):
+            if index:
+                self._sleep(self.chunk_interval_ms / 1000.0, deadline)
+            yield chunk
+        self._record_usage(prompt, cached, "".join(chunks))
+
+    async def agenerate(self, prompt, context=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cached = self._check_context(context)
+        self._check_quota()
+        delay, fails = self._sample()
+        chunks = self._chunks(prompt)
+        await self._asleep(self._total_delay(delay, len(chunks)), deadline)
+        if fails:
+            raise StubBackendError("Simulated upstream error (503 Service Unavailable)")
+        text = "".join(chunks)
+        self._record_usage(prompt, cached, text)
+        return text
+
+    async def astream(self, prompt, context=None, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cached = self._check_context(context)
+        self._check_quota()
+        delay, fails = self._sample()
+        await self._asleep(delay, deadline)
+        if fails:
+            raise StubBackendError("Simulated upstream error (503 Service Unavailable)")
+        chunks = self._chunks(prompt)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await self._asleep(self.chunk_interval_ms / 1000.0, deadline)
+            yield chunk
+        self._record_usage(prompt, cached, "".join(chunks))
+
+
+def create_backend(system_instruction=None, model_name=None):
+    """Build the backend selected by STUDY_BACKEND ("gemini" by default, or "stub")
+
+    system_instruction is sent with every call as the model's system prompt.
+    model_name defaults to STUDY_MODEL (Gemini) or "stub".
+
+    With several keys in STUDY_API_KEYS there is one backend per key, behind
+    a KeyPool that balances calls by quota headroom (see keypool.py); stub
+    backends then simulate one key each. Unless STUDY_RESILIENCE=0, it is
+    wrapped in a ResilientBackend (rate limiting, retries, circuit breaker;
+    see resilience.py). With STUDY_HEDGE=1 slow calls are also hedged with a
+    backup call (see hedging.py).
+    """
+    from hedging import HedgedBackend
+    from keypool import KeyPool
+    from resilience import ResilientBackend
+
+    name = os.getenv("STUDY_BACKEND", "gemini").lower()
+    if name not in ("stub", "gemini"):
+        raise ValueError(f"Unknown STUDY_BACKEND: {name}")
+
+    def build(api_key=None, primary=True):
+        if name == "stub":
+            return StubBackend.from_env(system_instruction=system_instruction, model_name=model_name or "stub")
+        return GeminiBackend(model_name or os.getenv("STUDY_MODEL", DEFAULT_MODEL), api_key=api_key,
+                             system_instruction=system_instruction, configure_global=primary)
+
+    backend = KeyPool.from_env(build) or build()
+    if os.getenv("STUDY_RESILIENCE", "1").lower() not in ("0", "false", "no", "off"):
+        backend = ResilientBackend.from_env(backend)
+    return HedgedBackend.from_env(backend) or backend
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for Study Assistant
+Drives the real app.py routes at a configurable concurrency and reports
+throughput and p50/p95/p99 latency per endpoint as JSON, so results can be
+stored and compared offline.
+
+By default the app runs in-process on the stub model backend (no API key
+needed, no network); use --url to benchmark a running server instead.
+
+Examples:
+    python benchmark.py load --concurrency 16 --requests 200
+    python benchmark.py load --endpoints create_guide,summarize_text --stream
+    python benchmark.py load --url http://localhost:8000 --output bench.json
+    python benchmark.py startup --runs 10 --import-profile 15
+    python benchmark.py sections --runs 5 --guide-chars 12000
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+SAMPLE_TEXT = (
+    "Photosynthesis is the process by which green plants use sunlight to synthesize "
+    "nutrients from carbon dioxide and water. It takes place mainly in the leaves, "
+    "inside chloroplasts that contain the pigment chlorophyll. "
+)
+
+# endpoint name -> (path, payload builder, body kind)
+ENDPOINTS = {
+    "create_guide": ("/create_guide", lambda i: {"topic": f"Benchmark Topic {i}", "level": "intermediate"}, "json"),
+    "generate_questions": ("/generate_questions", lambda i: {"topic": f"Benchmark Topic {i}", "num_questions": 5}, "json"),
+    "explain_topic": ("/explain_topic", lambda i: {"topic": f"Benchmark Topic {i}", "difficulty_level": "beginner"}, "json"),
+    "summarize_text": ("/summarize_text", lambda i: {"text": f"Document {i}. " + SAMPLE_TEXT * 20, "summary_type": "brief"}, "json"),
+    "submit_assignment": ("/submit_assignment", lambda i: {"assignment_name": f"Essay {i}", "details": "Discuss the topic."}, "form"),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_samples(samples):
+    """Latency statistics in milliseconds"""
+    if not samples:
+        return {}
+    return {
+        "p50": round(percentile(samples, 50), 2),
+        "p95": round(percentile(samples, 95), 2),
+        "p99": round(percentile(samples, 99), 2),
+        "mean": round(sum(samples) / len(samples), 2),
+        "max": round(max(samples), 2),
+    }
+
+
+class InProcessClient:
+    """Sends requests to app.py through Flask's test client"""
+
+    def __init__(self):
+        # app.py prints status lines; keep stdout clean for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            from app import app, get_assistant
+            get_assistant()
+        self.app = app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def request(self, path, payload, kind, stream):
+        """Return (status, time to first byte in seconds, total seconds)"""
+        headers = {"Accept": "text/event-stream" if stream else "application/json"}
+        start = time.perf_counter()
+        kwargs = {"json": payload} if kind == "json" else {"data": payload}
+        response = self._client().post(path, headers=headers, buffered=False, **kwargs)
+        first_byte = None
+        for chunk in response.response:
+            if first_byte is None and chunk:
+                first_byte = time.perf_counter() - start
+        response.close()
+        total = time.perf_counter() - start
+        return response.status_code, first_byte if first_byte is not None else total, total
+
+
+class HTTPClient:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, path, payload, kind, stream):
+        if kind == "json":
+            body = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        else:
+            body = urllib.parse.urlencode(payload).encode("utf-8")
+            content_type = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(self.base_url + path, data=body, method="POST", headers={
+            "Content-Type": content_type,
+            "Accept": "text/event-stream" if stream else "application/json",
+        })
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                status = response.status
+                response.read(1)
+                first_byte = time.perf_counter() - start
+                while response.read(65536):
+                    pass
+        except urllib.error.HTTPError as e:
+            status = e.code
+            first_byte = time.perf_counter() - start
+        total = time.perf_counter() - start
+        return status, first_byte, total
+
+
+def run_endpoint(client, name, requests, concurrency, stream):
+    """Fire `requests` calls at one endpoint with `concurrency` workers"""
+    path, make_payload, kind = ENDPOINTS[name]
+    latencies, ttfbs, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def one(i):
+        try:
+            status, first_byte, total = client.request(path, make_payload(i), kind, stream)
+        except Exception as e:
+            status, first_byte, total = type(e).__name__, None, None
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(total * 1000)
+                ttfbs.append(first_byte * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    ok = statuses.get("200", 0)
+    return {
+        "path": path,
+        "requests": requests,
+        "ok": ok,
+        "errors": requests - ok,
+        "statuses": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(ok / wall, 2) if wall else None,
+        "latency_ms": summarize_samples(latencies),
+        "ttfb_ms": summarize_samples(ttfbs),
+    }
+
+
+def cmd_load(args):
+    """Load test the generation endpoints"""
+    if not args.url:
+        # Configure the in-process app before it is imported
+        os.environ["STUDY_BACKEND"] = args.backend
+        if not args.cache:
+            os.environ["STUDY_CACHE_ENABLED"] = "0"
+            os.environ["STUDY_COALESCE"] = "0"
+            os.environ["STUDY_TOPIC_MATCHING"] = "0"
+        client = InProcessClient()
+    else:
+        client = HTTPClient(args.url)
+
+    names = [n.strip() for n in args.endpoints.split(",") if n.strip()]
+    unknown = [n for n in names if n not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        if args.warmup:
+            run_endpoint(client, name, args.warmup, min(args.concurrency, args.warmup), args.stream)
+        results[name] = run_endpoint(client, name, args.requests, args.concurrency, args.stream)
+        print_row(name, results[name])
+
+    return {
+        "benchmark": "load",
+        "config": {
+            "target": args.url or "in-process",
+            "backend": None if args.url else os.environ.get("STUDY_BACKEND"),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "stream": args.stream,
+            "cache": args.cache,
+        },
+        "endpoints": results,
+    }
+
+
+# Runs in a fresh interpreter per sample; prints one JSON line of timings
+STARTUP_PROBE = r"""
+import contextlib, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(sys.stderr):
+    import app
+imported = time.perf_counter()
+sdk_at_import = "google.generativeai" in sys.modules
+client = app.app.test_client()
+with contextlib.redirect_stdout(sys.stderr):
+    page = client.get("/")
+    first = client.post("/explain_topic", json={"topic": "Startup probe", "difficulty_level": "beginner"})
+served = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "first_request_s": served - imported,
+    "ready_s": served - start,
+    "page_status": page.status_code,
+    "status": first.status_code,
+    "sdk_imported_at_import": sdk_at_import,
+}))
+"""
+
+
+def import_profile(env, top):
+    """Slowest modules by cumulative import time, from python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 2)} for us, name in rows[:top]]
+
+
+def cmd_startup(args):
+    """Cold start: import time and time to the first served request, each in a fresh process"""
+    env = dict(os.environ, STUDY_BACKEND=args.backend, STUDY_STUB_LATENCY_MS="0", STUDY_STUB_CHUNK_MS="0",
+               STUDY_CACHE_ENABLED="0")
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(args.runs):
+        # Run from another directory, as a process manager would
+        result = subprocess.run(
+            [sys.executable, "-c", f"import sys; sys.path.insert(0, {here!r})\n" + STARTUP_PROBE],
+            capture_output=True, text=True, env=env, cwd=tempfile.gettempdir(),
+        )
+        if result.returncode != 0:
+            raise SystemExit(f"Startup probe failed:\n{result.stderr}")
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    def stats(field):
+        return summarize_samples([sample[field] * 1000 for sample in samples])
+
+    report = {
+        "benchmark": "startup",
+        "config": {"backend": args.backend, "runs": args.runs},
+        "import_ms": stats("import_s"),
+        "first_request_ms": stats("first_request_s"),
+        "ready_ms": stats("ready_s"),
+        "statuses": sorted({sample["status"] for sample in samples}),
+        "sdk_imported_at_import": any(sample["sdk_imported_at_import"] for sample in samples),
+    }
+    if args.import_profile:
+        report["slowest_imports"] = import_profile(env, args.import_profile)
+    print(
+        f"import p50={report['import_ms']['p50']}ms  first request p50={report['first_request_ms']['p50']}ms  "
+        f"ready p50={report['ready_ms']['p50']}ms",
+        file=sys.stderr,
+    )
+    return report
+
+
+def cmd_sections(args):
+    """Study guide wall time and time to first chunk: one call versus concurrent per-section calls"""
+    with contextlib.redirect_stdout(sys.stderr):
+        from backends import StubBackend, create_backend
+        from study_assistant import StudyAssistant, STUDY_GUIDE_SECTIONS, load_prompts
+
+    system_prompt = load_prompts()["system_prompt"]
+    if args.backend == "stub":
+        # Same total output either way: each section is a sixth of the whole guide
+        stub = dict(latency_ms=args.latency_ms, chunk_chars=args.chunk_chars, chunk_interval_ms=args.chunk_ms)
+        backends = {
+            "single": StubBackend(output_chars=args.guide_chars, **stub),
+            "sectional": StubBackend(output_chars=args.guide_chars // len(STUDY_GUIDE_SECTIONS), **stub),
+        }
+    else:
+        os.environ["STUDY_BACKEND"] = args.backend
+        shared = create_backend(system_instruction=system_prompt)
+        backends = {"single": shared, "sectional": shared}
+
+    results = {}
+    for mode, backend in backends.items():
+        assistant = StudyAssistant(backend=backend)
+        walls, firsts, sizes = [], [], []
+        for run in range(args.runs):
+            start = time.perf_counter()
+            first = None
+            size = 0
+            for chunk in assistant.create_study_guide(f"{args.topic} {run}", stream=True, sectional=mode == "sectional"):
+                if first is None and chunk:
+                    first = time.perf_counter() - start
+                size += len(chunk)
+            walls.append((time.perf_counter() - start) * 1000)
+            firsts.append((first or 0) * 1000)
+            sizes.append(size)
+        results[mode] = {
+            "wall_ms": summarize_samples(walls),
+            "first_chunk_ms": summarize_samples(firsts),
+            "output_chars": round(sum(sizes) / len(sizes)),
+        }
+
+    single, sectional = results["single"]["wall_ms"]["p50"], results["sectional"]["wall_ms"]["p50"]
+    report = {
+        "benchmark": "sections",
+        "config": {
+            "backend": args.backend,
+            "runs": args.runs,
+            "sections": len(STUDY_GUIDE_SECTIONS),
+            "guide_chars": args.guide_chars if args.backend == "stub" else None,
+        },
+        **results,
+        "wall_saving_ms": round(single - sectional, 1),
+        "wall_saving_pct": round(100.0 * (single - sectional) / single, 1) if single else None,
+    }
+    print(
+        f"single p50={single}ms  sectional p50={sectional}ms  saving={report['wall_saving_pct']}%",
+        file=sys.stderr,
+    )
+    return report
+
+
+def print_row(name, result):
+    """Human-readable progress line on stderr"""
+    latency = result["latency_ms"] or {}
+    print(
+        f"{name:<20} ok={result['ok']:<5} err={result['errors']:<4} "
+        f"rps={result['throughput_rps']!s:<8} p50={latency.get('p50')}ms "
+        f"p95={latency.get('p95')}ms p99={latency.get('p99')}ms",
+        file=sys.stderr,
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Study Assistant benchmark suite")
+    parser.add_argument("--output", help="write the JSON report to this file (default: stdout)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="load test the generation endpoints")
+    load.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    load.add_argument("--backend", default="stub", help="in-process model backend (default: stub)")
+    load.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated endpoint names")
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    load.add_argument("--warmup", type=int, default=0, help="untimed requests per endpoint before measuring")
+    load.add_argument("--stream", action="store_true", help="request Server-Sent Events and measure time to first byte")
+    load.add_argument("--cache", action="store_true", help="keep the response cache and coalescing enabled")
+    load.set_defaults(func=cmd_load)
+
+    startup = sub.add_parser("startup", help="measure cold start in fresh processes")
+    startup.add_argument("--backend", default="stub", help="model backend (default: stub)")
+    startup.add_argument("--runs", type=int, default=5, help="number of fresh processes")
+    startup.add_argument("--import-profile", type=int, default=0, metavar="N",
+                         help="also list the N slowest imports (python -X importtime)")
+    startup.set_defaults(func=cmd_startup)
+
+    sections = sub.add_parser("sections", help="compare single-call and sectional study guides")
+    sections.add_argument("--backend", default="stub", help="model backend (default: stub)")
+    sections.add_argument("--runs", type=int, default=3, help="study guides per mode")
+    sections.add_argument("--topic", default="Benchmark Topic", help="topic prefix (a run number is appended)")
+    sections.add_argument("--guide-chars", type=int, default=12000, help="stub: total characters per guide")
+    sections.add_argument("--latency-ms", type=float, default=200, help="stub: time to first chunk per call")
+    sections.add_argument("--chunk-chars", type=int, default=200, help="stub: characters per streamed chunk")
+    sections.add_argument("--chunk-ms", type=float, default=20, help="stub: milliseconds between chunks")
+    sections.set_defaults(func=cmd_sections)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = args.func(args)
+    report["timestamp"] = datetime.now(timezone.utc).isoformat()
+    report["environment"] = {"python": platform.python_version(), "platform": platform.platform()}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
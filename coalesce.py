@@ -0,0 +1,284 @@
+"""
+Single-flight request coalescing for Study Assistant
+Concurrent calls that share a key (the rendered prompt) wait for one
+upstream call and share its result. Works across threads and asyncio tasks
+and, with a SQLite file, across worker processes on the same machine.
+
+In asyncio the shared call runs as its own task: a caller that is cancelled
+(its client disconnected) or times out just stops waiting, and the call is
+only cancelled once nobody is waiting for it any more.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def make_flight_key(prompt, model_name):
+    """Key identifying one upstream call
+
+    Only the ends of the prompt are stripped: case and layout inside it can
+    matter (code in reference files, free-text answers being graded), and
+    topic variations are already folded before the prompt is built.
+    """
+    payload = f"{model_name}\n{prompt.strip()}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One in-progress upstream call inside this process"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _AsyncFlight:
+    """One in-progress upstream call inside this event loop, and how many callers await it
+
+    wait_until is the latest time.monotonic() any of its callers will wait
+    until; a wait on another process's call gives up then.
+    """
+
+    def __init__(self, wait_until):
+        self.task = None
+        self.waiters = 0
+        self.wait_until = wait_until
+
+
+class SingleFlight:
+    """Collapse concurrent identical calls into one
+
+    db_path enables the cross-process rendezvous: the first process to claim a
+    key in the SQLite file runs the call, the others poll for its result.
+    """
+
+    def __init__(self, db_path=None, wait_timeout=300, lease=300, poll_interval=0.05, result_ttl=60):
+        self.db_path = db_path
+        self.wait_timeout = wait_timeout
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        self._local = threading.local()
+        self._counters = {
+            "calls": 0,
+            "upstream_calls": 0,
+            "collapsed": 0,
+            "collapsed_cross_process": 0,
+        }
+        if self.db_path:
+            self._init_db()
+
+    @classmethod
+    def from_env(cls):
+        """Create a coalescer from STUDY_COALESCE* environment variables, or None when disabled"""
+        if os.getenv("STUDY_COALESCE", "1").lower() in ("0", "false", "no"):
+            return None
+        return cls(db_path=os.getenv("STUDY_COALESCE_DB") or None)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def stats(self):
+        """Return how many calls were made and how many were collapsed"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._flights) + len(self._async_flights)
+        collapsed = stats["collapsed"] + stats["collapsed_cross_process"]
+        stats["collapse_rate"] = round(collapsed / stats["calls"], 4) if stats["calls"] else 0.0
+        return stats
+
+    # Cross-process rendezvous
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS flights (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS flight_results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _claim(self, key):
+        """Try to become the process that runs key; True on success"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("DELETE FROM flights WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO flights (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, self.owner, now + self.lease),
+        )
+        return cursor.rowcount == 1
+
+    def _publish(self, key, value):
+        """Share the leader's result with waiting processes and release the claim"""
+        conn = self._connect()
+        now = time.time()
+        if value is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO flight_results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + self.result_ttl),
+            )
+        conn.execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, self.owner))
+        conn.execute("DELETE FROM flight_results WHERE expires_at <= ?", (now,))
+
+    def _poll(self, key):
+        """Return ("done", value), ("abandoned", None) or ("waiting", None) for a key led elsewhere"""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM flight_results WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is not None:
+            return "done", row[0]
+        row = conn.execute("SELECT 1 FROM flights WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+        return ("waiting", None) if row is not None else ("abandoned", None)
+
+    def _wait_until(self, timeout):
+        """The time.monotonic() a caller allowing timeout seconds stops waiting (at most wait_timeout)"""
+        return time.monotonic() + (self.wait_timeout if timeout is None else min(timeout, self.wait_timeout))
+
+    def _wait_elsewhere(self, key, deadline):
+        """Wait for another process's call; ("claimed", None) if it gave up and we took over"""
+        while True:
+            state, value = self._poll(key)
+            if state == "done" or (state == "abandoned" and self._claim(key)):
+                return ("done", value) if state == "done" else ("claimed", None)
+            if time.monotonic() >= deadline:
+                raise TimeoutError("Timed out waiting for an identical request in another process")
+            time.sleep(self.poll_interval)
+
+    async def _await_elsewhere(self, key, flight):
+        """Async version of _wait_elsewhere; waits until the flight's wait_until, off the event loop"""
+        while True:
+            state, value = await asyncio.to_thread(self._poll, key)
+            if state == "done" or (state == "abandoned" and await asyncio.to_thread(self._claim, key)):
+                return ("done", value) if state == "done" else ("claimed", None)
+            if time.monotonic() >= flight.wait_until:
+                raise TimeoutError("Timed out waiting for an identical request in another process")
+            await asyncio.sleep(self.poll_interval)
+
+    # Thread API
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once for all concurrent callers with the same key and return its result
+
+        timeout bounds how long a caller waits for someone else's call.
+        """
+        self._count("calls")
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self._count("collapsed")
+            if not flight.done.wait(self._wait_until(timeout) - time.monotonic()):
+                raise TimeoutError("Timed out waiting for an identical in-flight request")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._lead(key, fn, self._wait_until(timeout))
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result
+
+    def _lead(self, key, fn, deadline):
+        if not self.db_path:
+            self._count("upstream_calls")
+            return fn()
+        if not self._claim(key):
+            state, value = self._wait_elsewhere(key, deadline)
+            if state == "done":
+                self._count("collapsed_cross_process")
+                return value
+        result = None
+        try:
+            self._count("upstream_calls")
+            result = fn()
+            return result
+        finally:
+            self._publish(key, result if isinstance(result, str) else None)
+
+    # Asyncio API
+
+    async def ado(self, key, coro_fn, timeout=None):
+        """Async version of do(): await coro_fn() once for all concurrent tasks with the same key
+
+        timeout bounds how long a caller waits for another process's call.
+        """
+        self._count("calls")
+        wait_until = self._wait_until(timeout)
+        flight = self._async_flights.get(key)
+        if flight is None:
+            flight = self._async_flights[key] = _AsyncFlight(wait_until)
+            flight.task = asyncio.ensure_future(self._alead(key, coro_fn, flight))
+            flight.task.add_done_callback(lambda task: self._landed(key, flight))
+        else:
+            self._count("collapsed")
+            flight.wait_until = max(flight.wait_until, wait_until)
+        flight.waiters += 1
+        try:
+            # shield: a caller that gives up must not cancel the call for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody wants the result any more; stop paying for it
+                if self._async_flights.get(key) is flight:
+                    del self._async_flights[key]
+                flight.task.cancel()
+
+    def _landed(self, key, flight):
+        if self._async_flights.get(key) is flight:
+            del self._async_flights[key]
+        if not flight.task.cancelled():
+            # Mark the exception as retrieved when nobody was left to see it
+            flight.task.exception()
+
+    async def _alead(self, key, coro_fn, flight):
+        if not self.db_path:
+            self._count("upstream_calls")
+            return await coro_fn()
+        if not await asyncio.to_thread(self._claim, key):
+            state, value = await self._await_elsewhere(key, flight)
+            if state == "done":
+                self._count("collapsed_cross_process")
+                return value
+        result = None
+        try:
+            self._count("upstream_calls")
+            result = await coro_fn()
+            return result
+        finally:
+            # Runs to the end in its thread even if this task is cancelled meanwhile
+            await asyncio.to_thread(self._publish, key, result if isinstance(result, str) else None)
@@ -0,0 +1,86 @@
+"""
+Response compression for Study Assistant
+Negotiates brotli or gzip from Accept-Encoding for text responses (JSON, HTML,
+CSS, JavaScript). Brotli is used when the optional `brotli` package is
+installed; otherwise gzip. Streamed (Server-Sent Events) responses are left
+alone so every event still reaches the client as soon as it is written.
+"""
+
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/html", "text/css", "text/plain", "text/javascript",
+    "application/javascript", "application/json", "image/svg+xml",
+)
+
+# Bodies smaller than this aren't worth the CPU (or the extra header bytes)
+MIN_SIZE = int(os.getenv("STUDY_COMPRESS_MIN_BYTES", "1024"))
+
+
+def compression_enabled():
+    return os.getenv("STUDY_COMPRESSION", "1").lower() not in ("0", "false", "no", "off")
+
+
+def is_compressible(mimetype):
+    return (mimetype or "").split(";")[0].strip().lower() in COMPRESSIBLE_TYPES
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding):
+    """Pick the best supported encoding the client accepts, or None"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+class CompressedBodies:
+    """Small LRU of compressed bodies keyed by (ETag, encoding), for repeated GETs"""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag, data, encoding):
+        key = (etag, encoding)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        body = compress(data, encoding)
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body
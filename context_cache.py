@@ -0,0 +1,139 @@
+"""
+Provider-side context caching for Study Assistant
+Large content that is sent again and again (reference files reused across
+assignment revisions) is registered once with the provider's context cache,
+together with the system instruction, and later calls refer to it by handle
+instead of paying for its tokens every time. Handles expire on the provider,
+so their TTLs are tracked here: a handle close to expiry is refreshed, an
+expired one is replaced. When a handle is dropped, its backend is told to
+forget_context() it, so the backend doesn't hold its client-side state forever.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from text_chunks import estimate_tokens
+
+
+class ContextCache:
+    """Local registry of provider context-cache handles, keyed by content"""
+
+    def __init__(self, ttl=3600, refresh_margin=300, min_tokens=1024):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        # Providers refuse (or don't discount) small contexts
+        self.min_tokens = min_tokens
+        self._handles = {}  # key -> {"name": ..., "expires_at": ..., "backend": ...}
+        self._locks = {}  # key -> [lock, threads holding or waiting for it]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls):
+        """Create a context cache from STUDY_CONTEXT_CACHE* environment variables, or None when disabled"""
+        if os.getenv("STUDY_CONTEXT_CACHE", "0").lower() in ("0", "false", "no", "off"):
+            return None
+        return cls(
+            ttl=float(os.getenv("STUDY_CONTEXT_CACHE_TTL", "3600")),
+            refresh_margin=float(os.getenv("STUDY_CONTEXT_CACHE_REFRESH", "300")),
+            min_tokens=int(os.getenv("STUDY_CONTEXT_CACHE_MIN_TOKENS", "1024")),
+        )
+
+    @staticmethod
+    def _key(backend, content):
+        system = getattr(backend, "system_instruction", None) or ""
+        raw = "\x00".join([backend.model_name, system, content])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _forget(handle):
+        forget = getattr(handle["backend"], "forget_context", None)
+        if forget is not None:
+            forget(handle["name"])
+
+    @contextmanager
+    def _key_lock(self, key):
+        """Hold key's lock; the entry lives exactly as long as some thread holds or waits for it"""
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def acquire(self, backend, content):
+        """Return a context handle for content, or None to send it inline
+
+        None is returned for content below min_tokens, for backends without
+        context caching, and when the provider call fails.
+        """
+        if not content or estimate_tokens(content) < self.min_tokens or not hasattr(backend, "create_context"):
+            return None
+        key = self._key(backend, content)
+        # One creation per content at a time; other keys are not blocked
+        with self._key_lock(key):
+            now = time.time()
+            handle = self._handles.get(key)
+            if handle is not None and handle["expires_at"] - now > self.refresh_margin:
+                with self._lock:
+                    self.hits += 1
+                return handle["name"]
+            try:
+                if handle is not None and handle["expires_at"] > now:
+                    backend.refresh_context(handle["name"], self.ttl)
+                    with self._lock:
+                        self.refreshed += 1
+                else:
+                    if handle is not None:
+                        self._forget(handle)
+                    handle = {"name": backend.create_context(content, self.ttl), "backend": backend}
+                    with self._lock:
+                        self.created += 1
+            except Exception:
+                stale = self._handles.pop(key, None)
+                if stale is not None:
+                    self._forget(stale)
+                with self._lock:
+                    self.errors += 1
+                return None
+            handle["expires_at"] = now + self.ttl
+            self._handles[key] = handle
+            self._sweep(now)
+            return handle["name"]
+
+    def invalidate(self, name):
+        """Forget a handle the provider no longer recognizes"""
+        with self._lock:
+            dropped = [self._handles.pop(key) for key, handle in list(self._handles.items()) if handle["name"] == name]
+        for handle in dropped:
+            self._forget(handle)
+
+    def _sweep(self, now):
+        with self._lock:
+            dropped = []
+            for key, handle in list(self._handles.items()):
+                if handle["expires_at"] <= now:
+                    dropped.append(self._handles.pop(key))
+        for handle in dropped:
+            self._forget(handle)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "handles": len(self._handles),
+                "hits": self.hits,
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "errors": self.errors,
+            }
@@ -0,0 +1,270 @@
+"""
+Reference file text extraction for Study Assistant
+Turns uploaded .txt, .pdf, .docx and .doc files into plain text. Binary
+formats are parsed in a process pool so several uploads are extracted in
+parallel, off the request thread, with per-file time and memory limits.
+Extracted text is cached on disk by content hash and file type, so
+re-uploading the same file costs nothing.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+
+from response_cache import CACHE_DIR
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class ExtractionError(Exception):
+    """A reference file could not be turned into text"""
+
+
+# Format parsers. These run inside pool workers, so they must stay picklable
+# module-level functions.
+
+def extract_txt(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+
+def extract_docx(path):
+    """Read paragraphs from word/document.xml; no third-party dependency needed"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            xml = archive.read("word/document.xml")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ExtractionError(f"Not a valid .docx file: {e}")
+    root = ElementTree.fromstring(xml)
+    paragraphs = []
+    for paragraph in root.iter(f"{WORD_NS}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{WORD_NS}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{WORD_NS}tab":
+                parts.append("\t")
+            elif node.tag in (f"{WORD_NS}br", f"{WORD_NS}cr"):
+                parts.append("\n")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+
+def extract_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("PDF support requires the 'pypdf' package (pip install pypdf)")
+    try:
+        reader = PdfReader(path)
+        return "\n\n".join((page.extract_text() or "") for page in reader.pages)
+    except Exception as e:
+        raise ExtractionError(f"Could not read PDF: {e}")
+
+
+def extract_doc(path):
+    """Legacy Word files: use antiword when installed, else pull out readable text runs"""
+    if shutil.which("antiword"):
+        result = subprocess.run(["antiword", path], capture_output=True, timeout=60)
+        if result.returncode == 0:
+            return result.stdout.decode("utf-8", errors="replace")
+    with open(path, "rb") as f:
+        data = f.read()
+    # Word 97-2003 stores most text as UTF-16LE; fall back to 8-bit runs
+    runs = re.findall(rb"(?:[\x20-\x7e\r\n\t]\x00){4,}", data)
+    text = "\n".join(run.decode("utf-16-le") for run in runs)
+    if not text.strip():
+        runs = re.findall(rb"[\x20-\x7e\r\n\t]{8,}", data)
+        text = "\n".join(run.decode("latin-1") for run in runs)
+    return text
+
+
+PARSERS = {
+    "txt": extract_txt,
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "doc": extract_doc,
+}
+
+
+def _pool_context():
+    """Start workers from a clean interpreter: forking a multithreaded server can copy held locks"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _limit_worker(max_memory_mb):
+    """Pool initializer: cap each worker's address space"""
+    if resource is not None and max_memory_mb:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _timeout_handler(signum, frame):
+    raise ExtractionError("Extraction timed out")
+
+
+def _extract_in_worker(path, extension, timeout):
+    """Run one parser in a pool worker; returns (text, seconds)"""
+    import signal
+
+    start = time.perf_counter()
+    use_alarm = hasattr(signal, "SIGALRM") and timeout
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _timeout_handler)
+        signal.alarm(int(timeout) or 1)
+    try:
+        text = PARSERS[extension](path)
+    except MemoryError:
+        raise ExtractionError("Extraction exceeded the memory limit")
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+    return text, time.perf_counter() - start
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Extractor:
+    """Extract text from many files in parallel, with a content-hash cache"""
+
+    def __init__(self, workers=None, timeout=30, max_memory_mb=512, cache_dir=None):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.cache_dir = cache_dir
+        self._pool = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Create an extractor from STUDY_EXTRACT_* environment variables"""
+        return cls(
+            workers=int(os.getenv("STUDY_EXTRACT_WORKERS", "0")) or None,
+            timeout=float(os.getenv("STUDY_EXTRACT_TIMEOUT", "30")),
+            max_memory_mb=int(os.getenv("STUDY_EXTRACT_MAX_MEMORY_MB", "512")),
+            cache_dir=os.getenv("STUDY_EXTRACT_CACHE_DIR", os.path.join(CACHE_DIR, "extracted")),
+        )
+
+    def _get_pool(self):
+        # Created on first use so importing the app does not spawn processes
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=_pool_context(),
+                initializer=_limit_worker,
+                initargs=(self.max_memory_mb,),
+            )
+        return self._pool
+
+    def _reset_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def shutdown(self):
+        self._reset_pool()
+
+    def _cache_path(self, sha256, extension):
+        # The same bytes parse differently as .txt and as .doc
+        return os.path.join(self.cache_dir, f"{sha256}.{extension}.txt")
+
+    def _cached(self, sha256, extension):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(sha256, extension), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, sha256, extension, text):
+        if not self.cache_dir:
+            return
+        path = self._cache_path(sha256, extension)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def extract_many(self, paths, names=None, digests=None):
+        """Extract every file; returns one result dict per path, in order
+
+        names are the original filenames (the file type comes from them; by
+        default the path's basename), and digests their SHA-256 if already
+        known. Each result has filename, text, error, seconds, cached and sha256.
+        """
+        results = []
+        pending = []
+        for index, path in enumerate(paths):
+            filename = names[index] if names else os.path.basename(path)
+            extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+            result = {"filename": filename, "text": "", "error": None, "seconds": 0.0, "cached": False, "sha256": None}
+            results.append(result)
+            if extension not in PARSERS:
+                result["error"] = f"Unsupported file type: .{extension}"
+                continue
+            start = time.perf_counter()
+            result["sha256"] = digests[index] if digests else file_sha256(path)
+            cached = self._cached(result["sha256"], extension)
+            if cached is not None:
+                result.update(text=cached, cached=True, seconds=time.perf_counter() - start)
+            elif extension == "txt":
+                # Plain text is cheap to decode; not worth a trip to the pool
+                result["text"] = extract_txt(path)
+                result["seconds"] = time.perf_counter() - start
+                self._store(result["sha256"], extension, result["text"])
+            else:
+                pending.append((result, path, extension))
+
+        if pending:
+            pool = self._get_pool()
+            futures = [(result, extension, pool.submit(_extract_in_worker, path, extension, self.timeout))
+                       for result, path, extension in pending]
+            broken = False
+            for result, extension, future in futures:
+                try:
+                    # The worker enforces the timeout itself; this is a backstop
+                    text, seconds = future.result(timeout=self.timeout + 5)
+                    result.update(text=text, seconds=seconds)
+                    self._store(result["sha256"], extension, text)
+                except FutureTimeoutError:
+                    result["error"] = "Extraction timed out"
+                    broken = True
+                except BrokenProcessPool:
+                    result["error"] = "Extraction worker crashed (file too large or malformed?)"
+                    broken = True
+                except Exception as e:
+                    result["error"] = str(e)
+            if broken:
+                # A hung or dead worker poisons the pool; start fresh next time
+                self._reset_pool()
+
+        for result in results:
+            result["seconds"] = round(result["seconds"], 4)
+        return results
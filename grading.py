@@ -0,0 +1,179 @@
+"""
+Answer grading for Study Assistant
+Multiple-choice and true/false answers are graded locally against the answer
+key stored with each question bank question: no model call, microseconds per
+answer. Only short-answer and essay answers need judgement; they are sent to
+the model several to a call.
+"""
+
+import json
+import re
+import time
+
+from metrics import REGISTRY
+
+# Question types graded against the key without the model
+LOCAL_TYPES = ("multiple_choice", "true_false")
+
+GRADING_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+GRADED = REGISTRY.counter(
+    "study_graded_answers_total", "Answers graded by question type and grader (local or model)", ("type", "grader"))
+GRADING_LATENCY = REGISTRY.histogram(
+    "study_grading_seconds", "Time to grade an answer (model: its whole batch call)", ("grader",), GRADING_BUCKETS)
+
+TRUE_WORDS = {"true", "t", "yes", "y", "1", "correct", "right"}
+FALSE_WORDS = {"false", "f", "no", "n", "0", "incorrect", "wrong"}
+
+# "B) ...", "(b) ...", "c. ...", "D: ..."
+_OPTION_LABEL = re.compile(r"^\s*\(?([A-Za-z])\s*[\).:]\s*")
+_BARE_LABEL = re.compile(r"^\s*\(?([A-Za-z])\)?\s*$")
+
+
+def _normalize(text):
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def option_index(options, value):
+    """Index of the option an answer (or key) refers to, by its text or its letter; None if neither"""
+    text = str(value)
+    wanted = _normalize(_OPTION_LABEL.sub("", text))
+    for index, option in enumerate(options):
+        if _normalize(_OPTION_LABEL.sub("", option)) == wanted:
+            return index
+    label = _BARE_LABEL.match(text) or _OPTION_LABEL.match(text)
+    if label:
+        index = ord(label.group(1).lower()) - ord("a")
+        if 0 <= index < len(options):
+            return index
+    return None
+
+
+def truth_value(value):
+    """True or False for a true/false answer ("T", "yes", "False" ...), None if it is neither"""
+    word = _normalize(value)
+    if word in TRUE_WORDS:
+        return True
+    if word in FALSE_WORDS:
+        return False
+    return None
+
+
+def is_correct(question, answer):
+    """Whether an answer to a multiple-choice or true/false question matches the key"""
+    if question["type"] == "true_false":
+        expected, given = truth_value(question["answer"]), truth_value(answer)
+    else:
+        expected, given = option_index(question["options"], question["answer"]), option_index(question["options"], answer)
+    if expected is None:
+        # A key that names no option: compare the text
+        return _normalize(question["answer"]) == _normalize(answer)
+    return given == expected
+
+
+def grade_locally(question, answer):
+    """Grade one objective answer; returns its result record"""
+    start = time.perf_counter()
+    correct = is_correct(question, answer)
+    seconds = time.perf_counter() - start
+    GRADED.inc(type=question["type"], grader="local")
+    GRADING_LATENCY.observe(seconds, grader="local")
+    return {
+        "question_id": question["id"],
+        "type": question["type"],
+        "graded_by": "local",
+        "correct": correct,
+        "score": 1.0 if correct else 0.0,
+        "expected": question["answer"],
+        "explanation": question["explanation"],
+        "seconds": seconds,
+    }
+
+
+def grading_items(batch):
+    """Prompt items for a batch of (question, answer) pairs, numbered from 1"""
+    return json.dumps([
+        {"n": number, "type": question["type"], "question": question["stem"],
+         "reference": question["answer"], "answer": answer}
+        for number, (question, answer) in enumerate(batch, 1)
+    ], ensure_ascii=False, indent=1)
+
+
+def parse_grades(text):
+    """{item number: {score, correct, feedback}} from a model response holding a JSON array"""
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    grades = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            number = int(item.get("n"))
+            score = min(1.0, max(0.0, float(item.get("score", 0))))
+        except (TypeError, ValueError):
+            continue
+        correct = item.get("correct")
+        grades[number] = {
+            "score": score,
+            "correct": bool(correct) if isinstance(correct, bool) else score >= 0.5,
+            "feedback": str(item.get("feedback") or ""),
+        }
+    return grades
+
+
+def model_results(batch, text, seconds):
+    """Result records for a batch graded by the model in one call of `seconds`"""
+    grades = parse_grades(text)
+    results = []
+    for number, (question, _) in enumerate(batch, 1):
+        result = {
+            "question_id": question["id"],
+            "type": question["type"],
+            "graded_by": "model",
+            "expected": question["answer"],
+            "explanation": question["explanation"],
+            "seconds": seconds,
+        }
+        grade = grades.get(number)
+        if grade is None:
+            result["error"] = {"error": "The model's grade for this answer could not be read",
+                               "type": "invalid_response", "retryable": True}
+        else:
+            result.update(grade)
+            GRADED.inc(type=question["type"], grader="model")
+            GRADING_LATENCY.observe(seconds, grader="model")
+        results.append(result)
+    return results
+
+
+def failed_results(batch, error, seconds):
+    """Result records for a batch whose model call failed (error: an UpstreamError)"""
+    return [{
+        "question_id": question["id"],
+        "type": question["type"],
+        "graded_by": "model",
+        "error": error.to_dict(),
+        "seconds": seconds,
+    } for question, _ in batch]
+
+
+def summarize(results, local_seconds, model_seconds, model_calls):
+    """Totals for a grading request: counts, mean score and the local/model split"""
+    graded = [result for result in results if "score" in result]
+    return {
+        "answers": len(results),
+        "graded": len(graded),
+        "correct": sum(1 for result in graded if result["correct"]),
+        "score": round(sum(result["score"] for result in graded) / len(graded), 3) if graded else None,
+        "local": sum(1 for result in graded if result["graded_by"] == "local"),
+        "model": sum(1 for result in graded if result["graded_by"] == "model"),
+        "errors": len(results) - len(graded),
+        "model_calls": model_calls,
+        "local_seconds": round(local_seconds, 6),
+        "model_seconds": round(model_seconds, 3),
+    }
@@ -0,0 +1,299 @@
+"""
+Hedged model calls for Study Assistant
+Tail latency of a model API is dominated by a few slow calls. HedgedBackend
+wraps a backend with the same interface: when a call has not produced its
+first token within the recently observed p95, an identical backup call is
+sent and whichever answers first is used. The slower call is stopped, so it
+is not paid for to the end: async calls are cancelled and sync streams are
+closed. A sync generate() cannot be stopped once sent (the losing thread
+would run on, billed), so it is never hedged; on the sync path only streams
+are.
+
+Backups are capped by a budget: at most `budget` backup calls per call made
+(5% by default), so hedging can't double the load on an upstream that is
+slow for everyone. Hedging starts once `min_samples` latencies have been seen.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from resilience import deadline_after, timeout_kwargs, context_kwargs
+
+_DONE = object()
+
+
+class LatencyWindow:
+    """The most recent latencies of one kind of call"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples):
+        """Nearest-rank percentile, or None with fewer than min_samples samples"""
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+class _StreamLeg:
+    """One stream call, read in its own thread into a queue shared by all legs"""
+
+    def __init__(self, name, chunks, events, window):
+        self.name = name
+        self.stop = threading.Event()
+        self._chunks = chunks
+        self._events = events
+        self._window = window
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        start = time.perf_counter()
+        first = True
+        try:
+            for chunk in self._chunks:
+                if first:
+                    self._window.add(time.perf_counter() - start)
+                    first = False
+                if self.stop.is_set():
+                    break
+                self._events.put((self, chunk))
+            else:
+                self._events.put((self, _DONE))
+        except Exception as e:
+            self._events.put((self, e))
+        finally:
+            # Closing the backend's generator stops the call
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+
+
+class HedgedBackend:
+    """Sends a backup call when the first token is later than the observed p95"""
+
+    def __init__(self, backend, budget=0.05, percentile=95, min_samples=20, min_delay=0.2, window=200):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.budget = budget
+        self.pct = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._windows = {"generate": LatencyWindow(window), "stream": LatencyWindow(window)}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls, backend):
+        """Wrap a backend using STUDY_HEDGE_* settings, or None unless STUDY_HEDGE is on"""
+        if os.getenv("STUDY_HEDGE", "0").lower() not in ("1", "true", "yes", "on"):
+            return None
+        return cls(
+            backend,
+            budget=float(os.getenv("STUDY_HEDGE_BUDGET", "0.05")),
+            percentile=float(os.getenv("STUDY_HEDGE_PERCENTILE", "95")),
+            min_samples=int(os.getenv("STUDY_HEDGE_MIN_SAMPLES", "20")),
+            min_delay=float(os.getenv("STUDY_HEDGE_MIN_DELAY_MS", "200")) / 1000.0,
+        )
+
+    def __getattr__(self, name):
+        # Anything else (system_instruction, create_context, ...) is the wrapped backend's
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def _hedge_delay(self, operation):
+        """Seconds to wait for the first token before sending a backup, or None to never hedge"""
+        with self._lock:
+            self.calls += 1
+        observed = self._windows[operation].percentile(self.pct, self.min_samples)
+        return None if observed is None else max(self.min_delay, observed)
+
+    def _take_budget(self):
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def _won(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def _timed(self, fn, operation, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self._windows[operation].add(time.perf_counter() - start)
+        return result
+
+    async def _atimed(self, awaitable, operation):
+        start = time.perf_counter()
+        result = await awaitable
+        self._windows[operation].add(time.perf_counter() - start)
+        return result
+
+    def generate(self, prompt, context=None, timeout=None):
+        # Not hedged: a losing thread could not be stopped and would be billed in full.
+        # Timed all the same, so agenerate's hedge delay reflects every call.
+        deadline = deadline_after(timeout)
+        return self._timed(self.backend.generate, "generate", prompt, **context_kwargs(context), **timeout_kwargs(deadline))
+
+    def stream(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        delay = self._hedge_delay("stream")
+        window = self._windows["stream"]
+        if delay is None:
+            start = time.perf_counter()
+            first = True
+            for chunk in self.backend.stream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)):
+                if first:
+                    window.add(time.perf_counter() - start)
+                    first = False
+                yield chunk
+            return
+        events = queue.Queue()
+        legs = [_StreamLeg("primary", self.backend.stream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)),
+                           events, window)]
+        winner = None
+        errors = {}
+        try:
+            while True:
+                try:
+                    leg, item = events.get(timeout=delay if len(legs) == 1 and winner is None else None)
+                except queue.Empty:
+                    if self._take_budget():
+                        legs.append(_StreamLeg("backup", self.backend.stream(
+                            prompt, **context_kwargs(context), **timeout_kwargs(deadline)), events, window))
+                    else:
+                        delay = None
+                    continue
+                if winner is None:
+                    if isinstance(item, Exception):
+                        errors[leg.name] = item
+                        if len(errors) < len(legs):
+                            continue  # the other leg may still answer
+                        raise errors.get("primary", item)
+                    winner = leg
+                    if winner.name == "backup":
+                        self._won()
+                    for other in legs:
+                        if other is not winner:
+                            other.stop.set()
+                if leg is not winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for leg in legs:
+                leg.stop.set()
+
+    async def agenerate(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        delay = self._hedge_delay("generate")
+
+        def call():
+            return asyncio.ensure_future(self._atimed(
+                self.backend.agenerate(prompt, **context_kwargs(context), **timeout_kwargs(deadline)), "generate"))
+
+        if delay is None:
+            return await self._atimed(self.backend.agenerate(prompt, **context_kwargs(context), **timeout_kwargs(deadline)), "generate")
+        primary = call()
+        legs = {primary}
+        try:
+            done, _ = await asyncio.wait(legs, timeout=delay)
+            if not done and self._take_budget():
+                legs.add(call())
+            pending = set(legs)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for leg in done:
+                    if leg.exception() is None:
+                        if leg is not primary:
+                            self._won()
+                        return leg.result()
+            return primary.result()
+        finally:
+            # The slower call is cancelled, along with everything if we were
+            for leg in legs:
+                leg.cancel()
+
+    async def astream(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        delay = self._hedge_delay("stream")
+        window = self._windows["stream"]
+
+        def open_leg():
+            chunks = self.backend.astream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)).__aiter__()
+            return chunks, asyncio.ensure_future(self._atimed(chunks.__anext__(), "stream"))
+
+        if delay is None:
+            chunks, first = open_leg()
+        else:
+            legs = [open_leg()]
+            firsts = {first: chunks for chunks, first in legs}
+            first = None
+            try:
+                done, _ = await asyncio.wait(firsts, timeout=delay)
+                if not done and self._take_budget():
+                    legs.append(open_leg())
+                    firsts[legs[-1][1]] = legs[-1][0]
+                pending = set(firsts)
+                while pending and first is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        # An empty stream (StopAsyncIteration) is an answer too
+                        if not isinstance(task.exception(), Exception) or isinstance(task.exception(), StopAsyncIteration):
+                            first = task
+                            break
+                if first is None:
+                    first = legs[0][1]
+                elif first is not legs[0][1]:
+                    self._won()
+                chunks = firsts[first]
+            finally:
+                for other_chunks, other_first in legs:
+                    if other_first is not first:
+                        other_first.cancel()
+                        # The generator can only be closed once its pending step has unwound
+                        await asyncio.gather(other_first, return_exceptions=True)
+                        if hasattr(other_chunks, "aclose"):
+                            await other_chunks.aclose()
+        try:
+            try:
+                yield await first
+            except StopAsyncIteration:
+                return
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    def stats(self):
+        stats = self.backend.stats() if hasattr(self.backend, "stats") else {}
+        delays = {operation: window.percentile(self.pct, self.min_samples) for operation, window in self._windows.items()}
+        with self._lock:
+            stats.update({
+                "hedged_calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_budget": self.budget,
+                "hedge_delay_generate_ms": round(max(self.min_delay, delays["generate"]) * 1000) if delays["generate"] is not None else None,
+                "hedge_delay_stream_ms": round(max(self.min_delay, delays["stream"]) * 1000) if delays["stream"] is not None else None,
+            })
+        return stats
@@ -0,0 +1,390 @@
+"""
+Background job queue for Study Assistant
+Long generations (multi-thousand-word assignments) run as jobs instead of
+inside the HTTP request: submitting returns a job id at once, a bounded pool of
+worker threads processes jobs, and status, partial output and results live in
+SQLite, so they survive restarts and are visible to every worker process that
+shares the database file.
+
+Identical submissions attach to the job already queued, running or recently
+finished. A running job's lease is renewed by a heartbeat while its worker is
+alive, however long the model takes to answer; a job whose worker died (its
+lease ran out) is picked up again, up to max_attempts times. Every write a
+worker makes is tied to its attempt, so a worker that lost its job stops
+instead of overwriting the new attempt's row.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import REGISTRY
+from response_cache import CACHE_DIR
+
+JOB_WAIT = REGISTRY.histogram("study_job_wait_seconds", "Time jobs spend queued before a worker starts them", ("kind",))
+JOB_DURATION = REGISTRY.histogram("study_job_duration_seconds", "Time to run a job", ("kind", "status"))
+
+
+class QueueFull(Exception):
+    """Too many jobs are already waiting"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def make_job_key(kind, params):
+    """Stable key for deduplicating identical submissions"""
+    raw = json.dumps({"kind": kind, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """SQLite-backed job queue with a local worker pool
+
+    Handlers are registered per job kind; a handler takes the job's params and
+    returns an iterator of text chunks, whose concatenation is the result.
+    Partial output is saved every flush_interval seconds so clients can follow
+    progress.
+    """
+
+    def __init__(self, db_path, workers=2, max_queued=1000, lease=120, max_attempts=3,
+                 retention=86400, poll_interval=0.5, flush_interval=0.5):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_queued = max_queued
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._init_db()
+
+    @classmethod
+    def from_env(cls):
+        """Create a job queue from STUDY_JOB* environment variables"""
+        return cls(
+            db_path=os.getenv("STUDY_JOBS_DB", os.path.join(CACHE_DIR, "jobs.db")),
+            workers=int(os.getenv("STUDY_JOB_WORKERS", "2")),
+            max_queued=int(os.getenv("STUDY_JOB_MAX_QUEUED", "1000")),
+            lease=float(os.getenv("STUDY_JOB_LEASE", "120")),
+            retention=float(os.getenv("STUDY_JOB_RETENTION", "86400")),
+        )
+
+    def _connect(self):
+        """Return this thread's SQLite connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                job_key TEXT NOT NULL,
+                params TEXT NOT NULL,
+                meta TEXT,
+                status TEXT NOT NULL,
+                partial TEXT NOT NULL DEFAULT '',
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_expires REAL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (job_key)")
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    # Submitting and reading jobs
+
+    def submit(self, kind, params, meta=None):
+        """Queue a job, or attach to an identical one; returns (job, created)"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        key = make_job_key(kind, params)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """SELECT id FROM jobs WHERE job_key = ?
+                   AND (status IN ('queued', 'running') OR (status = 'done' AND finished_at > ?))
+                   ORDER BY created_at DESC LIMIT 1""",
+                (key, now - self.retention),
+            ).fetchone()
+            if row is not None:
+                conn.execute("COMMIT")
+                return self.get(row["id"]), False
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs are already waiting")
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, job_key, params, meta, status, created_at) VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, key, json.dumps(params), json.dumps(meta) if meta is not None else None, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._wakeup.set()
+        return self.get(job_id), True
+
+    def get(self, job_id, include_partial=False):
+        """Return a job as a dict, or None"""
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "meta": json.loads(row["meta"]) if row["meta"] else None,
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "progress_chars": len(row["partial"]) if row["status"] != "done" else len(row["result"] or ""),
+            "result": row["result"],
+            "error": json.loads(row["error"]) if row["error"] else None,
+        }
+        if row["status"] == "queued":
+            job["position"] = self._connect().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at <= ?", (row["created_at"],)
+            ).fetchone()[0]
+        if include_partial:
+            job["partial"] = row["partial"]
+        return job
+
+    def follow(self, job_id, poll_interval=None):
+        """Yield (event, data) pairs as a job progresses: status, chunk, then done or error"""
+        state = {}
+        while True:
+            events, finished = self._follow_step(job_id, state)
+            yield from events
+            if finished:
+                return
+            time.sleep(poll_interval or self.poll_interval)
+
+    async def afollow(self, job_id, poll_interval=None):
+        """Async version of follow; database reads run in a worker thread"""
+        state = {}
+        while True:
+            events, finished = await asyncio.to_thread(self._follow_step, job_id, state)
+            for event in events:
+                yield event
+            if finished:
+                return
+            await asyncio.sleep(poll_interval or self.poll_interval)
+
+    def _follow_step(self, job_id, state):
+        """Events since the last step; state tracks what the client has already seen"""
+        job = self.get(job_id, include_partial=True)
+        if job is None:
+            return [("error", {"error": "Job not found", "type": "not_found"})], True
+        events = []
+        if state.get("sent") and job["attempts"] != state["attempts"]:
+            # A worker died and the job started over; the partial text is gone
+            events.append(("restart", {"attempt": job["attempts"]}))
+            state["sent"] = 0
+        state["attempts"] = job["attempts"]
+        if (job["status"], job.get("position")) != state.get("status"):
+            state["status"] = (job["status"], job.get("position"))
+            events.append(("status", {"status": job["status"], "position": job.get("position")}))
+        text = job["result"] if job["status"] == "done" else job["partial"]
+        sent = state.get("sent", 0)
+        if len(text or "") > sent:
+            events.append(("chunk", {"text": text[sent:]}))
+            state["sent"] = len(text)
+        if job["status"] == "done":
+            events.append(("done", {}))
+            return events, True
+        if job["status"] == "failed":
+            events.append(("error", job["error"]))
+            return events, True
+        return events, False
+
+    # Worker pool
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return self
+            self._stopping.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"study-job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        last_maintenance = 0.0
+        while not self._stopping.is_set():
+            if time.time() - last_maintenance > self.poll_interval * 20:
+                self._maintain()
+                last_maintenance = time.time()
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running; returns its row or None"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    """UPDATE jobs SET status = 'running', started_at = ?, lease_expires = ?,
+                       attempts = attempts + 1, partial = '' WHERE id = ?""",
+                    (now, now + self.lease, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is not None:
+            JOB_WAIT.observe(now - row["created_at"], kind=row["kind"])
+        return row
+
+    def _heartbeat(self, job_id, attempt, stop, lost):
+        """Renew a running job's lease until stop is set; sets lost if another attempt took the job over"""
+        conn = self._connect()
+        try:
+            while not stop.wait(self.lease / 3):
+                renewed = conn.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                    (time.time() + self.lease, job_id, attempt),
+                ).rowcount
+                if not renewed:
+                    lost.set()
+                    return
+        finally:
+            conn.close()
+            self._local.conn = None
+
+    def _run(self, row):
+        # _claim counted this attempt; writes only land while it still owns the job
+        job_id, kind, attempt = row["id"], row["kind"], row["attempts"] + 1
+        conn = self._connect()
+        start = time.perf_counter()
+        parts = []
+        last_flush = time.monotonic()
+        stop, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, attempt, stop, lost),
+                                     name=f"study-job-heartbeat-{job_id[:8]}", daemon=True)
+        heartbeat.start()
+        chunks = None
+        try:
+            handler = self.handlers[kind]
+            chunks = handler(json.loads(row["params"]))
+            for chunk in chunks:
+                parts.append(chunk)
+                if lost.is_set():
+                    return
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    saved = conn.execute(
+                        "UPDATE jobs SET partial = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                        ("".join(parts), job_id, attempt),
+                    ).rowcount
+                    if not saved:
+                        return
+                    last_flush = time.monotonic()
+            status, values = "done", ("".join(parts), None)
+        except Exception as e:
+            error = e.to_dict() if hasattr(e, "to_dict") else {"error": str(e)}
+            status, values = "failed", ("".join(parts), json.dumps(error))
+        finally:
+            stop.set()
+            # Closing the handler's generator stops a generation this worker no longer owns
+            if hasattr(chunks, "close"):
+                chunks.close()
+        if status == "done":
+            query = "UPDATE jobs SET status = 'done', result = ?, partial = '', error = ?, finished_at = ?"
+        else:
+            query = "UPDATE jobs SET status = 'failed', partial = ?, error = ?, finished_at = ?"
+        conn.execute(
+            query + " WHERE id = ? AND attempts = ? AND status = 'running'",
+            (*values, time.time(), job_id, attempt),
+        )
+        JOB_DURATION.observe(time.perf_counter() - start, kind=kind, status=status)
+
+    def _maintain(self):
+        """Requeue jobs whose worker died, fail ones that keep dying, drop old finished jobs"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            """UPDATE jobs SET status = 'failed', finished_at = ?,
+               error = '{"error": "Job abandoned after repeated worker failures", "type": "abandoned"}'
+               WHERE status = 'running' AND lease_expires < ? AND attempts >= ?""",
+            (now, now, self.max_attempts),
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND lease_expires < ?",
+            (now,),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (now - self.retention,),
+        )
+
+    def stats(self):
+        """Queue depth, running jobs and waiting times"""
+        now = time.time()
+        conn = self._connect()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        recent_wait = conn.execute(
+            """SELECT AVG(started_at - created_at) FROM
+               (SELECT started_at, created_at FROM jobs WHERE started_at IS NOT NULL ORDER BY started_at DESC LIMIT 100)"""
+        ).fetchone()[0]
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "workers": self.workers,
+            "oldest_wait_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "recent_wait_seconds": round(recent_wait, 3) if recent_wait else 0.0,
+        }
@@ -0,0 +1,256 @@
+"""
+API key pool for Study Assistant
+One API key caps the whole deployment at that key's per-minute quota. With
+several keys (or keys of several projects) in STUDY_API_KEYS, KeyPool gives
+each its own backend, client and quota accounting, and sends every call to the
+key with the most headroom left this minute. A key that answers with a quota
+error (429) is drained: it gets no calls for STUDY_KEY_DRAIN seconds, and the
+call moves on to the next key straight away. Only when every key is drained
+does the call fail with a 429 (which ResilientBackend then retries).
+
+KeyPool has the backend interface (see backends.py) and sits under
+ResilientBackend, so the rate limits there (STUDY_RPM, STUDY_TPM) apply to
+the pool as a whole and STUDY_KEY_RPM / STUDY_KEY_TPM to each key.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from resilience import TokenBucket, UpstreamError, context_kwargs, deadline_after, remaining, timeout_kwargs, within
+from text_chunks import estimate_tokens
+
+
+class PooledKey:
+    """One API key's backend and quota accounting"""
+
+    def __init__(self, name, backend, requests_per_minute=0, tokens_per_minute=0):
+        self.name = name
+        self.backend = backend
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.drained_until = 0.0
+        self.last_used = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.drains = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.recent = deque()  # time.monotonic() of the calls in the last minute
+
+    def headroom(self):
+        """Share of this minute's quota left (1.0 when no quota is configured; below 0 when overdrawn)"""
+        shares = [bucket.available() / bucket.capacity for bucket in (self.request_bucket, self.token_bucket) if bucket]
+        return min(shares, default=1.0)
+
+    def drained(self, now):
+        return self.drained_until > now
+
+    def calls_last_minute(self, now):
+        while self.recent and self.recent[0] <= now - 60:
+            self.recent.popleft()
+        return len(self.recent)
+
+
+class KeyPool:
+    """Spreads calls over several backends, one per API key, by quota headroom"""
+
+    def __init__(self, keys, drain_seconds=60.0):
+        if not keys:
+            raise ValueError("A key pool needs at least one key")
+        self.keys = list(keys)
+        self.model_name = self.keys[0].backend.model_name
+        self.drain_seconds = drain_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, factory):
+        """A pool over the keys in STUDY_API_KEYS (comma-separated), or None when fewer than two are set
+
+        factory(api_key, primary) builds the backend for one key; primary is
+        True for the first key, which also serves cached-context calls.
+        """
+        api_keys = [key.strip() for key in os.getenv("STUDY_API_KEYS", "").split(",") if key.strip()]
+        if len(api_keys) < 2:
+            return None
+        requests_per_minute = int(os.getenv("STUDY_KEY_RPM", "0"))
+        tokens_per_minute = int(os.getenv("STUDY_KEY_TPM", "0"))
+        return cls(
+            [PooledKey(f"key{index + 1}", factory(api_key, index == 0), requests_per_minute, tokens_per_minute)
+             for index, api_key in enumerate(api_keys)],
+            drain_seconds=float(os.getenv("STUDY_KEY_DRAIN", "60")),
+        )
+
+    def __getattr__(self, name):
+        # system_instruction, create_context, ... are the first key's: cached
+        # contexts live in its project, so calls using one are sent there too
+        if name == "keys":
+            raise AttributeError(name)
+        return getattr(self.keys[0].backend, name)
+
+    def _acquire(self, prompt, context, tried):
+        """Pick the key for a call and count it; raises a 429 UpstreamError when every key is drained"""
+        now = time.monotonic()
+        with self._lock:
+            if context is not None:
+                candidates = [self.keys[0]] if self.keys[0] not in tried else []
+            else:
+                candidates = [key for key in self.keys if key not in tried and not key.drained(now)]
+            if not candidates:
+                drained = [key.drained_until - now for key in self.keys if key.drained(now)]
+                raise UpstreamError(
+                    "Every API key is over its quota, please retry shortly",
+                    kind="rate_limited", status=429, retryable=True,
+                    retry_after=min(drained) if drained else None,
+                )
+            # Most headroom first; then the least busy, least recently used key
+            key = max(candidates, key=lambda key: (key.headroom(), -key.in_flight, -key.last_used))
+            tokens = estimate_tokens(prompt)
+            if key.request_bucket is not None:
+                key.request_bucket.charge(1)
+            if key.token_bucket is not None:
+                key.token_bucket.charge(tokens)
+            key.calls += 1
+            key.in_flight += 1
+            key.prompt_tokens += tokens
+            key.last_used = now
+            key.recent.append(now)
+        return key
+
+    def _release(self, key):
+        with self._lock:
+            key.in_flight -= 1
+
+    def _succeeded(self, key, text):
+        tokens = estimate_tokens(text)
+        if key.token_bucket is not None:
+            key.token_bucket.charge(tokens)
+        with self._lock:
+            key.output_tokens += tokens
+
+    def _failed(self, key, exc, prompt):
+        """Account for a failed call; True if it was a quota error and the call may move to another key"""
+        error = UpstreamError.from_exception(exc)
+        with self._lock:
+            key.errors += 1
+            if error.kind != "rate_limited":
+                return False
+            # A rejected call used no quota
+            if key.request_bucket is not None:
+                key.request_bucket.refund(1)
+            if key.token_bucket is not None:
+                key.token_bucket.refund(estimate_tokens(prompt))
+            key.quota_errors += 1
+            if not key.drained(time.monotonic()):
+                key.drains += 1
+            key.drained_until = time.monotonic() + (error.retry_after or self.drain_seconds)
+        return True
+
+    def generate(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        tried = []
+        while True:
+            key = self._acquire(prompt, context, tried)
+            try:
+                text = key.backend.generate(prompt, **context_kwargs(context), **timeout_kwargs(deadline))
+            except Exception as e:
+                if not self._failed(key, e, prompt):
+                    raise
+                tried.append(key)
+                remaining(deadline)
+                continue
+            finally:
+                self._release(key)
+            self._succeeded(key, text)
+            return text
+
+    def stream(self, prompt, context=None, timeout=None):
+        # Moves to another key only until the first chunk is out
+        deadline = deadline_after(timeout)
+        tried = []
+        while True:
+            key = self._acquire(prompt, context, tried)
+            parts = []
+            try:
+                for chunk in key.backend.stream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)):
+                    parts.append(chunk)
+                    yield chunk
+            except Exception as e:
+                if not self._failed(key, e, prompt) or parts:
+                    raise
+                tried.append(key)
+                remaining(deadline)
+                continue
+            finally:
+                self._release(key)
+            self._succeeded(key, "".join(parts))
+            return
+
+    async def agenerate(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        tried = []
+        while True:
+            key = self._acquire(prompt, context, tried)
+            try:
+                text = await within(key.backend.agenerate(prompt, **context_kwargs(context), **timeout_kwargs(deadline)), deadline)
+            except Exception as e:
+                if not self._failed(key, e, prompt):
+                    raise
+                tried.append(key)
+                remaining(deadline)
+                continue
+            finally:
+                self._release(key)
+            self._succeeded(key, text)
+            return text
+
+    async def astream(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        tried = []
+        while True:
+            key = self._acquire(prompt, context, tried)
+            parts = []
+            chunks = key.backend.astream(prompt, **context_kwargs(context), **timeout_kwargs(deadline))
+            try:
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            except Exception as e:
+                if not self._failed(key, e, prompt) or parts:
+                    raise
+                tried.append(key)
+                remaining(deadline)
+                continue
+            finally:
+                self._release(key)
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+            self._succeeded(key, "".join(parts))
+            return
+
+    def key_stats(self):
+        """Per-key calls, quota errors, drain state and utilization of the configured quota"""
+        now = time.monotonic()
+        with self._lock:
+            stats = {}
+            for key in self.keys:
+                limited = key.request_bucket is not None or key.token_bucket is not None
+                headroom = key.headroom()
+                stats[key.name] = {
+                    "calls": key.calls,
+                    "calls_last_minute": key.calls_last_minute(now),
+                    "in_flight": key.in_flight,
+                    "errors": key.errors,
+                    "quota_errors": key.quota_errors,
+                    "drains": key.drains,
+                    "drained": key.drained(now),
+                    "drained_seconds": round(max(0.0, key.drained_until - now), 1),
+                    "prompt_tokens": key.prompt_tokens,
+                    "output_tokens": key.output_tokens,
+                    "headroom": round(headroom, 3) if limited else None,
+                    "utilization": round(1 - headroom, 3) if limited else None,
+                }
+            return stats
@@ -0,0 +1,208 @@
+"""
+Metrics for Study Assistant
+A small, dependency-free metrics registry rendered in the Prometheus text
+format by the /metrics endpoint. Counters and histograms are updated on the
+hot path (request and upstream latency, token usage, error classes); gauges
+for caches and queues are read from collector callbacks at scrape time.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Seconds; spans fast cache hits up to long generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labels))
+        return series[-1] if series else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics and scrape-time collectors and renders them for Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        """Add a callback returning [(name, help, {label: value}, value), ...] gauge samples"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        gauges = {}
+        for collect in collectors:
+            try:
+                samples = collect()
+            except Exception:
+                # A broken collector must not take the whole endpoint down
+                continue
+            for name, help, labels, value in samples:
+                gauges.setdefault(name, (help, []))[1].append((labels, value))
+        for name, (help, samples) in gauges.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                names = tuple(labels)
+                lines.append(f"{name}{_format_labels(names, [labels[n] for n in names])} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "study_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "study_http_request_duration_seconds", "Time to serve a request, including streamed bodies", ("route",))
+HTTP_REQUEST_BYTES = REGISTRY.histogram(
+    "study_http_request_bytes", "Request body size", ("route",), SIZE_BUCKETS)
+HTTP_RESPONSE_BYTES = REGISTRY.histogram(
+    "study_http_response_bytes", "Response body size", ("route",), SIZE_BUCKETS)
+HTTP_DISCONNECTS = REGISTRY.counter(
+    "study_http_disconnects_total", "Generation requests cancelled because the client disconnected", ("route",))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "study_upstream_duration_seconds", "Model call duration per attempt", ("model", "operation"))
+UPSTREAM_FIRST_CHUNK = REGISTRY.histogram(
+    "study_upstream_first_chunk_seconds", "Time to the first streamed chunk from the model", ("model",))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "study_upstream_errors_total", "Failed model calls by error type", ("model", "type"))
+TOKENS = REGISTRY.counter(
+    "study_tokens_total", "Tokens reported by the model (prompt, output, cached)", ("model", "kind"))
+
+
+def record_usage(model, prompt_tokens=0, output_tokens=0, cached_tokens=0):
+    """Count token usage for one model call"""
+    for kind, amount in (("prompt", prompt_tokens), ("output", output_tokens), ("cached", cached_tokens)):
+        if amount:
+            TOKENS.inc(amount, model=model, kind=kind)
+
+
+def record_usage_metadata(model, usage):
+    """Count tokens from a Gemini response's usage_metadata (missing fields count as 0)"""
+    if usage is None:
+        return
+    record_usage(
+        model,
+        prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+        output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+        cached_tokens=getattr(usage, "cached_content_token_count", 0) or 0,
+    )
+
+
+def stats_samples(prefix, help, stats, labels=None):
+    """Turn a stats() dict into gauge samples, one metric per numeric field"""
+    samples = []
+    for field, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        samples.append((f"{prefix}_{field}", f"{help}: {field}", labels or {}, value))
+    return samples
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Offline cache pre-generation for Study Assistant
+Works through a curriculum (topics x levels x features) ahead of time and
+stores study guides, topic explanations and practice questions in the
+persistent response cache and question bank, so students asking about those
+topics during the semester are served without waiting for the model.
+
+Entries that are already cached and stay fresh for at least --min-fresh
+seconds are skipped, so an interrupted run is resumed by running it again.
+Generation runs --concurrency entries at a time under the usual client-side
+rate limit (STUDY_RPM / STUDY_TPM, or --rpm).
+
+The web app serves these entries when it shares the same files: run it with
+STUDY_CACHE_DB set to the --cache-db used here (and the same
+STUDY_CACHE_DIR, or the same STUDY_QUESTION_BANK_DB / STUDY_TOPIC_DB).
+
+Curriculum files are JSON:
+    {
+        "topics": ["Photosynthesis", {"topic": "Cell Division", "levels": ["beginner"]}],
+        "levels": ["beginner", "intermediate", "advanced"],
+        "features": ["study_guide", "explanation", "questions"],
+        "num_questions": 5,
+        "question_types": ["multiple_choice", "true_false", "short_answer"]
+    }
+or plain text with one topic per line (# starts a comment).
+
+Examples:
+    python pregenerate.py curriculum.json --concurrency 4 --rpm 30
+    python pregenerate.py topics.txt --levels beginner,advanced --features study_guide
+    python pregenerate.py curriculum.json --dry-run
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from question_bank import DEFAULT_TYPES, QuestionBank, allocate
+from response_cache import CACHE_DIR, ResponseCache
+from study_assistant import StudyAssistant
+from topic_index import TopicIndex
+
+FEATURES = ("study_guide", "explanation", "questions")
+DEFAULT_LEVELS = ("beginner", "intermediate", "advanced")
+
+
+def load_curriculum(path, levels=None, features=None):
+    """Expand a curriculum file into entries: dicts with feature, topic, level and question settings
+
+    levels and features given on the command line override the file's defaults
+    (but not per-topic settings). Question sets don't depend on the level, so
+    there is one per topic.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.lower().endswith(".json"):
+        spec = json.loads(text)
+    else:
+        lines = (line.split("#", 1)[0].strip() for line in text.splitlines())
+        spec = {"topics": [line for line in lines if line]}
+    default_levels = levels or spec.get("levels") or list(DEFAULT_LEVELS)
+    default_features = features or spec.get("features") or list(FEATURES)
+    entries = []
+    seen = set()
+    for item in spec.get("topics", []):
+        if isinstance(item, str):
+            item = {"topic": item}
+        topic = item["topic"].strip()
+        for feature in item.get("features") or default_features:
+            if feature not in FEATURES:
+                raise ValueError(f"Unknown feature {feature!r} (expected one of {', '.join(FEATURES)})")
+            entry_levels = [None] if feature == "questions" else item.get("levels") or default_levels
+            for level in entry_levels:
+                if (feature, topic.lower(), level) in seen:
+                    continue
+                seen.add((feature, topic.lower(), level))
+                entries.append({
+                    "feature": feature,
+                    "topic": topic,
+                    "level": level,
+                    "num_questions": int(item.get("num_questions", spec.get("num_questions", 5))),
+                    "question_types": item.get("question_types") or spec.get("question_types") or list(DEFAULT_TYPES),
+                })
+    return entries
+
+
+def describe(entry):
+    return " | ".join(part for part in (entry["feature"], entry["topic"], entry["level"]) if part)
+
+
+class Pregenerator:
+    """Checks and fills the caches for curriculum entries"""
+
+    def __init__(self, assistant, min_fresh=86400):
+        self.assistant = assistant
+        self.min_fresh = min_fresh
+
+    def _keys(self, entry, topic):
+        """Response cache keys an entry is stored under"""
+        assistant = self.assistant
+        if entry["feature"] == "study_guide":
+            params = assistant._study_guide_params(topic, entry["level"], None)
+            if assistant.sectional_guides:
+                return [assistant._cache_key("study_guide_section_prompt", section,
+                                             assistant._route("study_guide_section_prompt", section))
+                        for section in assistant._section_params(params)]
+            return [assistant._cache_key("study_guide_prompt", params, assistant._route("study_guide_prompt", params))]
+        if entry["feature"] == "explanation":
+            params = assistant._explain_topic_params(topic, entry["level"])
+            return [assistant._cache_key("explain_topic_prompt", params, assistant._route("explain_topic_prompt", params))]
+        params = assistant._practice_questions_params(topic, entry["num_questions"], entry["question_types"])
+        return [assistant._cache_key("practice_questions_prompt", params,
+                                     assistant._route("practice_questions_prompt", params))]
+
+    def resolve(self, entry):
+        """The entry with its topic mapped to the equivalent known topic, as the web app would map it"""
+        return dict(entry, topic=self.assistant._match_topic(entry["topic"]))
+
+    def is_fresh(self, entry):
+        """Whether a resolved entry is stored and won't expire within min_fresh seconds"""
+        assistant = self.assistant
+        topic = entry["topic"]
+        if entry["feature"] == "questions" and assistant.question_bank is not None:
+            wanted = allocate(entry["num_questions"], entry["question_types"])
+            return not assistant.question_bank.shortfall(topic, wanted)
+        deadline = time.time() + self.min_fresh
+        return all((assistant.cache.expires_at(key) or 0) > deadline for key in self._keys(entry, topic))
+
+    def generate(self, entry):
+        """Generate a resolved entry into the caches, replacing stored responses that are about to expire"""
+        assistant = self.assistant
+        topic = entry["topic"]
+        if entry["feature"] == "questions" and assistant.question_bank is not None:
+            assistant.stock_question_bank(topic, entry["num_questions"], entry["question_types"])
+            return
+        for key in self._keys(entry, topic):
+            assistant.cache.delete(key)
+        if entry["feature"] == "study_guide":
+            assistant.create_study_guide(topic, entry["level"])
+        elif entry["feature"] == "explanation":
+            assistant.explain_complex_topic(topic, entry["level"])
+        else:
+            assistant.generate_practice_questions(topic, entry["num_questions"], entry["question_types"])
+
+
+def run(pregenerator, entries, concurrency=4, force=False, dry_run=False):
+    """Generate the entries that aren't fresh; returns {generated, skipped, failed} counts"""
+    counts = {"generated": 0, "skipped": 0, "failed": 0}
+    todo = []
+    seen = set()
+    for entry in entries:
+        resolved = pregenerator.resolve(entry)
+        identity = (resolved["feature"], resolved["topic"], resolved["level"])
+        if identity in seen:
+            counts["skipped"] += 1
+            print(f"⏭️  {describe(entry)} (same as {resolved['topic']})")
+            continue
+        seen.add(identity)
+        entry = resolved
+        if not force and pregenerator.is_fresh(entry):
+            counts["skipped"] += 1
+            print(f"⏭️  {describe(entry)} (fresh)")
+        else:
+            todo.append(entry)
+    if dry_run:
+        for entry in todo:
+            print(f"📝 {describe(entry)} (would generate)")
+        counts["pending"] = len(todo)
+        return counts
+
+    def work(entry):
+        started = time.perf_counter()
+        pregenerator.generate(entry)
+        return time.perf_counter() - started
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {pool.submit(work, entry): entry for entry in todo}
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"❌ [{done}/{len(todo)}] {describe(entry)}: {e}")
+                continue
+            counts["generated"] += 1
+            print(f"✅ [{done}/{len(todo)}] {describe(entry)} ({elapsed:.1f}s)")
+    except KeyboardInterrupt:
+        # Finished entries are already stored; running again picks up the rest
+        print("\n⏹️  Interrupted, stopping after the entries in progress...")
+        pool.shutdown(wait=True, cancel_futures=True)
+        counts["interrupted"] = True
+        return counts
+    pool.shutdown(wait=True)
+    return counts
+
+
+def split_list(value):
+    return [part.strip() for part in value.split(",") if part.strip()] if value else None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Pre-generate Study Assistant content for a curriculum")
+    parser.add_argument("curriculum", help="curriculum file (.json, or text with one topic per line)")
+    parser.add_argument("--levels", help="comma-separated levels (default: from the file, else beginner,intermediate,advanced)")
+    parser.add_argument("--features", help=f"comma-separated features to generate (default: {','.join(FEATURES)})")
+    parser.add_argument("--concurrency", type=int, default=4, help="entries generated at a time")
+    parser.add_argument("--rpm", type=int, help="requests per minute to stay under (default: STUDY_RPM)")
+    parser.add_argument("--cache-db", default=os.getenv("STUDY_CACHE_DB") or os.path.join(CACHE_DIR, "responses.db"),
+                        help="response cache file (default: STUDY_CACHE_DB, else responses.db in the cache folder)")
+    parser.add_argument("--ttl", type=float, default=120 * 86400,
+                        help="seconds the generated entries stay cached (default: 120 days)")
+    parser.add_argument("--min-fresh", type=float, default=86400,
+                        help="regenerate entries expiring within this many seconds (default: 1 day)")
+    parser.add_argument("--force", action="store_true", help="regenerate entries that are still fresh")
+    parser.add_argument("--dry-run", action="store_true", help="only report which entries would be generated")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        entries = load_curriculum(args.curriculum, split_list(args.levels), split_list(args.features))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"❌ Invalid curriculum {args.curriculum}: {e}")
+        return 2
+    if args.rpm:
+        os.environ["STUDY_RPM"] = str(args.rpm)
+    # Offline runs can wait for the rate limit instead of failing fast
+    os.environ.setdefault("STUDY_THROTTLE_MAX_WAIT", "600")
+    try:
+        assistant = StudyAssistant(
+            cache=ResponseCache(max_entries=1, ttl=args.ttl, db_path=args.cache_db),
+            question_bank=QuestionBank.from_env(),
+            topic_index=TopicIndex.from_env()
+        )
+    except Exception as e:
+        print(f"❌ Error initializing Study Assistant: {str(e)}")
+        print("Please make sure your GOOGLE_API_KEY is set in the .env file")
+        return 1
+    print(f"📚 {len(entries)} entries from {args.curriculum} -> {args.cache_db}")
+    started = time.perf_counter()
+    counts = run(Pregenerator(assistant, args.min_fresh), entries, args.concurrency, args.force, args.dry_run)
+    print(f"\n📊 {json.dumps(counts)} in {time.perf_counter() - started:.1f}s")
+    if os.getenv("STUDY_CACHE_DB") != args.cache_db:
+        print(f"💡 Start the app with STUDY_CACHE_DB={args.cache_db} to serve these responses")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Opt-in sampling profiler for Study Assistant
+When STUDY_PROFILING=1, a request sent with an `X-Profile: 1` header (or
+`?profile=1`) is profiled: a background thread samples the serving thread's
+stack every few milliseconds, and the collapsed stacks are saved in the
+"folded" format used by flamegraph tools (flamegraph.pl, speedscope). The
+response carries an X-Profile-Id header; fetch the result from
+/profiles/<id>.
+
+Under the ASGI server the sampled thread is the event loop, so a profile also
+shows other requests being served at the same time.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from response_cache import CACHE_DIR
+
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def profiling_enabled():
+    return os.getenv("STUDY_PROFILING", "0").lower() in ("1", "true", "yes", "on")
+
+
+def profile_dir():
+    return os.getenv("STUDY_PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+
+
+class SamplingProfiler:
+    """Sample one thread's stack at a fixed interval and count folded stacks"""
+
+    def __init__(self, thread_id=None, interval=None, max_depth=64):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval if interval is not None else float(os.getenv("STUDY_PROFILE_INTERVAL_MS", "5")) / 1000.0
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if names:
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="study-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started if self.started else 0.0
+        return self
+
+    def folded(self):
+        """Collapsed stacks, one "frame;frame;frame count" line each"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """A profiler bound to one request; saved under a random id when finished"""
+
+    def __init__(self, label):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.profiler = SamplingProfiler().start()
+
+    def finish(self):
+        self.profiler.stop()
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.id}.folded"), "w", encoding="utf-8") as f:
+            f.write(f"# {self.label} samples={self.profiler.samples} seconds={self.profiler.duration:.3f}\n")
+            f.write(self.profiler.folded())
+
+
+def load_profile(profile_id):
+    """Return a saved profile's text, or None for unknown or malformed ids"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), f"{profile_id}.folded"), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
@@ -0,0 +1,287 @@
+"""
+Question bank for Study Assistant
+Practice questions are generated as structured records (type, stem, options,
+answer, explanation, topic, difficulty) and kept in a local SQLite bank.
+Requests are served by sampling from the bank, least-served questions first,
+so repeated requests for a popular topic rotate through the stored questions
+instead of calling the model each time. The model is only asked to top up the
+topic and question types that run short.
+"""
+
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from response_cache import CACHE_DIR
+
+DEFAULT_TYPES = ("multiple_choice", "true_false", "short_answer")
+
+TYPE_LABELS = {
+    "multiple_choice": "Multiple Choice",
+    "true_false": "True/False",
+    "short_answer": "Short Answer",
+    "essay": "Essay",
+}
+
+
+# Most question ids a request can exclude; the most recently seen are kept
+MAX_EXCLUDE = 500
+
+
+def normalize_topic(topic):
+    """Bank key for a topic: case, punctuation and spacing don't matter"""
+    return " ".join(re.findall(r"\w+", topic.lower()))
+
+
+def allocate(num_questions, question_types):
+    """Split num_questions over the types as evenly as possible, earlier types first"""
+    base, extra = divmod(num_questions, len(question_types))
+    return {qtype: base + (1 if index < extra else 0) for index, qtype in enumerate(question_types)}
+
+
+def parse_questions(text, question_types):
+    """Extract valid question records from a model response holding a JSON array
+
+    Records with an unknown type, without a stem or answer, or multiple-choice
+    records without at least two options are dropped.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        return []
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return []
+    records = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        qtype = str(item.get("type", "")).strip().lower().replace(" ", "_").replace("/", "_")
+        stem = str(item.get("stem") or item.get("question") or "").strip()
+        answer = item.get("answer")
+        options = item.get("options") or []
+        if qtype not in question_types or not stem or answer in (None, ""):
+            continue
+        if not isinstance(options, list):
+            continue
+        if qtype == "multiple_choice" and len(options) < 2:
+            continue
+        records.append({
+            "type": qtype,
+            "stem": stem,
+            "options": [str(option) for option in options],
+            "answer": str(answer),
+            "explanation": str(item.get("explanation") or ""),
+            "difficulty": str(item.get("difficulty") or "medium").lower(),
+        })
+    return records
+
+
+def render_questions(questions):
+    """Render question records as the HTML cards the practice questions page shows"""
+    parts = []
+    for number, question in enumerate(questions, 1):
+        label = TYPE_LABELS.get(question["type"], question["type"])
+        parts.append(f'<div class="card mb-3" data-question-id="{question["id"]}">')
+        parts.append(f'<div class="card-header">{html.escape(label)} &middot; {html.escape(question["difficulty"])}</div>')
+        parts.append('<div class="card-body">')
+        parts.append(f'<h3>Question {number}</h3><p>{html.escape(question["stem"])}</p>')
+        if question["options"]:
+            parts.append("<ul>" + "".join(f"<li>{html.escape(option)}</li>" for option in question["options"]) + "</ul>")
+        parts.append(f'<div class="alert alert-success"><strong>Answer:</strong> {html.escape(question["answer"])}</div>')
+        if question["explanation"]:
+            parts.append(f'<div class="alert alert-info"><strong>Explanation:</strong> {html.escape(question["explanation"])}</div>')
+        parts.append("</div></div>")
+    return "".join(parts)
+
+
+class QuestionBank:
+    """SQLite store of structured practice questions, sampled least-served first
+
+    A question is served at most max_serves times before its topic and type
+    count as short again, so popular topics keep getting fresh questions.
+    """
+
+    def __init__(self, db_path, batch_size=10, max_serves=20):
+        self.db_path = db_path
+        # Questions requested per type when topping up
+        self.batch_size = batch_size
+        self.max_serves = max_serves
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.served_from_bank = 0
+        self.top_ups = 0
+        self.added = 0
+        self._init_db()
+
+    @classmethod
+    def from_env(cls):
+        """Create a question bank from STUDY_QUESTION_* environment variables, or None when disabled"""
+        if os.getenv("STUDY_QUESTION_BANK", "1").lower() in ("0", "false", "no", "off"):
+            return None
+        return cls(
+            db_path=os.getenv("STUDY_QUESTION_BANK_DB", os.path.join(CACHE_DIR, "question_bank.db")),
+            batch_size=int(os.getenv("STUDY_QUESTION_BATCH", "10")),
+            max_serves=int(os.getenv("STUDY_QUESTION_MAX_SERVES", "20")),
+        )
+
+    def _connect(self):
+        """Return this thread's SQLite connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                topic_key TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                type TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                options TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                explanation TEXT NOT NULL,
+                fingerprint TEXT NOT NULL UNIQUE,
+                served INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_topic ON questions (topic_key, type, served)")
+        conn.commit()
+
+    @staticmethod
+    def _record(row):
+        return {
+            "id": row["id"],
+            "topic": row["topic"],
+            "type": row["type"],
+            "difficulty": row["difficulty"],
+            "stem": row["stem"],
+            "options": json.loads(row["options"]),
+            "answer": row["answer"],
+            "explanation": row["explanation"],
+        }
+
+    @staticmethod
+    def _exclusion(exclude):
+        ids = [int(question_id) for question_id in (exclude or ())][-MAX_EXCLUDE:]
+        if not ids:
+            return "", []
+        return f" AND id NOT IN ({','.join('?' * len(ids))})", ids
+
+    def shortfall(self, topic, wanted, exclude=None):
+        """Return {type: missing count} for the types the bank can't fully serve"""
+        clause, ids = self._exclusion(exclude)
+        conn = self._connect()
+        short = {}
+        for qtype, count in wanted.items():
+            available = conn.execute(
+                f"SELECT COUNT(*) FROM questions WHERE topic_key = ? AND type = ? AND served < ?{clause}",
+                [normalize_topic(topic), qtype, self.max_serves, *ids],
+            ).fetchone()[0]
+            if available < count:
+                short[qtype] = count - available
+        return short
+
+    def top_up_request(self, short):
+        """{type: count} to ask the model for, given the shortfall"""
+        # Ask for whole batches so the next requests are served from the bank
+        return {qtype: max(missing, self.batch_size) for qtype, missing in short.items()}
+
+    def known_stems(self, topic, limit=20):
+        """Recent stems for a topic, so top-ups can avoid repeating them"""
+        rows = self._connect().execute(
+            "SELECT stem FROM questions WHERE topic_key = ? ORDER BY created_at DESC LIMIT ?",
+            (normalize_topic(topic), limit),
+        ).fetchall()
+        return [row["stem"] for row in rows]
+
+    def add(self, topic, records):
+        """Store question records; duplicates of stored questions are ignored. Returns the number added"""
+        now = time.time()
+        key = normalize_topic(topic)
+        conn = self._connect()
+        added = 0
+        with conn:
+            for record in records:
+                fingerprint = hashlib.sha256(
+                    "\x00".join([key, record["type"], " ".join(record["stem"].lower().split())]).encode("utf-8")
+                ).hexdigest()
+                cursor = conn.execute(
+                    """INSERT OR IGNORE INTO questions
+                       (topic_key, topic, type, difficulty, stem, options, answer, explanation, fingerprint, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (key, topic, record["type"], record["difficulty"], record["stem"], json.dumps(record["options"]),
+                     record["answer"], record["explanation"], fingerprint, now),
+                )
+                added += cursor.rowcount
+        with self._lock:
+            self.top_ups += 1
+            self.added += added
+        return added
+
+    def sample(self, topic, wanted, exclude=None, topped_up=False):
+        """Pick up to wanted[type] questions per type, least served first, and count them as served"""
+        clause, ids = self._exclusion(exclude)
+        conn = self._connect()
+        questions = []
+        for qtype, count in wanted.items():
+            if count <= 0:
+                continue
+            rows = conn.execute(
+                f"""SELECT * FROM questions WHERE topic_key = ? AND type = ? AND served < ?{clause}
+                    ORDER BY served, RANDOM() LIMIT ?""",
+                [normalize_topic(topic), qtype, self.max_serves, *ids, count],
+            ).fetchall()
+            questions.extend(self._record(row) for row in rows)
+        if questions:
+            with conn:
+                conn.execute(
+                    f"UPDATE questions SET served = served + 1 WHERE id IN ({','.join('?' * len(questions))})",
+                    [question["id"] for question in questions],
+                )
+        with self._lock:
+            self.requests += 1
+            if not topped_up:
+                self.served_from_bank += 1
+        return questions
+
+    def get_many(self, ids):
+        """{id: question record} for the stored questions among ids (not counted as served)"""
+        ids = sorted({int(question_id) for question_id in ids})
+        if not ids:
+            return {}
+        rows = self._connect().execute(
+            f"SELECT * FROM questions WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        return {row["id"]: self._record(row) for row in rows}
+
+    def stats(self):
+        conn = self._connect()
+        total, topics = conn.execute("SELECT COUNT(*), COUNT(DISTINCT topic_key) FROM questions").fetchone()
+        with self._lock:
+            return {
+                "questions": total,
+                "topics": topics,
+                "requests": self.requests,
+                "served_from_bank": self.served_from_bank,
+                "top_ups": self.top_ups,
+                "added": self.added,
+            }
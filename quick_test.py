@@ -4,7 +4,13 @@ Quick test script for Study Assistant
 Run this to test the basic functionality
 """
 
+import asyncio
+
 from study_assistant import StudyAssistant
+from backends import GeminiBackend, StubBackend
+from keypool import KeyPool, PooledKey
+from resilience import UpstreamError
+from topic_index import TopicIndex
 
 def test_study_assistant():
     """Test the Study Assistant functionality"""
@@ -58,5 +64,94 @@ def test_study_assistant():
         print(f"❌ Error during testing: {str(e)}")
         print("Please check your API key and internet connection.")
 
+def test_key_pool():
+    """Test API key pool balancing and draining against stub keys with their own quotas (no API key needed)"""
+    print("🔑 Testing API key pool...")
+    
+    def stub_key(name, quota):
+        return PooledKey(name, StubBackend(latency_ms=0, output_chars=100, chunk_interval_ms=0, quota_rpm=quota))
+    
+    # Calls are spread evenly, so three keys serve three keys' worth of quota
+    pool = KeyPool([stub_key("key1", 5), stub_key("key2", 5), stub_key("key3", 5)])
+    for i in range(15):
+        pool.generate(f"Question {i}")
+    stats = pool.key_stats()
+    assert [stats[key]["calls"] for key in ("key1", "key2", "key3")] == [5, 5, 5]
+    assert not any(key_stats["drained"] for key_stats in stats.values())
+    
+    # Once every key is over its quota, each is drained and the call fails with a 429
+    try:
+        pool.generate("One question too many")
+        raise AssertionError("Expected every key to be over its quota")
+    except UpstreamError as e:
+        assert e.kind == "rate_limited" and e.status == 429 and e.retry_after > 0
+    stats = pool.key_stats()
+    assert all(key_stats["drained"] and key_stats["quota_errors"] == 1 for key_stats in stats.values())
+    
+    # A key that runs out is drained and the call moves on to another key
+    pool = KeyPool([stub_key("small", 1), stub_key("large", 100)])
+    for i in range(6):
+        assert "".join(pool.stream(f"Topic {i}"))
+    stats = pool.key_stats()
+    assert stats["small"]["drained"] and stats["small"]["drains"] == 1
+    assert stats["large"]["calls"] == 5 and stats["large"]["errors"] == 0
+    print("✅ Key pool balances calls and drains keys over their quota!")
+
+def test_topic_matching():
+    """Test that topic variations share an entry and that different topics never do (no API key needed)"""
+    print("🔎 Testing topic matching...")
+    same = [
+        ("Neural Networks", "  NEURAL networks basics"),
+        ("Photosynthesis in Plants", "Photosynthsis in Plants"),
+    ]
+    different = [
+        ("Calculus 2", "Calculus 3"),
+        ("Vitamin B", "Vitamin C"),
+        ("Physics for Machine Learning", "Machine Learning for Physics"),
+        ("Organic Chemistry", "Inorganic Chemistry"),
+        ("Supervised Learning", "Unsupervised Learning"),
+        ("Macroeconomics", "Microeconomics"),
+        ("Hypotension", "Hypertension"),
+        ("Hypothyroidism", "Hyperthyroidism"),
+        ("Meiosis", "Mitosis"),
+        ("Eukaryotic Cells", "Prokaryotic Cells"),
+        ("Catabolism", "Anabolism"),
+        ("Nonlinear Algebra", "Linear Algebra"),
+        ("Endothermic Reactions", "Exothermic Reactions"),
+    ]
+    for first, second in same:
+        index = TopicIndex()
+        index.match(first)
+        assert index.match(second) == first, (first, second)
+    for first, second in different:
+        # Either one may be seen first
+        for seen, asked in ((first, second), (second, first)):
+            index = TopicIndex()
+            index.match(seen)
+            assert index.match(asked) == asked, (seen, asked)
+    print("✅ Topic variations match and different topics stay apart!")
+
+def test_gemini_key_binding():
+    """Check the SDK internals GeminiBackend uses to give each pooled key its own client (no API key needed)"""
+    print("🔌 Testing Gemini client binding...")
+    from google.generativeai.client import _ClientManager
+    
+    assert callable(getattr(_ClientManager, "get_default_client", None))
+    first = GeminiBackend(api_key="first-key", configure_global=False)
+    second = GeminiBackend(api_key="second-key", configure_global=False)
+    # Each backend's model calls through a client made with its own key
+    assert first.model._client is first._clients.get_default_client("generative")
+    assert first.model._client is not second.model._client
+    
+    async def async_clients():
+        return first._amodel_for(None)._async_client, second._amodel_for(None)._async_client
+    
+    first_async, second_async = asyncio.run(async_clients())
+    assert first_async is not None and first_async is not second_async
+    print("✅ Each Gemini backend uses its own API key's clients!")
+
 if __name__ == "__main__":
-    test_study_assistant() 
\ No newline at end of file
+    test_study_assistant()
+    test_key_pool()
+    test_topic_matching()
+    test_gemini_key_binding() 
\ No newline at end of file
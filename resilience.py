@@ -0,0 +1,433 @@
+"""
+Resilient upstream client for Study Assistant
+ResilientBackend wraps a model backend (see backends.py) with the same
+interface and adds:
+    - client-side token buckets for requests per minute and tokens per minute,
+      so bursts queue briefly instead of running into the API quota
+    - jittered exponential retry, for retryable errors only (429, 5xx, timeouts)
+    - a circuit breaker that fails fast while the upstream is unhealthy
+    - deadlines: calls given a timeout never wait, retry or stream past it
+Failures surface as UpstreamError, which carries the HTTP status and error type
+the web app should answer with.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+
+from metrics import UPSTREAM_ERRORS, UPSTREAM_FIRST_CHUNK, UPSTREAM_LATENCY
+from text_chunks import estimate_tokens
+
+# upstream HTTP status -> (error type, status to answer with, retryable)
+STATUS_MAP = {
+    400: ("invalid_request", 400, False),
+    401: ("auth", 502, False),
+    403: ("auth", 502, False),
+    404: ("invalid_request", 400, False),
+    408: ("timeout", 504, True),
+    429: ("rate_limited", 429, True),
+    500: ("unavailable", 503, True),
+    502: ("unavailable", 503, True),
+    503: ("unavailable", 503, True),
+    504: ("timeout", 504, True),
+}
+
+
+def context_kwargs(context):
+    """Only pass context= to backends when a cached context is in use"""
+    return {"context": context} if context is not None else {}
+
+
+def deadline_exceeded():
+    return UpstreamError("The request took too long and was stopped", kind="deadline_exceeded", status=504)
+
+
+def remaining(deadline):
+    """Seconds left before a time.monotonic() deadline (None without one); raises once it has passed"""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise deadline_exceeded()
+    return left
+
+
+def timeout_kwargs(deadline):
+    """Only pass timeout= to backends when the request has a deadline"""
+    return {"timeout": remaining(deadline)} if deadline is not None else {}
+
+
+def deadline_after(timeout):
+    """The time.monotonic() deadline for a timeout in seconds (None: no deadline)"""
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+async def within(awaitable, deadline):
+    """Await with the time left before deadline; cancels the awaitable when it runs out"""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, remaining(deadline))
+    except asyncio.TimeoutError:
+        if time.monotonic() < deadline:
+            raise  # the awaitable's own timeout
+        raise deadline_exceeded() from None
+
+
+class UpstreamError(Exception):
+    """A generation failed; carries what the API should tell the client"""
+
+    def __init__(self, message, kind="upstream_error", status=502, retryable=False, retry_after=None, label=None):
+        super().__init__(message)
+        self.message = message
+        self.kind = kind
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.label = label
+
+    def __str__(self):
+        return f"{self.label}: {self.message}" if self.label else self.message
+
+    @classmethod
+    def from_exception(cls, exc, label=None):
+        """Classify any exception raised while generating
+
+        Backends report the upstream HTTP status in a `code` attribute
+        (google.api_core exceptions and StubBackendError both do).
+        """
+        if isinstance(exc, cls):
+            if label and not exc.label:
+                exc.label = label
+            return exc
+        code = getattr(exc, "code", None)
+        if isinstance(code, int) and code in STATUS_MAP:
+            kind, status, retryable = STATUS_MAP[code]
+        elif isinstance(code, int) and code >= 500:
+            kind, status, retryable = "unavailable", 503, True
+        elif isinstance(exc, (TimeoutError, asyncio.TimeoutError)):
+            kind, status, retryable = "timeout", 504, True
+        elif isinstance(exc, ConnectionError):
+            kind, status, retryable = "unavailable", 503, True
+        elif isinstance(code, int):
+            kind, status, retryable = "upstream_error", 502, False
+        else:
+            kind, status, retryable = "internal", 500, False
+        return cls(str(exc) or type(exc).__name__, kind=kind, status=status, retryable=retryable, label=label)
+
+    def to_dict(self):
+        payload = {"error": str(self), "type": self.kind, "retryable": self.retryable}
+        if self.retry_after is not None:
+            payload["retry_after"] = round(self.retry_after, 1)
+        return payload
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `per_minute` tokens per minute
+
+    Callers reserve tokens up front and are told how long to wait before
+    using them, so sync and async code can share one bucket.
+    """
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, max_wait=None):
+        """Take `amount` tokens and return the seconds to wait before using them
+
+        Returns None, without taking anything, if the wait would exceed max_wait.
+        """
+        with self._lock:
+            self._refill()
+            amount = min(amount, self.capacity)
+            wait = max(0.0, (amount - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.tokens -= amount
+            return wait
+
+    def refund(self, amount):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+    def available(self):
+        """Tokens left right now (negative while in debt)"""
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+    def charge(self, amount):
+        """Account for tokens already spent (e.g. output tokens); may go into debt"""
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+
+class CircuitBreaker:
+    """Open after `failure_threshold` consecutive failures; probe again after reset_timeout"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raise UpstreamError while open; lets one probe through per reset_timeout"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise UpstreamError(
+                    "The model service is temporarily unavailable, please retry shortly",
+                    kind="circuit_open", status=503, retryable=True, retry_after=remaining,
+                )
+            # Half-open: this call is the probe; re-arm so concurrent calls keep failing fast
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.opens += 1
+                self.opened_at = time.monotonic()
+
+
+class ResilientBackend:
+    """Rate limiting, retries and a circuit breaker around another backend"""
+
+    def __init__(self, backend, requests_per_minute=0, tokens_per_minute=0, max_retries=3,
+                 base_delay=0.5, max_delay=8.0, failure_threshold=5, reset_timeout=30.0, max_wait=30.0):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout) if failure_threshold else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, backend):
+        """Wrap a backend using STUDY_RPM, STUDY_TPM, STUDY_RETRY_* and STUDY_BREAKER_* settings"""
+        return cls(
+            backend,
+            requests_per_minute=int(os.getenv("STUDY_RPM", "0")),
+            tokens_per_minute=int(os.getenv("STUDY_TPM", "0")),
+            max_retries=int(os.getenv("STUDY_RETRIES", "3")),
+            base_delay=float(os.getenv("STUDY_RETRY_BASE_MS", "500")) / 1000.0,
+            max_delay=float(os.getenv("STUDY_RETRY_MAX_MS", "8000")) / 1000.0,
+            failure_threshold=int(os.getenv("STUDY_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("STUDY_BREAKER_RESET", "30")),
+            max_wait=float(os.getenv("STUDY_THROTTLE_MAX_WAIT", "30")),
+        )
+
+    def __getattr__(self, name):
+        # Anything else (system_instruction, create_context, ...) is the wrapped backend's
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def _admit(self, prompt, deadline=None):
+        """Check the breaker and reserve quota; returns the seconds to wait before calling"""
+        if self.breaker is not None:
+            try:
+                self.breaker.before_call()
+            except UpstreamError as e:
+                UPSTREAM_ERRORS.inc(model=self.model_name, type=e.kind)
+                raise
+        waits = []
+        taken = []
+        for bucket, amount in ((self.request_bucket, 1), (self.token_bucket, estimate_tokens(prompt))):
+            if bucket is None:
+                continue
+            max_wait = self.max_wait if deadline is None else min(self.max_wait, remaining(deadline))
+            wait = bucket.reserve(amount, max_wait)
+            if wait is None:
+                for previous, previous_amount in taken:
+                    previous.refund(previous_amount)
+                with self._lock:
+                    self.rejected += 1
+                UPSTREAM_ERRORS.inc(model=self.model_name, type="rate_limited")
+                raise UpstreamError(
+                    "Request quota exhausted, please retry shortly",
+                    kind="rate_limited", status=429, retryable=True,
+                    retry_after=amount / bucket.rate,
+                )
+            taken.append((bucket, amount))
+            waits.append(wait)
+        wait = max(waits, default=0.0)
+        with self._lock:
+            self.calls += 1
+            self.throttled_seconds += wait
+        return wait
+
+    def _succeeded(self, text, operation, start):
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, model=self.model_name, operation=operation)
+        if self.breaker is not None:
+            self.breaker.record_success()
+        if self.token_bucket is not None:
+            self.token_bucket.charge(estimate_tokens(text))
+
+    def _failed(self, exc, attempt, produced_output, operation, start, deadline=None):
+        """Classify a failure; returns (error, seconds to wait before retrying or None)"""
+        error = UpstreamError.from_exception(exc)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, model=self.model_name, operation=operation)
+        if deadline is not None and time.monotonic() >= deadline:
+            # The request's own time limit ran out; that says nothing about the upstream's health
+            UPSTREAM_ERRORS.inc(model=self.model_name, type="deadline_exceeded")
+            return deadline_exceeded(), None
+        UPSTREAM_ERRORS.inc(model=self.model_name, type=error.kind)
+        if error.retryable and self.breaker is not None:
+            self.breaker.record_failure()
+        with self._lock:
+            self.failures += 1
+        if not error.retryable or produced_output or attempt >= self.max_retries:
+            return error, None
+        # Full jitter keeps a crowd of clients from retrying in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return error, None
+        with self._lock:
+            self.retries += 1
+        return error, delay
+
+    def generate(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        attempt = 0
+        while True:
+            time.sleep(self._admit(prompt, deadline))
+            start = time.perf_counter()
+            try:
+                text = self.backend.generate(prompt, **context_kwargs(context), **timeout_kwargs(deadline))
+            except Exception as e:
+                error, delay = self._failed(e, attempt, False, "generate", start, deadline)
+                if delay is None:
+                    raise error from e
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(text, "generate", start)
+            return text
+
+    def stream(self, prompt, context=None, timeout=None):
+        # Only retried until the first chunk is out; after that a retry would repeat text
+        deadline = deadline_after(timeout)
+        attempt = 0
+        while True:
+            time.sleep(self._admit(prompt, deadline))
+            start = time.perf_counter()
+            parts = []
+            try:
+                for chunk in self.backend.stream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)):
+                    if not parts:
+                        UPSTREAM_FIRST_CHUNK.observe(time.perf_counter() - start, model=self.model_name)
+                    parts.append(chunk)
+                    yield chunk
+                    # Closing the backend's stream stops the generation
+                    remaining(deadline)
+            except Exception as e:
+                error, delay = self._failed(e, attempt, bool(parts), "stream", start, deadline)
+                if delay is None:
+                    raise error from e
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded("".join(parts), "stream", start)
+            return
+
+    async def agenerate(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admit(prompt, deadline))
+            start = time.perf_counter()
+            try:
+                text = await within(self.backend.agenerate(prompt, **context_kwargs(context), **timeout_kwargs(deadline)), deadline)
+            except Exception as e:
+                error, delay = self._failed(e, attempt, False, "generate", start, deadline)
+                if delay is None:
+                    raise error from e
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(text, "generate", start)
+            return text
+
+    async def astream(self, prompt, context=None, timeout=None):
+        deadline = deadline_after(timeout)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admit(prompt, deadline))
+            start = time.perf_counter()
+            parts = []
+            chunks = self.backend.astream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)).__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await within(chunks.__anext__(), deadline)
+                    except StopAsyncIteration:
+                        break
+                    if not parts:
+                        UPSTREAM_FIRST_CHUNK.observe(time.perf_counter() - start, model=self.model_name)
+                    parts.append(chunk)
+                    yield chunk
+            except Exception as e:
+                error, delay = self._failed(e, attempt, bool(parts), "stream", start, deadline)
+                if delay is None:
+                    raise error from e
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            finally:
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+            self._succeeded("".join(parts), "stream", start)
+            return
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "circuit": self.breaker.state if self.breaker is not None else "disabled",
+                "circuit_opens": self.breaker.opens if self.breaker is not None else 0,
+            }
@@ -0,0 +1,205 @@
+"""
+Response cache for Study Assistant generations
+Keeps recent model responses in an in-memory LRU and, optionally, in a
+SQLite file that every Flask worker process can share.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Error responses produced by StudyAssistant start with this markup
+ERROR_MARKER = "alert-danger"
+
+# Default home of every on-disk cache and database; next to the code, not the working directory
+CACHE_DIR = os.getenv("STUDY_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+
+def make_cache_key(prompt_name, params, model_name):
+    """Build a stable cache key from the prompt template, its parameters and the model"""
+    payload = json.dumps(
+        {"prompt": prompt_name, "params": params, "model": model_name},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(value):
+    """Only real model output is cached, never empty or error responses"""
+    return isinstance(value, str) and value.strip() != "" and ERROR_MARKER not in value[:200]
+
+
+class ResponseCache:
+    """Two-tier response cache: in-memory LRU with TTL plus an optional SQLite tier"""
+
+    def __init__(self, max_entries=256, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "rejected": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+        if self.db_path:
+            self._init_db()
+
+    @classmethod
+    def from_env(cls):
+        """Create a cache from STUDY_CACHE_* environment variables, or None when disabled"""
+        if os.getenv("STUDY_CACHE_ENABLED", "1").lower() in ("0", "false", "no"):
+            return None
+        return cls(
+            max_entries=int(os.getenv("STUDY_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("STUDY_CACHE_TTL", "3600")),
+            db_path=os.getenv("STUDY_CACHE_DB") or None,
+        )
+
+    def _connect(self):
+        """Return this thread's SQLite connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at)")
+        conn.commit()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._counters["hits"] += 1
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._counters["expirations"] += 1
+
+        if self.db_path:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is not None:
+                value, expires_at = row
+                self._remember(key, value, expires_at)
+                with self._lock:
+                    self._counters["hits"] += 1
+                    self._counters["disk_hits"] += 1
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl=None):
+        """Store a model response; error and empty responses are ignored"""
+        if not is_cacheable(value):
+            self._count("rejected")
+            return False
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+        if self.db_path:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, expires_at),
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            conn.commit()
+        self._count("stores")
+        return True
+
+    def expires_at(self, key):
+        """Expiry timestamp of a live entry, or None if key isn't cached (counters are not touched)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[0]
+        if self.db_path:
+            row = self._connect().execute(
+                "SELECT expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                return row[0]
+        return None
+
+    def delete(self, key):
+        """Drop one entry from both tiers"""
+        with self._lock:
+            self._memory.pop(key, None)
+        if self.db_path:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+
+    def _remember(self, key, value, expires_at):
+        """Put an entry in the memory tier, evicting least recently used entries"""
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        """Drop every cached response from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        if self.db_path:
+            stats["disk_entries"] = self._connect().execute(
+                "SELECT COUNT(*) FROM responses WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return stats
@@ -0,0 +1,202 @@
+"""
+Reference retrieval for Study Assistant
+Splits uploaded reference files into chunks, indexes them with BM25 and picks
+the chunks most relevant to an assignment within a token budget, instead of
+pasting every file into the prompt. Indexes are stored on disk per upload set
+(keyed by the files' content hashes), so regenerating an assignment with the
+same references reuses the index without rebuilding it.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from response_cache import CACHE_DIR
+from text_chunks import estimate_tokens, split_text
+
+WORD = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can do does for from has have how i if in into is it its "
+    "me my no not of on or our so such than that the their them then there these they this to "
+    "was we were what when where which while who why will with would you your".split()
+)
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords"""
+    return [word for word in WORD.findall(text.lower()) if word not in STOPWORDS and len(word) > 1]
+
+
+class BM25Index:
+    """Okapi BM25 over a list of chunks
+
+    Each chunk is a dict with sha256 (of its source file), position (order
+    within the file) and text.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(chunk["text"])) for chunk in chunks]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            document_frequency.update(counts.keys())
+        total = len(chunks)
+        self.idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def scores(self, query):
+        """BM25 score of every chunk for the query"""
+        terms = set(tokenize(query))
+        results = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+    def select(self, query, max_tokens):
+        """Best-scoring chunks that fit in max_tokens, returned in document order
+
+        When nothing matches the query, the opening chunks are used instead.
+        """
+        scores = self.scores(query)
+        matched = any(score > 0 for score in scores)
+        ranked = sorted(range(len(self.chunks)), key=lambda i: (-scores[i], i))
+        chosen, used = [], 0
+        for i in ranked:
+            if matched and scores[i] <= 0:
+                break
+            tokens = estimate_tokens(self.chunks[i]["text"])
+            if used + tokens > max_tokens:
+                continue
+            chosen.append(i)
+            used += tokens
+        chosen.sort()
+        return [dict(self.chunks[i], score=round(scores[i], 4)) for i in chosen]
+
+    def to_dict(self):
+        return {"k1": self.k1, "b": self.b, "chunks": self.chunks}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["chunks"], k1=data["k1"], b=data["b"])
+
+
+class ReferenceRetriever:
+    """Build or reuse the BM25 index for a set of reference documents and query it"""
+
+    def __init__(self, max_tokens=6000, chunk_tokens=400, cache_dir=None, memory_entries=32):
+        self.max_tokens = max_tokens
+        self.chunk_tokens = chunk_tokens
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Create a retriever from STUDY_REFERENCE_* environment variables"""
+        return cls(
+            max_tokens=int(os.getenv("STUDY_REFERENCE_TOKENS", "6000")),
+            chunk_tokens=int(os.getenv("STUDY_REFERENCE_CHUNK_TOKENS", "400")),
+            cache_dir=os.getenv("STUDY_REFERENCE_INDEX_DIR", os.path.join(CACHE_DIR, "reference_index")),
+        )
+
+    def index_key(self, documents):
+        """Identify an upload set by the content of its files, not their names or order"""
+        digests = sorted(document["sha256"] for document in documents)
+        raw = json.dumps({"files": digests, "chunk_tokens": self.chunk_tokens})
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _index_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key):
+        with self._lock:
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+                return self._indexes[key]
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._index_path(key), "r", encoding="utf-8") as f:
+                index = BM25Index.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+        self._remember(key, index)
+        return index
+
+    def _remember(self, key, index):
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.memory_entries:
+                self._indexes.popitem(last=False)
+
+    def _save(self, key, index):
+        if not self.cache_dir:
+            return
+        path = self._index_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(temp_path, path)
+
+    def build(self, documents):
+        """Chunk and index documents; each has filename, sha256 and text"""
+        chunks = []
+        for document in sorted(documents, key=lambda d: d["sha256"]):
+            for position, text in enumerate(split_text(document["text"], self.chunk_tokens)):
+                chunks.append({"sha256": document["sha256"], "position": position, "text": text})
+        return BM25Index(chunks)
+
+    def retrieve(self, documents, query):
+        """Return (selected chunks, info) for the query; chunks carry filename and text
+
+        If every document fits in the budget together, all of it is returned
+        and no index is built.
+        """
+        total_tokens = sum(estimate_tokens(document["text"]) for document in documents)
+        if total_tokens <= self.max_tokens:
+            chunks = [{"filename": document["filename"], "position": 0, "text": document["text"]}
+                      for document in documents if document["text"]]
+            return chunks, {"mode": "full", "total_tokens": total_tokens, "selected_tokens": total_tokens}
+
+        key = self.index_key(documents)
+        index = self._load(key)
+        reused = index is not None
+        if index is None:
+            index = self.build(documents)
+            self._save(key, index)
+            self._remember(key, index)
+
+        # The index may have been built from the same files under other names
+        names = {document["sha256"]: document["filename"] for document in documents}
+        selected = [dict(chunk, filename=names.get(chunk["sha256"], "reference"))
+                    for chunk in index.select(query, self.max_tokens)]
+        return selected, {
+            "mode": "bm25",
+            "index": key[:16],
+            "index_reused": reused,
+            "chunks_total": len(index.chunks),
+            "chunks_selected": len(selected),
+            "total_tokens": total_tokens,
+            "selected_tokens": sum(estimate_tokens(chunk["text"]) for chunk in selected),
+        }
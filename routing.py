@@ -0,0 +1,300 @@
+"""
+Model routing for Study Assistant
+Picks the model for each call from configurable rules. A rule matches on the
+feature (study_guide, practice_questions, explain_topic, summarize,
+assignment), the prompt template, summary_type, output_format, num_questions
+and the estimated input tokens, and lists the models eligible for those calls.
+Among the eligible models the router picks the one with the lowest recently
+observed latency for that feature, so traffic shifts towards whichever model
+is currently fastest. A small share of calls still explores the others.
+
+Rules come from a JSON file (or inline JSON) named by STUDY_MODEL_ROUTES:
+    {
+        "rules": [
+            {"feature": "practice_questions", "max_num_questions": 5, "models": ["gemini-2.5-flash-lite"]},
+            {"feature": "summarize", "summary_type": "brief", "models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"]},
+            {"feature": "assignment", "min_input_tokens": 4000, "models": ["gemini-2.5-pro", "gemini-2.5-flash"]}
+        ],
+        "default": ["gemini-2.5-flash"]
+    }
+The first matching rule wins; calls no rule matches use "default" (the
+STUDY_MODEL model if not given).
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+from metrics import TOKENS
+
+CONDITIONS = (
+    "feature",
+    "prompt",
+    "summary_type",
+    "output_format",
+    "min_num_questions",
+    "max_num_questions",
+    "min_input_tokens",
+    "max_input_tokens",
+)
+
+
+class Rule:
+    """A set of conditions on a call's traits and the models eligible when they all hold"""
+
+    def __init__(self, name, models, conditions=None):
+        if not models:
+            raise ValueError(f"Route {name!r} lists no models")
+        unknown = set(conditions or {}) - set(CONDITIONS)
+        if unknown:
+            raise ValueError(f"Route {name!r} has unknown conditions: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.models = list(models)
+        self.conditions = dict(conditions or {})
+        # Every model of a route answers the same requests, so they share cache entries
+        self.cache_name = "+".join(self.models)
+
+    def matches(self, traits):
+        for condition, expected in self.conditions.items():
+            if condition.startswith(("min_", "max_")):
+                value = traits.get(condition[4:])
+                if value is None:
+                    return False
+                if condition.startswith("min_") and value < expected:
+                    return False
+                if condition.startswith("max_") and value > expected:
+                    return False
+            else:
+                value = traits.get(condition)
+                allowed = expected if isinstance(expected, list) else [expected]
+                if value is None or str(value).lower() not in {str(item).lower() for item in allowed}:
+                    return False
+        return True
+
+
+class RoutedBackend:
+    """One model's backend, reporting each call's latency to the router"""
+
+    def __init__(self, router, backend, feature):
+        self.router = router
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.feature = feature
+
+    def __getattr__(self, name):
+        # create_context, refresh_context, ... are the model backend's
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def generate(self, prompt, **kwargs):
+        self.router._started(self.model_name)
+        start = time.perf_counter()
+        try:
+            text = self.backend.generate(prompt, **kwargs)
+        except Exception:
+            self.router._observe(self.model_name, self.feature, "generate", time.perf_counter() - start, failed=True)
+            raise
+        finally:
+            self.router._finished(self.model_name)
+        self.router._observe(self.model_name, self.feature, "generate", time.perf_counter() - start)
+        return text
+
+    def stream(self, prompt, **kwargs):
+        # Streams are compared by time to the first chunk
+        self.router._started(self.model_name)
+        start = time.perf_counter()
+        first = True
+        try:
+            for chunk in self.backend.stream(prompt, **kwargs):
+                if first:
+                    self.router._observe(self.model_name, self.feature, "stream", time.perf_counter() - start)
+                    first = False
+                yield chunk
+        except Exception:
+            self.router._observe(self.model_name, self.feature, "stream", time.perf_counter() - start,
+                                 failed=True, sample=first)
+            raise
+        finally:
+            self.router._finished(self.model_name)
+
+    async def agenerate(self, prompt, **kwargs):
+        self.router._started(self.model_name)
+        start = time.perf_counter()
+        try:
+            text = await self.backend.agenerate(prompt, **kwargs)
+        except Exception:
+            self.router._observe(self.model_name, self.feature, "generate", time.perf_counter() - start, failed=True)
+            raise
+        finally:
+            self.router._finished(self.model_name)
+        self.router._observe(self.model_name, self.feature, "generate", time.perf_counter() - start)
+        return text
+
+    async def astream(self, prompt, **kwargs):
+        self.router._started(self.model_name)
+        start = time.perf_counter()
+        first = True
+        chunks = self.backend.astream(prompt, **kwargs)
+        try:
+            async for chunk in chunks:
+                if first:
+                    self.router._observe(self.model_name, self.feature, "stream", time.perf_counter() - start)
+                    first = False
+                yield chunk
+        except Exception:
+            self.router._observe(self.model_name, self.feature, "stream", time.perf_counter() - start,
+                                 failed=True, sample=first)
+            raise
+        finally:
+            self.router._finished(self.model_name)
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+
+class ModelRouter:
+    """Chooses a model per call by rules, then by observed latency
+
+    Latency is tracked per (model, feature, operation) as an exponentially
+    weighted moving average with weight alpha; "generate" calls are timed to
+    completion and "stream" calls to their first chunk. A model needs
+    min_samples observations before it is compared; until then it is tried
+    first. explore is the share of calls sent to a random eligible model.
+    Failed calls count as at least twice the model's average latency.
+    """
+
+    def __init__(self, rules, default, factory, backends=None, alpha=0.2, explore=0.05, min_samples=3):
+        self.rules = list(rules)
+        self.default = Rule("default", default)
+        self.factory = factory
+        self.alpha = alpha
+        self.explore = explore
+        self.min_samples = min_samples
+        self._backends = dict(backends or {})
+        self._lock = threading.Lock()
+        self._latency = {}  # (model, feature, operation) -> [moving average seconds, samples]
+        self._calls = {}
+        self._errors = {}
+        self._in_flight = {}
+        self._routed = {}
+
+    @classmethod
+    def from_env(cls, backend, factory):
+        """A router from STUDY_MODEL_ROUTES (a JSON file or inline JSON), or None when unset
+
+        backend serves its own model; factory(model_name) builds the backends
+        of the other models on first use.
+        """
+        spec = os.getenv("STUDY_MODEL_ROUTES", "").strip()
+        if not spec:
+            return None
+        if spec.startswith("{"):
+            config = json.loads(spec)
+        else:
+            with open(spec, encoding="utf-8") as f:
+                config = json.load(f)
+        rules = []
+        for index, item in enumerate(config.get("rules", [])):
+            item = dict(item)
+            rules.append(Rule(item.pop("name", f"rule{index + 1}"), item.pop("models", None), item))
+        return cls(
+            rules,
+            config.get("default") or [backend.model_name],
+            factory,
+            backends={backend.model_name: backend},
+            alpha=float(os.getenv("STUDY_ROUTE_ALPHA", "0.2")),
+            explore=float(os.getenv("STUDY_ROUTE_EXPLORE", "0.05")),
+            min_samples=int(os.getenv("STUDY_ROUTE_MIN_SAMPLES", "3")),
+        )
+
+    def route(self, traits):
+        """The first rule matching a call's traits (the default route if none does)"""
+        for rule in self.rules:
+            if rule.matches(traits):
+                return rule
+        return self.default
+
+    def choose(self, route, feature, operation):
+        """The eligible model to call: untried ones first, then usually the fastest"""
+        with self._lock:
+            self._routed[route.name] = self._routed.get(route.name, 0) + 1
+            if len(route.models) == 1:
+                return route.models[0]
+
+            def samples(model):
+                return self._latency.get((model, feature, operation), (0, 0))[1]
+
+            untried = [model for model in route.models if samples(model) < self.min_samples]
+            if untried:
+                # Count calls in flight too, so a burst doesn't all go to one untried model
+                return min(untried, key=lambda model: samples(model) + self._in_flight.get(model, 0))
+            if random.random() < self.explore:
+                return random.choice(route.models)
+            return min(route.models, key=lambda model: self._latency[(model, feature, operation)][0])
+
+    def backend(self, model, feature):
+        """The backend for a model, reporting latency under feature"""
+        backend = self._backends.get(model)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.get(model)
+                if backend is None:
+                    backend = self._backends[model] = self.factory(model)
+        return RoutedBackend(self, backend, feature)
+
+    def backends(self):
+        """model -> backend, for the models called so far"""
+        with self._lock:
+            return dict(self._backends)
+
+    def _started(self, model):
+        with self._lock:
+            self._calls[model] = self._calls.get(model, 0) + 1
+            self._in_flight[model] = self._in_flight.get(model, 0) + 1
+
+    def _finished(self, model):
+        with self._lock:
+            self._in_flight[model] -= 1
+
+    def _observe(self, model, feature, operation, seconds, failed=False, sample=True):
+        with self._lock:
+            if failed:
+                self._errors[model] = self._errors.get(model, 0) + 1
+            if not sample:
+                return
+            key = (model, feature, operation)
+            average, count = self._latency.get(key, (None, 0))
+            if failed and average is not None:
+                seconds = max(seconds, 2 * average)
+            average = seconds if average is None else average + self.alpha * (seconds - average)
+            self._latency[key] = [average, count + 1]
+
+    def latency_samples(self):
+        """(model, feature, operation, moving average seconds, samples) for every tracked combination"""
+        with self._lock:
+            return [(*key, average, count) for key, (average, count) in sorted(self._latency.items())]
+
+    def stats(self):
+        models = sorted({model for rule in [*self.rules, self.default] for model in rule.models})
+        with self._lock:
+            return {
+                "routes": {rule.name: {"models": rule.models, "calls": self._routed.get(rule.name, 0)}
+                           for rule in [*self.rules, self.default]},
+                "models": {
+                    model: {
+                        "calls": self._calls.get(model, 0),
+                        "errors": self._errors.get(model, 0),
+                        "in_flight": self._in_flight.get(model, 0),
+                        "prompt_tokens": TOKENS.value(model=model, kind="prompt"),
+                        "output_tokens": TOKENS.value(model=model, kind="output"),
+                        "latency_ms": {
+                            f"{feature}.{operation}": round(average * 1000)
+                            for (name, feature, operation), (average, _) in sorted(self._latency.items())
+                            if name == model
+                        },
+                    }
+                    for model in models
+                },
+            }
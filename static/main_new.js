@@ -38,6 +38,155 @@ document.getElementById('exploreFeatures')?.addEventListener('click', function(e
     }
 });
 
+// Read a Server-Sent Events response body, calling onEvent(name, data) for each event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let name = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) name = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(name, JSON.parse(data));
+        }
+    }
+}
+
+// Streaming needs fetch() with a readable response body
+const supportsStreaming = typeof ReadableStream !== 'undefined' && typeof TextDecoder !== 'undefined';
+
+// JSON with sorted object keys, so equal parameters always give the same string
+function stableStringify(value) {
+    if (Array.isArray(value)) return '[' + value.map(stableStringify).join(',') + ']';
+    if (value && typeof value === 'object') {
+        return '{' + Object.keys(value).sort()
+            .map(key => JSON.stringify(key) + ':' + stableStringify(value[key])).join(',') + '}';
+    }
+    return JSON.stringify(value === undefined ? null : value);
+}
+
+function requestSignature(url, payload) {
+    return url + '\n' + stableStringify(payload);
+}
+
+// Cache key for a request: a SHA-256 of its signature (long texts make long
+// signatures), or the signature itself where WebCrypto is unavailable (plain http)
+async function requestKey(url, payload) {
+    const signature = requestSignature(url, payload);
+    if (!(window.crypto && crypto.subtle)) return signature;
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(signature));
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Recent results are kept in IndexedDB, so asking for the same thing again,
+// even after a reload, is answered without a request. The least recently used
+// entries beyond RESULT_CACHE_MAX_ENTRIES are dropped.
+const RESULT_CACHE_MAX_ENTRIES = 50;
+const RESULT_CACHE_TTL_MS = 24 * 60 * 60 * 1000;
+
+const resultCache = {
+    db: null,
+
+    open() {
+        if (!this.db) {
+            this.db = new Promise((resolve, reject) => {
+                if (typeof indexedDB === 'undefined') {
+                    reject(new Error('IndexedDB is not available'));
+                    return;
+                }
+                const request = indexedDB.open('study-assistant', 1);
+                request.onupgradeneeded = () => {
+                    const store = request.result.createObjectStore('results', { keyPath: 'key' });
+                    store.createIndex('usedAt', 'usedAt');
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        }
+        return this.db;
+    },
+
+    // Run fn(store) in a transaction; resolves with the result of the request fn returns
+    async transaction(mode, fn) {
+        const db = await this.open();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction('results', mode);
+            const request = fn(tx.objectStore('results'));
+            tx.oncomplete = () => resolve(request ? request.result : undefined);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    },
+
+    async get(key) {
+        try {
+            const entry = await this.transaction('readonly', store => store.get(key));
+            if (!entry || Date.now() - entry.savedAt > RESULT_CACHE_TTL_MS) return null;
+            this.transaction('readwrite', store => store.put({ ...entry, usedAt: Date.now() })).catch(() => {});
+            return entry.html;
+        } catch (error) {
+            // No IndexedDB (some private windows) just means no cache
+            return null;
+        }
+    },
+
+    async set(key, html) {
+        try {
+            const now = Date.now();
+            await this.transaction('readwrite', store => store.put({ key, html, savedAt: now, usedAt: now }));
+            await this.transaction('readwrite', store => {
+                const count = store.count();
+                count.onsuccess = () => {
+                    let excess = count.result - RESULT_CACHE_MAX_ENTRIES;
+                    if (excess <= 0) return;
+                    store.index('usedAt').openCursor().onsuccess = event => {
+                        const cursor = event.target.result;
+                        if (cursor && excess-- > 0) {
+                            cursor.delete();
+                            cursor.continue();
+                        }
+                    };
+                };
+            });
+        } catch (error) {
+            console.warn('Result cache unavailable:', error);
+        }
+    }
+};
+
+// The request running for each endpoint: url -> { signature, controller }.
+// A new submission to an endpoint aborts the one it supersedes (closing the
+// connection also stops the generation on the server); resubmitting the
+// request that is already running is ignored.
+const inFlight = new Map();
+
+function isPending(url, payload) {
+    const pending = inFlight.get(url);
+    return Boolean(pending) && pending.signature === requestSignature(url, payload);
+}
+
+function isBusy(url) {
+    return inFlight.has(url);
+}
+
+function isAbortError(error) {
+    return Boolean(error) && error.name === 'AbortError';
+}
+
+function throwIfAborted(signal) {
+    if (signal.aborted) throw new DOMException('The request was superseded', 'AbortError');
+}
+
 // Initialize all event listeners when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize scroll reveal
@@ -55,7 +204,13 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!response.ok) {
             const errorText = await response.text();
             console.error('API Error:', errorText);
-            throw new Error(`Server error: ${response.status}`);
+            let message = `Server error: ${response.status}`;
+            try {
+                message = JSON.parse(errorText).error || message;
+            } catch (e) {
+                // Not a JSON error body
+            }
+            throw new Error(message);
         }
         
         const data = await response.json();
@@ -72,6 +227,83 @@ document.addEventListener('DOMContentLoaded', function() {
         return data;
     }
 
+    // Helper function to POST to an endpoint and render its HTML as it streams in.
+    // Falls back to the JSON response when streaming is unavailable. Results
+    // are served from and saved to the result cache unless cache is false.
+    // Rejects with an AbortError when a newer submission supersedes it.
+    async function postAndRender(url, payload, resultElementId, displayElementId, onProgress, cache = true) {
+        const pending = inFlight.get(url);
+        if (pending) pending.controller.abort();
+        const controller = new AbortController();
+        inFlight.set(url, { signature: requestSignature(url, payload), controller });
+        try {
+            return await fetchAndRender(url, payload, resultElementId, displayElementId, onProgress, cache, controller.signal);
+        } finally {
+            if (inFlight.get(url)?.controller === controller) inFlight.delete(url);
+        }
+    }
+
+    async function fetchAndRender(url, payload, resultElementId, displayElementId, onProgress, cache, signal) {
+        const resultElement = document.getElementById(resultElementId);
+        const key = cache ? await requestKey(url, payload) : null;
+        if (key) {
+            const cached = await resultCache.get(key);
+            throwIfAborted(signal);
+            if (cached !== null) {
+                resultElement.innerHTML = cached;
+                setElementDisplay(displayElementId || resultElementId, true);
+                return cached;
+            }
+        }
+
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': supportsStreaming ? 'text/event-stream' : 'application/json'
+            },
+            body: JSON.stringify(payload),
+            signal: signal
+        });
+
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!contentType.includes('text/event-stream')) {
+            const data = await handleApiResponse(response, resultElementId);
+            setElementDisplay(displayElementId || resultElementId, true);
+            if (key) resultCache.set(key, data[Object.keys(data)[0]]);
+            return data;
+        }
+
+        setElementDisplay(displayElementId || resultElementId, true);
+        let html = '';
+        let complete = false;
+        let renderPending = false;
+        const render = () => {
+            renderPending = false;
+            // A superseded stream must not paint over its replacement
+            if (!signal.aborted) resultElement.innerHTML = html;
+        };
+        await readEventStream(response, (event, data) => {
+            if (event === 'chunk') {
+                html += data.text;
+                if (!renderPending) {
+                    renderPending = true;
+                    requestAnimationFrame(render);
+                }
+            } else if (event === 'progress' && onProgress) {
+                onProgress(data.done, data.total);
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            } else if (event === 'done') {
+                complete = true;
+            }
+        });
+        render();
+        // Only whole results are cached, not streams cut short
+        if (key && complete) resultCache.set(key, html);
+        return html;
+    }
+
     // Helper function to show error message
     function showError(error, errorElementId) {
         console.error('Error:', error);
@@ -96,49 +328,34 @@ document.addEventListener('DOMContentLoaded', function() {
                 const topic = document.getElementById('guideTopic')?.value;
                 const level = document.getElementById('guideLevel')?.value || 'intermediate';
                 const focus = document.getElementById('guideFocus')?.value || '';
+                const payload = {
+                    topic: topic,
+                    level: level,
+                    focus_areas: focus
+                };
+                // Already being generated (a double click or resubmit)
+                if (isPending('/create_guide', payload)) return;
                 
                 setElementDisplay('guideLoading', true);
                 setElementDisplay('guideResult', false);
                 setElementDisplay('guideError', false);
                 
                 try {
-                    const response = await fetch('/create_guide', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'Accept': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            topic: topic,
-                            level: level,
-                            focus_areas: focus
-                        })
-                    });
-                    
-                    const result = await response.json();
-                    // First, show the result container
-                    setElementDisplay('guideResult', true);
-                    // Then update the content
-                    await handleApiResponse(response, 'guideResult');
-                    
-                    // Move the content to pdfContent div
-                    const resultElement = document.getElementById('guideResult');
-                    const resultContent = resultElement.innerHTML;
-                    document.getElementById('pdfContent').innerHTML = resultContent
-                        .replace('<div class="d-flex justify-content-end mb-3">', '')
-                        .replace('</div>', '');
+                    // Render straight into the PDF content area inside the result container
+                    await postAndRender('/create_guide', payload, 'pdfContent', 'guideResult');
                     
                     // Make sure the download buttons are visible
                     document.getElementById('downloadPdfBtn').style.display = 'block';
                     document.getElementById('downloadPdfBtnBottom').style.display = 'inline-block';
                     
                     // Add event listeners for download buttons
-                    document.getElementById('downloadPdfBtn').addEventListener('click', downloadAsPdf);
-                    document.getElementById('downloadPdfBtnBottom').addEventListener('click', downloadAsPdf);
+                    document.getElementById('downloadPdfBtn').onclick = downloadAsPdf;
+                    document.getElementById('downloadPdfBtnBottom').onclick = downloadAsPdf;
                 } catch (error) {
-                    showError(error, 'guideError');
+                    if (!isAbortError(error)) showError(error, 'guideError');
                 } finally {
-                    setElementDisplay('guideLoading', false);
+                    // The submission that superseded this one keeps its spinner
+                    if (!isBusy('/create_guide')) setElementDisplay('guideLoading', false);
                 }
             });
         }
@@ -156,29 +373,31 @@ document.addEventListener('DOMContentLoaded', function() {
                     Array.from(questionTypesSelect.selectedOptions).map(option => option.value) : 
                     ['multiple_choice', 'true_false', 'short_answer'];
                 
+                // Question bank ids already shown for this topic, so new requests get new questions
+                const seenKey = 'seenQuestions:' + (topic || '').trim().toLowerCase();
+                const seen = JSON.parse(sessionStorage.getItem(seenKey) || '[]');
+                const payload = {
+                    topic: topic,
+                    num_questions: parseInt(numQuestions),
+                    question_types: questionTypes,
+                    exclude: seen
+                };
+                if (isPending('/generate_questions', payload)) return;
+                
                 setElementDisplay('questionsLoading', true);
                 setElementDisplay('questionsResult', false);
                 setElementDisplay('questionsError', false);
                 
                 try {
-                    const response = await fetch('/generate_questions', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'Accept': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            topic: topic,
-                            num_questions: parseInt(numQuestions),
-                            question_types: questionTypes
-                        })
-                    });
-                    
-                    await handleApiResponse(response, 'questionsResult');
+                    // Not cached: asking again should bring new questions
+                    await postAndRender('/generate_questions', payload, 'questionsResult', null, null, false);
+                    const shown = Array.from(document.querySelectorAll('#questionsResult [data-question-id]'))
+                        .map(card => parseInt(card.dataset.questionId));
+                    sessionStorage.setItem(seenKey, JSON.stringify(seen.concat(shown).slice(-500)));
                 } catch (error) {
-                    showError(error, 'questionsError');
+                    if (!isAbortError(error)) showError(error, 'questionsError');
                 } finally {
-                    setElementDisplay('questionsLoading', false);
+                    if (!isBusy('/generate_questions')) setElementDisplay('questionsLoading', false);
                 }
             });
         }
@@ -191,29 +410,22 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 const topic = document.getElementById('explainTopic')?.value;
                 const level = document.getElementById('explainLevel')?.value || 'beginner';
+                const payload = {
+                    topic: topic,
+                    difficulty_level: level
+                };
+                if (isPending('/explain_topic', payload)) return;
                 
                 setElementDisplay('explainLoading', true);
                 setElementDisplay('explainResult', false);
                 setElementDisplay('explainError', false);
                 
                 try {
-                    const response = await fetch('/explain_topic', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'Accept': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            topic: topic,
-                            difficulty_level: level
-                        })
-                    });
-                    
-                    await handleApiResponse(response, 'explainResult');
+                    await postAndRender('/explain_topic', payload, 'explainResult');
                 } catch (error) {
-                    showError(error, 'explainError');
+                    if (!isAbortError(error)) showError(error, 'explainError');
                 } finally {
-                    setElementDisplay('explainLoading', false);
+                    if (!isBusy('/explain_topic')) setElementDisplay('explainLoading', false);
                 }
             });
         }
@@ -226,29 +438,30 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 const text = document.getElementById('summarizeText')?.value;
                 const summaryType = document.getElementById('summaryType')?.value || 'paragraph';
+                const payload = {
+                    text: text,
+                    summary_type: summaryType
+                };
+                if (isPending('/summarize_text', payload)) return;
                 
                 setElementDisplay('summarizeLoading', true);
                 setElementDisplay('summarizeResult', false);
                 setElementDisplay('summarizeError', false);
                 
                 try {
-                    const response = await fetch('/summarize_text', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'Accept': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            text: text,
-                            summary_type: summaryType
-                        })
+                    // Long texts are summarized in sections; show how far along we are
+                    const loadingText = document.querySelector('#summarizeLoading p');
+                    if (loadingText) {
+                        loadingText.dataset.defaultText = loadingText.dataset.defaultText || loadingText.textContent;
+                        loadingText.textContent = loadingText.dataset.defaultText;
+                    }
+                    await postAndRender('/summarize_text', payload, 'summarizeResult', null, (done, total) => {
+                        if (loadingText) loadingText.textContent = `Summarized section ${done} of ${total}...`;
                     });
-                    
-                    await handleApiResponse(response, 'summarizeResult');
                 } catch (error) {
-                    showError(error, 'summarizeError');
+                    if (!isAbortError(error)) showError(error, 'summarizeError');
                 } finally {
-                    setElementDisplay('summarizeLoading', false);
+                    if (!isBusy('/summarize_text')) setElementDisplay('summarizeLoading', false);
                 }
             });
         }
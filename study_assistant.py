@@ -1,93 +1,770 @@
+import argparse
 import os
-import google.generativeai as genai
+import asyncio
+import queue
+import threading
 from dotenv import load_dotenv
 import json
+import hashlib
+import inspect
+import time
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from response_cache import ResponseCache, make_cache_key
+from coalesce import SingleFlight, make_flight_key
+from context_cache import ContextCache
+from topic_index import TopicIndex
+from question_bank import QuestionBank, DEFAULT_TYPES, allocate, parse_questions, render_questions
+from grading import LOCAL_TYPES, failed_results, grade_locally, grading_items, model_results, summarize
+from backends import create_backend
+from resilience import UpstreamError, context_kwargs, remaining, timeout_kwargs, within
+from routing import ModelRouter
+from text_chunks import estimate_tokens, split_text, pack
 
 # Load environment variables
 load_dotenv()
 
-# Load prompts from prompts.json
-with open("prompts.json", "r", encoding="utf-8") as f:
-    PROMPTS = json.load(f)
+# prompts.json ships next to this module, whatever the working directory
+PROMPTS_PATH = os.getenv("STUDY_PROMPTS_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts.json")
+
+@lru_cache(maxsize=None)
+def load_prompts():
+    """Read and parse prompts.json once, on first use"""
+    with open(PROMPTS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def __getattr__(name):
+    # Keeps `from study_assistant import PROMPTS` working without loading at import time
+    if name == "PROMPTS":
+        return load_prompts()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Stands in for content that was moved into a provider-side cached context
+CACHED_CONTEXT_NOTE = "(provided in the cached reference material above)"
+
+# Sections of a study guide generated section by section: (title, what it covers)
+STUDY_GUIDE_SECTIONS = (
+    ("Learning Objectives", 'what the learner will be able to do afterwards, as a list inside <div class="alert alert-info">'),
+    ("Key Concepts and Definitions", "the core concepts, each with a clear definition"),
+    ("Important Points with Examples", "the most important points, each illustrated with a concrete example"),
+    ("Summary", 'a concise recap of the topic, with key takeaways inside <div class="alert alert-success">'),
+    ("Practice Questions", "a few questions with answers that check understanding of the topic"),
+    ("Recommended Resources", "books, courses and websites for further study"),
+)
+
+# Marks the end of one section's output in the sectional study guide queues
+_SECTION_DONE = object()
+
+# Batch mode: job feature -> StudyAssistant method
+BATCH_FEATURES = {
+    "study_guide": "create_study_guide",
+    "practice_questions": "generate_practice_questions",
+    "explain_topic": "explain_complex_topic",
+    "summarize": "summarize_text",
+    "assignment": "generate_assignment",
+    "grade_answers": "grade_answers",
+}
+
+# Prompt template -> feature, for model routing (see routing.py)
+PROMPT_FEATURES = {
+    "study_guide_prompt": "study_guide",
+    "study_guide_section_prompt": "study_guide",
+    "practice_questions_prompt": "practice_questions",
+    "question_bank_prompt": "practice_questions",
+    "explain_topic_prompt": "explain_topic",
+    "summarize_text_prompt": "summarize",
+    "summarize_chunk_prompt": "summarize",
+    "merge_summaries_prompt": "summarize",
+    "combine_summaries_prompt": "summarize",
+    "assignment_prompt": "assignment",
+    "grade_answers_prompt": "grading",
+}
+
+async def _single_chunk(text):
+    yield text
 
 class StudyAssistant:
-    def __init__(self):
-        """Initialize the Study Assistant with Gemini API"""
-        self.api_key = os.getenv('GOOGLE_API_KEY')
-        if not self.api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables")
+    def __init__(self, cache=None, coalescer=None, backend=None, context_cache=None, question_bank=None, topic_index=None,
+                 router=None):
+        """Initialize the Study Assistant with Gemini API
+
+        backend is the model backend (see backends.py); by default it is chosen
+        by STUDY_BACKEND and talks to Gemini, with the system prompt as its
+        system instruction. cache is an optional ResponseCache (or any object
+        with get/set) used to reuse responses for identical prompts. coalescer
+        is an optional SingleFlight that makes concurrent identical prompts
+        share one call. context_cache is an optional ContextCache that moves
+        large reference content into the provider's context cache.
+        question_bank is an optional QuestionBank that practice questions are
+        sampled from. topic_index is an optional TopicIndex that maps topics to
+        an equivalent one seen before, so trivial variations share cache entries.
+        router is an optional ModelRouter that picks the model for each call;
+        by default one is built from STUDY_MODEL_ROUTES, if set.
+        """
+        self.system_prompt = load_prompts()["system_prompt"]
+        self.backend = backend if backend is not None else create_backend(system_instruction=self.system_prompt)
+        self.model_name = self.backend.model_name
+        self.router = router if router is not None else ModelRouter.from_env(
+            self.backend, lambda model_name: create_backend(system_instruction=self.system_prompt, model_name=model_name))
+        self.cache = cache
+        self.coalescer = coalescer
+        self.context_cache = context_cache
+        self.question_bank = question_bank
+        self.topic_index = topic_index
+        # Long texts are summarized in chunks of this many (estimated) tokens
+        self.summary_chunk_tokens = int(os.getenv("STUDY_SUMMARY_CHUNK_TOKENS", "8000"))
+        self.summary_workers = int(os.getenv("STUDY_SUMMARY_WORKERS", "4"))
+        # Study guides can be generated as concurrent per-section calls
+        self.sectional_guides = os.getenv("STUDY_GUIDE_SECTIONAL", "0").lower() in ("1", "true", "yes", "on")
+        self.section_workers = int(os.getenv("STUDY_GUIDE_SECTION_WORKERS", str(len(STUDY_GUIDE_SECTIONS))))
+        # Free-text answers are graded this many to a model call
+        self.grade_batch = max(1, int(os.getenv("STUDY_GRADE_BATCH", "5")))
+        self.grade_workers = int(os.getenv("STUDY_GRADE_WORKERS", "4"))
+    
+    def _match_topic(self, topic):
+        """Return the known topic equivalent to this one ("neural network" -> "Neural Networks")"""
+        if self.topic_index is None or not topic:
+            return topic
+        return self.topic_index.match(topic)
+    
+    async def _off_loop(self, store, fn, *args):
+        """Call a cache or index method; in a thread when the store is backed by SQLite, so the loop never waits on disk"""
+        if getattr(store, "db_path", None):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+    
+    async def _amatch_topic(self, topic):
+        """Async version of _match_topic"""
+        if self.topic_index is None or not topic:
+            return topic
+        return await self._off_loop(self.topic_index, self.topic_index.match, topic)
+    
+    def _route(self, prompt_name, params):
+        """The router's rule for a prompt, or None without model routing"""
+        if self.router is None:
+            return None
+        return self.router.route({
+            "feature": PROMPT_FEATURES.get(prompt_name),
+            "prompt": prompt_name,
+            "summary_type": params.get("summary_type"),
+            "output_format": params.get("output_format"),
+            "num_questions": params.get("num_questions"),
+            "input_tokens": estimate_tokens(" ".join(str(value) for value in params.values())),
+        })
+    
+    def _pick(self, prompt_name, route, operation):
+        """The backend to call for a prompt on a route ("generate" or "stream")"""
+        if route is None:
+            return self.backend
+        feature = PROMPT_FEATURES.get(prompt_name, prompt_name)
+        return self.router.backend(self.router.choose(route, feature, operation), feature)
+    
+    def _cache_key(self, prompt_name, params, route=None):
+        # All models of a route serve the same requests, so they share entries
+        return make_cache_key(prompt_name, params, route.cache_name if route is not None else self.model_name)
+    
+    def _cache_lookup(self, prompt_name, params, cacheable, route=None):
+        """Return (cache key, cached response) for a prompt; both are None when caching is off"""
+        if not cacheable or self.cache is None:
+            return None, None
+        key = self._cache_key(prompt_name, params, route)
+        return key, self.cache.get(key)
+    
+    async def _acache_lookup(self, prompt_name, params, cacheable, route=None):
+        """Async version of _cache_lookup"""
+        if not cacheable or self.cache is None:
+            return None, None
+        key = self._cache_key(prompt_name, params, route)
+        return key, await self._off_loop(self.cache, self.cache.get, key)
+    
+    def _render(self, prompt_name, params, context_field=None, backend=None):
+        """Format a prompt template; returns (prompt, cached context handle or None)
+
+        When context caching is on, large content in params[context_field] is
+        registered with the provider (for backend's model) once and referenced
+        by handle instead of being sent inline.
+        """
+        if context_field and self.context_cache is not None:
+            context = self.context_cache.acquire(backend or self.backend, params[context_field])
+            if context is not None:
+                params = dict(params, **{context_field: CACHED_CONTEXT_NOTE})
+                return load_prompts()[prompt_name].format(**params), context
+        return load_prompts()[prompt_name].format(**params), None
+    
+    def _flight_key(self, prompt, context, route=None):
+        return make_flight_key(prompt if context is None else f"{context}\n{prompt}",
+                               route.cache_name if route is not None else self.model_name)
+    
+    def _context_failed(self, context, error):
+        """Drop a context handle after a failed call; True if the provider no longer knows it"""
+        if context is None:
+            return False
+        self.context_cache.invalidate(context)
+        return UpstreamError.from_exception(error).kind == "invalid_request"
+    
+    def _complete(self, prompt_name, params, cacheable=True, context_field=None, deadline=None):
+        """Return the full response for a prompt template, raising on upstream errors"""
+        route = self._route(prompt_name, params)
+        key, cached = self._cache_lookup(prompt_name, params, cacheable, route)
+        if cached is not None:
+            return cached
+        backend = self._pick(prompt_name, route, "generate")
+        prompt, context = self._render(prompt_name, params, context_field, backend)
+        def call():
+            try:
+                text = backend.generate(prompt, **context_kwargs(context), **timeout_kwargs(deadline))
+            except Exception as e:
+                if not self._context_failed(context, e):
+                    raise
+                # The cached context expired early; send the content inline instead
+                text = backend.generate(load_prompts()[prompt_name].format(**params), **timeout_kwargs(deadline))
+            if key is not None:
+                self.cache.set(key, text)
+            return text
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
-        self.system_prompt = PROMPTS["system_prompt"]
-    
-    def create_study_guide(self, topic, level="intermediate", focus_areas=None):
-        """Create a comprehensive study guide for a given topic"""
-        prompt = PROMPTS["study_guide_prompt"].format(
-            topic=topic,
-            level=level,
-            focus_areas=focus_areas if focus_areas else 'comprehensive coverage'
-        )
+        if self.coalescer is not None:
+            return self.coalescer.do(self._flight_key(prompt, context, route), call, timeout=remaining(deadline))
+        return call()
+    
+    def _generate(self, prompt_name, error_label, params, cacheable=True, stream=False, context_field=None, deadline=None):
+        """Format a prompt template and generate a response, consulting the cache first
+
+        With stream=True a generator of text chunks is returned instead of the full
+        text. Failures raise UpstreamError, labelled with error_label. deadline
+        is a time.monotonic() value; model calls still running then are
+        abandoned with UpstreamError(kind="deadline_exceeded").
+        """
+        if stream:
+            return self._stream(prompt_name, error_label, params, cacheable, context_field, deadline)
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self._complete(prompt_name, params, cacheable, context_field, deadline)
         except Exception as e:
-            return f"<div class='alert alert-danger'>Error creating study guide: {str(e)}</div>"
+            raise UpstreamError.from_exception(e, error_label) from e
     
-    def generate_practice_questions(self, topic, num_questions=5, question_types=None):
-        """Generate practice questions for a given topic"""
-        if question_types is None:
-            question_types = ["multiple_choice", "true_false", "short_answer"]
-        prompt = PROMPTS["practice_questions_prompt"].format(
-            topic=topic,
-            num_questions=num_questions,
-            question_types=", ".join(question_types)
-        )
+    def _stream(self, prompt_name, error_label, params, cacheable=True, context_field=None, deadline=None):
+        """Yield response text chunks as the model produces them"""
+        route = self._route(prompt_name, params)
+        key, cached = self._cache_lookup(prompt_name, params, cacheable, route)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        context = None
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            backend = self._pick(prompt_name, route, "stream")
+            prompt, context = self._render(prompt_name, params, context_field, backend)
+            for text in backend.stream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)):
+                parts.append(text)
+                yield text
         except Exception as e:
-            return f"<div class='alert alert-danger'>Error generating practice questions: {str(e)}</div>"
+            self._context_failed(context, e)
+            raise UpstreamError.from_exception(e, error_label) from e
+        if key is not None:
+            self.cache.set(key, "".join(parts))
     
-    def explain_complex_topic(self, topic, difficulty_level="beginner"):
-        """Explain a complex topic in simple terms"""
-        prompt = PROMPTS["explain_topic_prompt"].format(
-            topic=topic,
-            difficulty_level=difficulty_level
-        )
+    async def _arender(self, prompt_name, params, context_field=None, backend=None):
+        """Async version of _render; registering a context is a blocking provider call"""
+        if context_field and self.context_cache is not None:
+            return await asyncio.to_thread(self._render, prompt_name, params, context_field, backend)
+        return self._render(prompt_name, params)
+    
+    async def _acomplete(self, prompt_name, params, cacheable=True, context_field=None, deadline=None):
+        """Async version of _complete"""
+        route = self._route(prompt_name, params)
+        key, cached = await self._acache_lookup(prompt_name, params, cacheable, route)
+        if cached is not None:
+            return cached
+        backend = self._pick(prompt_name, route, "generate")
+        prompt, context = await self._arender(prompt_name, params, context_field, backend)
+        async def call():
+            try:
+                text = await backend.agenerate(prompt, **context_kwargs(context), **timeout_kwargs(deadline))
+            except Exception as e:
+                if not self._context_failed(context, e):
+                    raise
+                text = await backend.agenerate(load_prompts()[prompt_name].format(**params), **timeout_kwargs(deadline))
+            if key is not None:
+                await self._off_loop(self.cache, self.cache.set, key, text)
+            return text
+        
+        if self.coalescer is not None:
+            # A caller whose deadline passes stops waiting; the call goes on for the others
+            flight_key = self._flight_key(prompt, context, route)
+            return await within(self.coalescer.ado(flight_key, call, timeout=remaining(deadline)), deadline)
+        return await within(call(), deadline)
+    
+    async def _agenerate(self, prompt_name, error_label, params, cacheable=True, context_field=None, deadline=None):
+        """Async version of _generate"""
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return await self._acomplete(prompt_name, params, cacheable, context_field, deadline)
         except Exception as e:
-            return f"<div class='alert alert-danger'>Error explaining topic: {str(e)}</div>"
+            raise UpstreamError.from_exception(e, error_label) from e
     
-    def summarize_text(self, text, summary_type="comprehensive"):
-        """Summarize long text or content"""
-        prompt = PROMPTS["summarize_text_prompt"].format(
-            text=text,
-            summary_type=summary_type
-        )
+    async def _astream(self, prompt_name, error_label, params, cacheable=True, context_field=None, deadline=None):
+        """Async version of _stream: an async generator of text chunks"""
+        route = self._route(prompt_name, params)
+        key, cached = await self._acache_lookup(prompt_name, params, cacheable, route)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        context = None
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            backend = self._pick(prompt_name, route, "stream")
+            prompt, context = await self._arender(prompt_name, params, context_field, backend)
+            async for text in backend.astream(prompt, **context_kwargs(context), **timeout_kwargs(deadline)):
+                parts.append(text)
+                yield text
         except Exception as e:
-            return f"<div class='alert alert-danger'>Error summarizing text: {str(e)}</div>"
+            self._context_failed(context, e)
+            raise UpstreamError.from_exception(e, error_label) from e
+        if key is not None:
+            await self._off_loop(self.cache, self.cache.set, key, "".join(parts))
     
-    def generate_assignment(self, assignment_name, details, output_format="Report", word_count="", reference_content=""):
-        """Generate a custom assignment based on user requirements"""
-        prompt = PROMPTS["assignment_prompt"].format(
-            assignment_name=assignment_name,
-            details=details,
-            output_format=output_format,
-            word_count=word_count if word_count else "No specific length requirement",
-            reference_content=reference_content if reference_content else "No reference files provided"
-        )
+    # Map-reduce summarization for texts longer than one prompt's budget.
+    # Chunk notes are cached by content, so re-summarizing an edited document
+    # only re-runs the chunks that changed.
+    
+    def _reduce_notes(self, notes, deadline=None):
+        """Merge chunk notes hierarchically until they fit in one prompt"""
+        while len(notes) > 1 and estimate_tokens("\n\n".join(notes)) > self.summary_chunk_tokens:
+            groups = pack(notes, self.summary_chunk_tokens)
+            if len(groups) == len(notes):
+                # Every note is over half the budget; merge them pairwise
+                groups = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+            with ThreadPoolExecutor(max_workers=self.summary_workers) as pool:
+                notes = list(pool.map(
+                    lambda group: self._complete("merge_summaries_prompt", {"summaries": "\n\n".join(group)}, deadline=deadline),
+                    groups
+                ))
+        return notes
+    
+    def _stream_chunked_summary(self, text, summary_type, progress=None, deadline=None):
+        """Summarize chunks in parallel, then stream the combined summary
+
+        Empty strings are yielded while chunks complete so that streaming
+        callers get a chance to forward progress updates.
+        """
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            chunks = split_text(text, self.summary_chunk_tokens)
+            notes = [None] * len(chunks)
+            with ThreadPoolExecutor(max_workers=self.summary_workers) as pool:
+                futures = {
+                    pool.submit(self._complete, "summarize_chunk_prompt", {"text": chunk}, deadline=deadline): index
+                    for index, chunk in enumerate(chunks)
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    notes[futures[future]] = future.result()
+                    if progress:
+                        progress(done, len(chunks))
+                    yield ""
+            notes = self._reduce_notes(notes, deadline)
+        except Exception as e:
+            raise UpstreamError.from_exception(e, "Error summarizing text") from e
+        params = {"summaries": "\n\n".join(notes), "summary_type": summary_type}
+        yield from self._stream("combine_summaries_prompt", "Error summarizing text", params, deadline=deadline)
+    
+    async def _astream_chunked_summary(self, text, summary_type, progress=None, deadline=None):
+        """Async version of _stream_chunked_summary"""
+        try:
+            chunks = split_text(text, self.summary_chunk_tokens)
+            notes = [None] * len(chunks)
+            limit = asyncio.Semaphore(self.summary_workers)
+            
+            async def summarize_chunk(index, chunk):
+                async with limit:
+                    return index, await self._acomplete("summarize_chunk_prompt", {"text": chunk}, deadline=deadline)
+            
+            tasks = [asyncio.ensure_future(summarize_chunk(i, chunk)) for i, chunk in enumerate(chunks)]
+            try:
+                for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+                    index, note = await task
+                    notes[index] = note
+                    if progress:
+                        progress(done, len(chunks))
+                    yield ""
+            finally:
+                for task in tasks:
+                    task.cancel()
+            notes = await asyncio.to_thread(self._reduce_notes, notes, deadline)
         except Exception as e:
-            return f"<div class='alert alert-danger'>Error generating assignment: {str(e)}</div>"
+            raise UpstreamError.from_exception(e, "Error summarizing text") from e
+        params = {"summaries": "\n\n".join(notes), "summary_type": summary_type}
+        async for text in self._astream("combine_summaries_prompt", "Error summarizing text", params, deadline=deadline):
+            yield text
+    
+    # Sectional study guides: every section is its own concurrent model call,
+    # and sections are streamed in order, each as soon as the ones before it
+    # are out. Wall time follows the longest section instead of the whole guide.
+    
+    @staticmethod
+    def _section_params(params):
+        titles = [title for title, _ in STUDY_GUIDE_SECTIONS]
+        return [
+            dict(params, section=title, section_instructions=instructions,
+                 other_sections=", ".join(other for other in titles if other != title))
+            for title, instructions in STUDY_GUIDE_SECTIONS
+        ]
+    
+    def _stream_sectional_guide(self, params, deadline=None):
+        """Generate the study guide sections concurrently and yield their text in order"""
+        sections = self._section_params(params)
+        queues = [queue.Queue() for _ in sections]
+        stop = threading.Event()
+        
+        def produce(index):
+            try:
+                for text in self._stream("study_guide_section_prompt", "Error creating study guide", sections[index],
+                                         deadline=deadline):
+                    if stop.is_set():
+                        return
+                    queues[index].put(text)
+                queues[index].put(_SECTION_DONE)
+            except Exception as e:
+                queues[index].put(e)
+        
+        pool = ThreadPoolExecutor(max_workers=self.section_workers)
+        try:
+            for index in range(len(sections)):
+                pool.submit(produce, index)
+            for section in queues:
+                while True:
+                    item = section.get()
+                    if item is _SECTION_DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            # The client may have gone away; don't keep generating for nobody
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    async def _astream_sectional_guide(self, params, deadline=None):
+        """Async version of _stream_sectional_guide"""
+        sections = self._section_params(params)
+        queues = [asyncio.Queue() for _ in sections]
+        limit = asyncio.Semaphore(self.section_workers)
+        
+        async def produce(index):
+            try:
+                async with limit:
+                    async for text in self._astream("study_guide_section_prompt", "Error creating study guide", sections[index],
+                                                    deadline=deadline):
+                        queues[index].put_nowait(text)
+                queues[index].put_nowait(_SECTION_DONE)
+            except Exception as e:
+                queues[index].put_nowait(e)
+        
+        tasks = [asyncio.ensure_future(produce(index)) for index in range(len(sections))]
+        try:
+            for section in queues:
+                while True:
+                    item = await section.get()
+                    if item is _SECTION_DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    @staticmethod
+    def _study_guide_params(topic, level, focus_areas):
+        return {
+            "topic": topic,
+            "level": level,
+            "focus_areas": focus_areas if focus_areas else 'comprehensive coverage'
+        }
+    
+    @staticmethod
+    def _practice_questions_params(topic, num_questions, question_types):
+        if question_types is None:
+            question_types = ["multiple_choice", "true_false", "short_answer"]
+        return {
+            "topic": topic,
+            "num_questions": num_questions,
+            "question_types": ", ".join(question_types)
+        }
+    
+    @staticmethod
+    def _explain_topic_params(topic, difficulty_level):
+        return {
+            "topic": topic,
+            "difficulty_level": difficulty_level
+        }
+    
+    @staticmethod
+    def _summarize_params(text, summary_type):
+        return {
+            "text": text,
+            "summary_type": summary_type
+        }
+    
+    @staticmethod
+    def _assignment_params(assignment_name, details, output_format, word_count, reference_content):
+        return {
+            "assignment_name": assignment_name,
+            "details": details,
+            "output_format": output_format,
+            "word_count": word_count if word_count else "No specific length requirement",
+            "reference_content": reference_content if reference_content else "No reference files provided"
+        }
+    
+    def create_study_guide(self, topic, level="intermediate", focus_areas=None, stream=False, sectional=None, deadline=None):
+        """Create a comprehensive study guide for a given topic
+
+        With sectional=True (default: STUDY_GUIDE_SECTIONAL) the sections are
+        generated as concurrent calls and assembled in order.
+        """
+        topic = self._match_topic(topic)
+        params = self._study_guide_params(topic, level, focus_areas)
+        if self.sectional_guides if sectional is None else sectional:
+            chunks = self._stream_sectional_guide(params, deadline)
+            return chunks if stream else "".join(chunks)
+        return self._generate("study_guide_prompt", "Error creating study guide", params, stream=stream, deadline=deadline)
+    
+    def generate_practice_questions(self, topic, num_questions=5, question_types=None, stream=False, exclude=None, deadline=None):
+        """Generate practice questions for a given topic
+
+        With a question bank, questions are sampled from it (skipping the ids
+        in exclude) and rendered as HTML; the free-form prompt is only used
+        when the bank has nothing to offer.
+        """
+        topic = self._match_topic(topic)
+        if self.question_bank is not None:
+            questions = self.sample_practice_questions(topic, num_questions, question_types, exclude, deadline)
+            if questions:
+                html = render_questions(questions)
+                return iter([html]) if stream else html
+        params = self._practice_questions_params(topic, num_questions, question_types)
+        return self._generate("practice_questions_prompt", "Error generating practice questions", params,
+                              stream=stream, deadline=deadline)
+    
+    # Practice questions from the question bank: stored records are sampled and
+    # the model is only asked to top up the question types that run short
+    
+    def _question_top_up_params(self, topic, short):
+        counts = self.question_bank.top_up_request(short)
+        known = self.question_bank.known_stems(topic)
+        return {
+            "topic": topic,
+            "num_questions": sum(counts.values()),
+            "counts": ", ".join(f"{qtype}: {count}" for qtype, count in counts.items()),
+            "types": ", ".join(counts),
+            "known_questions": "\n".join(f"- {stem}" for stem in known) if known else "(none yet)"
+        }
+    
+    def _top_up_questions(self, topic, wanted, exclude=None, deadline=None):
+        """Ask the model for more questions if the bank can't serve wanted; returns whether it had to"""
+        short = self.question_bank.shortfall(topic, wanted, exclude)
+        if short:
+            params = self._question_top_up_params(topic, short)
+            # The bank is the cache here; identical concurrent top-ups still coalesce
+            text = self._generate("question_bank_prompt", "Error generating practice questions", params,
+                                  cacheable=False, deadline=deadline)
+            self.question_bank.add(topic, parse_questions(text, short))
+        return bool(short)
+    
+    def sample_practice_questions(self, topic, num_questions=5, question_types=None, exclude=None, deadline=None):
+        """Return practice question records from the question bank, topping it up first if it is short"""
+        wanted = allocate(num_questions, question_types or list(DEFAULT_TYPES))
+        topped_up = self._top_up_questions(topic, wanted, exclude, deadline)
+        return self.question_bank.sample(topic, wanted, exclude, topped_up=topped_up)
+    
+    def stock_question_bank(self, topic, num_questions=5, question_types=None):
+        """Top up the question bank for a topic without serving anything; True if the model was called"""
+        topic = self._match_topic(topic)
+        return self._top_up_questions(topic, allocate(num_questions, question_types or list(DEFAULT_TYPES)))
+    
+    async def asample_practice_questions(self, topic, num_questions=5, question_types=None, exclude=None, deadline=None):
+        """Async version of sample_practice_questions"""
+        wanted = allocate(num_questions, question_types or list(DEFAULT_TYPES))
+        short = await asyncio.to_thread(self.question_bank.shortfall, topic, wanted, exclude)
+        if short:
+            params = await asyncio.to_thread(self._question_top_up_params, topic, short)
+            text = await self._agenerate("question_bank_prompt", "Error generating practice questions", params,
+                                         cacheable=False, deadline=deadline)
+            await asyncio.to_thread(self.question_bank.add, topic, parse_questions(text, short))
+        return await asyncio.to_thread(self.question_bank.sample, topic, wanted, exclude, bool(short))
+    
+    # Answer grading: multiple-choice and true/false answers are checked against
+    # the question bank's answer key locally; only free-text answers go to the
+    # model, grade_batch to a call
+    
+    def _grading_plan(self, answers):
+        """Grade the objective answers; returns (results, batches of (index, question, answer) for the model, local seconds)"""
+        if self.question_bank is None:
+            raise ValueError("Answer grading needs the question bank (STUDY_QUESTION_BANK)")
+        questions = self.question_bank.get_many(item["question_id"] for item in answers)
+        results = [None] * len(answers)
+        pending = []
+        local_seconds = 0.0
+        for index, item in enumerate(answers):
+            question = questions.get(int(item["question_id"]))
+            if question is None:
+                results[index] = {"question_id": item["question_id"], "error": {
+                    "error": "Unknown question", "type": "invalid_request", "retryable": False}}
+            elif question["type"] in LOCAL_TYPES:
+                results[index] = grade_locally(question, item["answer"])
+                local_seconds += results[index]["seconds"]
+            else:
+                pending.append((index, question, item["answer"]))
+        batches = [pending[i:i + self.grade_batch] for i in range(0, len(pending), self.grade_batch)]
+        return results, batches, local_seconds
+    
+    @staticmethod
+    def _grading_params(batch):
+        return {"items": grading_items([(question, answer) for _, question, answer in batch])}
+    
+    @staticmethod
+    def _grading_results(results, batch, text, error, seconds):
+        pairs = [(question, answer) for _, question, answer in batch]
+        graded = failed_results(pairs, error, seconds) if error is not None else model_results(pairs, text, seconds)
+        for (index, _, _), result in zip(batch, graded):
+            results[index] = result
+    
+    def _grade_batch(self, batch, deadline=None):
+        """(response text, UpstreamError, seconds) for one model grading call"""
+        start = time.perf_counter()
+        try:
+            text = self._generate("grade_answers_prompt", "Error grading answers", self._grading_params(batch),
+                                  deadline=deadline)
+        except UpstreamError as e:
+            return None, e, time.perf_counter() - start
+        return text, None, time.perf_counter() - start
+    
+    def grade_answers(self, answers, deadline=None):
+        """Grade answers to question bank questions, given as {"question_id", "answer"} items
+
+        Returns {"results": one record per answer in order, "summary": totals};
+        each record says whether it was graded "local"ly or by the "model" and
+        how long that took. A failed model call marks its batch's records with
+        an error instead of failing the whole request.
+        """
+        results, batches, local_seconds = self._grading_plan(answers)
+        start = time.perf_counter()
+        if batches:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.grade_workers, len(batches)))) as pool:
+                for batch, outcome in zip(batches, pool.map(lambda batch: self._grade_batch(batch, deadline), batches)):
+                    self._grading_results(results, batch, *outcome)
+        return {"results": results,
+                "summary": summarize(results, local_seconds, time.perf_counter() - start, len(batches))}
+    
+    def explain_complex_topic(self, topic, difficulty_level="beginner", stream=False, deadline=None):
+        """Explain a complex topic in simple terms"""
+        topic = self._match_topic(topic)
+        params = self._explain_topic_params(topic, difficulty_level)
+        return self._generate("explain_topic_prompt", "Error explaining topic", params, stream=stream, deadline=deadline)
+    
+    def summarize_text(self, text, summary_type="comprehensive", stream=False, progress=None, deadline=None):
+        """Summarize long text or content
+
+        Text longer than summary_chunk_tokens is split into chunks that are
+        summarized in parallel and then combined. progress, if given, is called
+        as progress(done, total) as each chunk finishes.
+        """
+        if estimate_tokens(text) > self.summary_chunk_tokens:
+            chunks = self._stream_chunked_summary(text, summary_type, progress, deadline)
+            return chunks if stream else "".join(chunks)
+        params = self._summarize_params(text, summary_type)
+        return self._generate("summarize_text_prompt", "Error summarizing text", params, stream=stream, deadline=deadline)
+    
+    def generate_assignment(self, assignment_name, details, output_format="Report", word_count="", reference_content="", stream=False,
+                            deadline=None):
+        """Generate a custom assignment based on user requirements"""
+        params = self._assignment_params(assignment_name, details, output_format, word_count, reference_content)
+        # Reference files are often reused across revisions: candidates for the context cache
+        return self._generate("assignment_prompt", "Error generating assignment", params,
+                              cacheable=False, stream=stream, context_field="reference_content", deadline=deadline)
+    
+    # Async counterparts, for serving many slow model calls from one event loop.
+    # With stream=True they return an async generator of text chunks. Cancelling
+    # the awaiting task (or closing the generator) cancels the model call.
+    
+    async def acreate_study_guide(self, topic, level="intermediate", focus_areas=None, stream=False, sectional=None, deadline=None):
+        """Async version of create_study_guide"""
+        topic = await self._amatch_topic(topic)
+        params = self._study_guide_params(topic, level, focus_areas)
+        if self.sectional_guides if sectional is None else sectional:
+            chunks = self._astream_sectional_guide(params, deadline)
+            if stream:
+                return chunks
+            return "".join([text async for text in chunks])
+        if stream:
+            return self._astream("study_guide_prompt", "Error creating study guide", params, deadline=deadline)
+        return await self._agenerate("study_guide_prompt", "Error creating study guide", params, deadline=deadline)
+    
+    async def agenerate_practice_questions(self, topic, num_questions=5, question_types=None, stream=False, exclude=None,
+                                           deadline=None):
+        """Async version of generate_practice_questions"""
+        topic = await self._amatch_topic(topic)
+        if self.question_bank is not None:
+            questions = await self.asample_practice_questions(topic, num_questions, question_types, exclude, deadline)
+            if questions:
+                html = render_questions(questions)
+                return _single_chunk(html) if stream else html
+        params = self._practice_questions_params(topic, num_questions, question_types)
+        if stream:
+            return self._astream("practice_questions_prompt", "Error generating practice questions", params, deadline=deadline)
+        return await self._agenerate("practice_questions_prompt", "Error generating practice questions", params, deadline=deadline)
+    
+    async def _agrade_batch(self, batch, deadline=None):
+        """Async version of _grade_batch"""
+        start = time.perf_counter()
+        try:
+            text = await self._agenerate("grade_answers_prompt", "Error grading answers", self._grading_params(batch),
+                                         deadline=deadline)
+        except UpstreamError as e:
+            return None, e, time.perf_counter() - start
+        return text, None, time.perf_counter() - start
+    
+    async def agrade_answers(self, answers, deadline=None):
+        """Async version of grade_answers"""
+        results, batches, local_seconds = await asyncio.to_thread(self._grading_plan, answers)
+        start = time.perf_counter()
+        limit = asyncio.Semaphore(max(1, self.grade_workers))
+        
+        async def grade(batch):
+            async with limit:
+                return await self._agrade_batch(batch, deadline)
+        
+        for batch, outcome in zip(batches, await asyncio.gather(*(grade(batch) for batch in batches))):
+            self._grading_results(results, batch, *outcome)
+        return {"results": results,
+                "summary": summarize(results, local_seconds, time.perf_counter() - start, len(batches))}
+    
+    async def aexplain_complex_topic(self, topic, difficulty_level="beginner", stream=False, deadline=None):
+        """Async version of explain_complex_topic"""
+        topic = await self._amatch_topic(topic)
+        params = self._explain_topic_params(topic, difficulty_level)
+        if stream:
+            return self._astream("explain_topic_prompt", "Error explaining topic", params, deadline=deadline)
+        return await self._agenerate("explain_topic_prompt", "Error explaining topic", params, deadline=deadline)
+    
+    async def asummarize_text(self, text, summary_type="comprehensive", stream=False, progress=None, deadline=None):
+        """Async version of summarize_text"""
+        if estimate_tokens(text) > self.summary_chunk_tokens:
+            chunks = self._astream_chunked_summary(text, summary_type, progress, deadline)
+            if stream:
+                return chunks
+            return "".join([text async for text in chunks])
+        params = self._summarize_params(text, summary_type)
+        if stream:
+            return self._astream("summarize_text_prompt", "Error summarizing text", params, deadline=deadline)
+        return await self._agenerate("summarize_text_prompt", "Error summarizing text", params, deadline=deadline)
+    
+    async def agenerate_assignment(self, assignment_name, details, output_format="Report", word_count="", reference_content="",
+                                   stream=False, deadline=None):
+        """Async version of generate_assignment"""
+        params = self._assignment_params(assignment_name, details, output_format, word_count, reference_content)
+        if stream:
+            return self._astream("assignment_prompt", "Error generating assignment", params,
+                                 cacheable=False, context_field="reference_content", deadline=deadline)
+        return await self._agenerate("assignment_prompt", "Error generating assignment", params,
+                                     cacheable=False, context_field="reference_content", deadline=deadline)
     
     def interactive_study_session(self):
         """Run an interactive study session"""
@@ -170,16 +847,168 @@ class StudyAssistant:
                 break
             except Exception as e:
                 print(f"❌ Error: {str(e)}")
+    
+    # Batch mode: jobs are read from a JSONL file, run concurrently and written
+    # to an output JSONL in completion order. The output doubles as the
+    # checkpoint, so a rerun skips the jobs that already succeeded.
+    
+    @staticmethod
+    def _batch_job_id(job):
+        """A job's "id", or a stable hash of its feature and parameters"""
+        if job.get("id") is not None:
+            return str(job["id"])
+        raw = json.dumps({"feature": job.get("feature"), "params": job.get("params", {})}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+    
+    def _batch_call(self, job):
+        """The bound method and arguments a batch job calls; ValueError if the job is malformed"""
+        if "invalid" in job:
+            raise ValueError(job["invalid"])
+        method = BATCH_FEATURES.get(job.get("feature"))
+        if method is None:
+            raise ValueError(f"Unknown feature {job.get('feature')!r} (expected one of {', '.join(BATCH_FEATURES)})")
+        params = job.get("params", {})
+        if not isinstance(params, dict) or {"stream", "progress", "deadline"} & set(params):
+            raise ValueError("params must be an object of keyword arguments (stream, progress and deadline are not allowed)")
+        function = getattr(self, method)
+        try:
+            inspect.signature(function).bind(**params)
+        except TypeError as e:
+            raise ValueError(f"Invalid params for {job['feature']}: {e}") from None
+        return function, params
+    
+    def _run_batch_job(self, job):
+        """Run one batch job; returns its output record
 
-def main():
+        Only a malformed job is an invalid_request; anything raised while
+        generating is classified like any other upstream failure.
+        """
+        started = time.perf_counter()
+        record = {"id": self._batch_job_id(job), "feature": job.get("feature")}
+        try:
+            function, params = self._batch_call(job)
+        except ValueError as e:
+            function = None
+            record["ok"] = False
+            record["error"] = {"error": str(e), "type": "invalid_request", "retryable": False}
+        if function is not None:
+            try:
+                record["result"] = function(**params)
+                record["ok"] = True
+            except Exception as e:
+                record["ok"] = False
+                record["error"] = UpstreamError.from_exception(e).to_dict()
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        return record
+    
+    def batch_session(self, input_path, output_path, workers=4):
+        """Run the jobs in a JSONL file ({"id", "feature", "params"} per line) and append results to output_path
+
+        Returns a summary with counts, throughput and latency percentiles.
+        """
+        done = set()
+        if os.path.exists(output_path):
+            with open(output_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by an interruption
+                    if record.get("ok"):
+                        done.add(record.get("id"))
+        
+        def jobs():
+            with open(input_path, encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        job = json.loads(line)
+                    except ValueError:
+                        job = None
+                    if not isinstance(job, dict):
+                        job = {"id": f"line-{number}", "feature": None, "invalid": f"Line {number} is not a JSON object"}
+                    yield job
+        
+        summary = {"ok": 0, "failed": 0, "skipped": 0}
+        latencies = []
+        seen = set()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool, open(output_path, "a", encoding="utf-8") as out:
+            pending = set()
+            
+            def collect(futures):
+                for future in futures:
+                    record = future.result()
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    latencies.append(record["seconds"])
+                    summary["ok" if record["ok"] else "failed"] += 1
+                    status = "✅" if record["ok"] else f"❌ {record['error']['error']}"
+                    print(f"{status} {record['id']} ({record['feature']}, {record['seconds']:.1f}s)")
+            
+            try:
+                for job in jobs():
+                    job_id = self._batch_job_id(job)
+                    if job_id in done or job_id in seen:
+                        summary["skipped"] += 1
+                        continue
+                    seen.add(job_id)
+                    # Keep only a few jobs queued so huge input files aren't loaded at once
+                    if len(pending) >= workers * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                    pending.add(pool.submit(self._run_batch_job, job))
+                collect(as_completed(pending))
+            except KeyboardInterrupt:
+                print("\n⏹️  Interrupted; rerun the same command to continue where this stopped")
+                # Queued jobs are dropped; the ones already running are finished and recorded
+                collect([future for future in pending if not future.cancel()])
+                summary["interrupted"] = True
+        
+        elapsed = time.perf_counter() - started
+        ordered = sorted(latencies)
+        
+        def pick(pct):
+            return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))] if ordered else None
+        
+        summary.update({
+            "seconds": round(elapsed, 2),
+            "jobs_per_second": round(len(ordered) / elapsed, 2) if elapsed > 0 else None,
+            "latency_p50": pick(50),
+            "latency_p95": pick(95),
+            "latency_max": ordered[-1] if ordered else None,
+        })
+        return summary
+
+def main(argv=None):
     """Main function to run the Study Assistant"""
+    parser = argparse.ArgumentParser(description="Study Assistant")
+    parser.add_argument("--batch", metavar="JOBS.jsonl", help="run the jobs in a JSONL file instead of the interactive session")
+    parser.add_argument("--output", metavar="RESULTS.jsonl", help="batch results (default: <jobs>.results.jsonl)")
+    parser.add_argument("--workers", type=int, default=4, help="batch jobs run at a time (default: 4)")
+    args = parser.parse_args(argv)
     try:
-        assistant = StudyAssistant()
+        assistant = StudyAssistant(
+            cache=ResponseCache.from_env(),
+            coalescer=SingleFlight.from_env(),
+            context_cache=ContextCache.from_env(),
+            question_bank=QuestionBank.from_env(),
+            topic_index=TopicIndex.from_env()
+        )
         print("✅ Study Assistant initialized successfully!")
-        assistant.interactive_study_session()
     except Exception as e:
         print(f"❌ Error initializing Study Assistant: {str(e)}")
         print("Please make sure your GOOGLE_API_KEY is set in the .env file")
+        return 1
+    if not args.batch:
+        assistant.interactive_study_session()
+        return 0
+    output = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+    print(f"📦 Running {args.batch} with {args.workers} workers -> {output}")
+    summary = assistant.batch_session(args.batch, output, args.workers)
+    print(f"\n📊 {json.dumps(summary)}")
+    return 1 if summary["failed"] or summary.get("interrupted") else 0
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    raise SystemExit(main())
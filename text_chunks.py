@@ -0,0 +1,102 @@
+"""
+Text chunking helpers for Study Assistant
+Splits long text on paragraph and sentence boundaries into chunks that fit a
+token budget. Chunk boundaries are content-defined: after a minimum size, a
+chunk ends at an "anchor" paragraph chosen by its hash. An edit therefore only
+changes the chunks around it, and the rest keep the same text (and the same
+cached summaries).
+"""
+
+import hashlib
+import re
+
+# Rough size of a token in characters for English text
+CHARS_PER_TOKEN = 4
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate, good enough for budgeting prompts"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _split_oversized(text, max_tokens):
+    """Split one paragraph that exceeds the budget on sentence, then word boundaries"""
+    pieces, current = [], ""
+    for sentence in SENTENCE_END.split(text):
+        if estimate_tokens(sentence) > max_tokens:
+            # A single enormous "sentence": fall back to word boundaries
+            words = sentence.split()
+            sentence = ""
+            for word in words:
+                if sentence and estimate_tokens(sentence + " " + word) > max_tokens:
+                    pieces.append(sentence)
+                    sentence = word
+                else:
+                    sentence = f"{sentence} {word}" if sentence else word
+        if current and estimate_tokens(current + " " + sentence) > max_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_anchor(paragraph, modulus=4):
+    """Deterministically mark roughly one paragraph in `modulus` as a chunk boundary"""
+    return hashlib.sha1(paragraph.encode("utf-8")).digest()[0] % modulus == 0
+
+
+def split_text(text, max_tokens, min_tokens=None):
+    """Split text into chunks of at most max_tokens (estimated)
+
+    Paragraphs are kept whole when they fit. A chunk is closed when the next
+    paragraph would overflow it, or once it holds min_tokens and the paragraph
+    just added is an anchor.
+    """
+    if min_tokens is None:
+        min_tokens = max_tokens // 2
+    paragraphs = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) > max_tokens:
+            paragraphs.extend(_split_oversized(paragraph, max_tokens))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks, current = [], []
+    size = 0
+    for paragraph in paragraphs:
+        tokens = estimate_tokens(paragraph) + 1
+        if current and size + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += tokens
+        if size >= min_tokens and _is_anchor(paragraph):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def pack(items, max_tokens):
+    """Group consecutive strings so each group's total stays within max_tokens"""
+    groups, current, size = [], [], 0
+    for item in items:
+        tokens = estimate_tokens(item) + 1
+        if current and size + tokens > max_tokens:
+            groups.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += tokens
+    if current:
+        groups.append(current)
+    return groups
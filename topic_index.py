@@ -0,0 +1,316 @@
+"""
+Near-duplicate topic matching for Study Assistant
+Topics arrive as raw user strings ("Neural Networks", "neural network",
+"  NEURAL networks basics"). Before a request reaches the response cache, its
+topic is mapped to the first-seen topic it is close enough to, so trivial
+variations share one cache entry (and one coalesced model call).
+
+Matching has two steps:
+    1. canonical form: lowercase words in their original order, articles and
+       filler words ("basics", "introduction to") dropped, plurals folded;
+       equal canonical forms always match
+    2. character trigram similarity: a MinHash LSH index proposes a few
+       candidates, and the best one is accepted when its Jaccard similarity
+       reaches the threshold, its words line up one to one, equal or a typo
+       apart (so "Physics for Machine Learning" never matches "Machine
+       Learning for Physics", nor "Microeconomics" "Macroeconomics") and it has the same numbers and short words
+       ("Calculus 2" never matches "Calculus 3", "Vitamin B" never matches
+       "Vitamin C")
+
+Lookups touch a handful of size-capped LSH buckets and compare at most
+MAX_CANDIDATES topics exactly, so they stay fast with 100k+ known topics.
+The index holds at most max_topics topics; when it is full, the least
+recently matched half is dropped.
+"""
+
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import Counter
+
+from response_cache import CACHE_DIR
+
+# Words that don't change what a topic is about
+FILLER_WORDS = frozenset(
+    "a an the basics basic introduction intro overview fundamentals fundamental beginner beginners guide".split()
+)
+# Words that relate the others ("Physics for Machine Learning"); only dropped
+# at either end, where they are left over from filler ("Introduction to ...")
+CONNECTIVES = frozenset("of to in on for and with about".split())
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_SIGNATURE = struct.Struct(f"<{NUM_PERM}I")
+# Buckets stop growing here; the earliest topics are the ones matches resolve to
+MAX_BUCKET = 100
+# Candidates sharing the most buckets are compared exactly, at most this many
+MAX_CANDIDATES = 32
+ROMAN = re.compile(r"^[ivxl]+$")
+# Aligned words only count as the same word (a typo) when they start with
+# these many identical letters, so prefixes tell topics apart ("Macro" /
+# "Micro"economics, "Hypo" / "Hyper"tension, "In" / "Organic" Chemistry)
+TYPO_PREFIX = 4
+
+
+def stem(word):
+    """Fold regular English plurals to the singular; every other word is kept as is"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is", "ics")):
+        return word[:-1]
+    return word
+
+
+def canonicalize(topic):
+    """Canonical form of a topic: its content words, plurals folded, in their original order"""
+    words = re.findall(r"\w+", topic.lower())
+    content = [word for word in words if word not in FILLER_WORDS]
+    while content and content[0] in CONNECTIVES:
+        content.pop(0)
+    while content and content[-1] in CONNECTIVES:
+        content.pop()
+    # A topic made only of filler words keeps them
+    return " ".join(stem(word) for word in content or words)
+
+
+def shingles(canonical):
+    """Character trigrams of a canonical form, with word boundaries"""
+    text = f" {canonical} "
+    return {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+
+
+def markers(canonical):
+    """Words that must match exactly: numbers, roman numerals and one- or two-letter words"""
+    return frozenset(word for word in canonical.split()
+                     if len(word) <= 2 or ROMAN.match(word) or any(ch.isdigit() for ch in word))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def edit_distance(a, b):
+    """Damerau-Levenshtein distance (optimal string alignment): edits, counting a swap of neighbours as one"""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[len(b)]
+
+
+def max_typos(word):
+    """Edits a word of this length may be off by: none up to 4 letters, 1 up to 8, else 2"""
+    return 0 if len(word) <= 4 else 1 if len(word) <= 8 else 2
+
+
+def same_word(word, other):
+    """Whether two words are the same but for a typo past their first TYPO_PREFIX letters"""
+    if word == other:
+        return True
+    if word[:TYPO_PREFIX] != other[:TYPO_PREFIX]:
+        return False
+    return edit_distance(word, other) <= max_typos(min(word, other, key=len))
+
+
+def aligned(canonical, other):
+    """Whether two canonical forms have the same words in the same order, allowing typos"""
+    words, other_words = canonical.split(), other.split()
+    if len(words) != len(other_words):
+        return False
+    return all(same_word(word, other_word) for word, other_word in zip(words, other_words))
+
+
+def minhash(grams):
+    """MinHash signature (NUM_PERM 32-bit values) of a set of shingles"""
+    hashes = [int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little") for gram in grams]
+    return [min((a * h + b) % _PRIME for h in hashes) & _MASK for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature):
+    """One LSH bucket key per band; topics sharing any bucket are candidates"""
+    return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+class TopicIndex:
+    """Maps incoming topics to the first-seen equivalent topic
+
+    The index is kept in memory and, with db_path, persisted to SQLite
+    (topic, canonical form and signature), so it survives restarts without
+    recomputing signatures. It is loaded on first use.
+    """
+
+    def __init__(self, threshold=0.8, db_path=None, max_topics=100000):
+        self.threshold = threshold
+        self.db_path = db_path
+        self.max_topics = max_topics
+        self._topics = []  # id -> (topic, canonical, (shingles, markers) or None)
+        self._signatures = []  # id -> MinHash signature, to rebuild the buckets when pruning
+        self._last_used = []  # id -> time.monotonic() of its last match
+        self._canonical = {}  # canonical form -> id
+        self._buckets = {}  # (band, key) -> [ids]
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.candidates = 0
+        self.pruned = 0
+
+    @classmethod
+    def from_env(cls):
+        """Create a topic index from STUDY_TOPIC_* environment variables, or None when disabled"""
+        if os.getenv("STUDY_TOPIC_MATCHING", "1").lower() in ("0", "false", "no", "off"):
+            return None
+        return cls(
+            threshold=float(os.getenv("STUDY_TOPIC_THRESHOLD", "0.8")),
+            db_path=os.getenv("STUDY_TOPIC_DB", os.path.join(CACHE_DIR, "topics.db")) or None,
+            max_topics=int(os.getenv("STUDY_TOPIC_MAX", "100000")),
+        )
+
+    def _connect(self):
+        """Return this thread's SQLite connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS topics (
+                    id INTEGER PRIMARY KEY,
+                    topic TEXT NOT NULL,
+                    canonical TEXT NOT NULL UNIQUE,
+                    signature BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self._local.conn = conn
+        return conn
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.db_path:
+            return
+        # The newest max_topics, oldest first so matches resolve to the earliest
+        rows = self._connect().execute(
+            "SELECT topic, canonical, signature FROM (SELECT * FROM topics ORDER BY id DESC LIMIT ?) ORDER BY id",
+            (self.max_topics,),
+        ).fetchall()
+        for topic, canonical, signature in rows:
+            self._insert(topic, canonical, list(_SIGNATURE.unpack(signature)))
+
+    def _insert(self, topic, canonical, signature):
+        topic_id = len(self._topics)
+        self._topics.append((topic, canonical, None))
+        self._signatures.append(signature)
+        self._last_used.append(time.monotonic())
+        self._canonical[canonical] = topic_id
+        for key in band_keys(signature):
+            bucket = self._buckets.setdefault(key, [])
+            if len(bucket) < MAX_BUCKET:
+                bucket.append(topic_id)
+        return topic_id
+
+    def _prune(self):
+        """Drop the least recently matched half of the index; returns the canonical forms dropped"""
+        keep = set(sorted(range(len(self._topics)), key=self._last_used.__getitem__)[len(self._topics) // 2:])
+        entries = [(self._topics[i], self._signatures[i], self._last_used[i]) for i in range(len(self._topics))]
+        dropped = [topic[1] for i, (topic, _, _) in enumerate(entries) if i not in keep]
+        self._topics, self._signatures, self._last_used = [], [], []
+        self._canonical, self._buckets = {}, {}
+        for i, ((topic, canonical, _), signature, last_used) in enumerate(entries):
+            if i in keep:
+                self._last_used[self._insert(topic, canonical, signature)] = last_used
+        self.pruned += len(dropped)
+        return dropped
+
+    def _features(self, topic_id):
+        # Built on demand; most topics are never a candidate
+        topic, canonical, features = self._topics[topic_id]
+        if features is None:
+            features = (shingles(canonical), markers(canonical))
+            self._topics[topic_id] = (topic, canonical, features)
+        return features
+
+    def match(self, topic):
+        """Return the known topic equivalent to this one; an unknown topic is added and returned as is"""
+        canonical = canonicalize(topic)
+        signature = minhash(shingles(canonical))
+        with self._lock:
+            self._load()
+            match, exact = self._find(canonical, signature)
+            if match is not None:
+                if exact:
+                    self.exact_hits += 1
+                else:
+                    self.similar_hits += 1
+                self._last_used[match] = time.monotonic()
+                return self._topics[match][0]
+            self.misses += 1
+            dropped = self._prune() if len(self._topics) >= self.max_topics else []
+            self._insert(topic, canonical, signature)
+        if self.db_path:
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM topics WHERE canonical = ?", [(item,) for item in dropped])
+                conn.execute(
+                    "INSERT OR IGNORE INTO topics (topic, canonical, signature, created_at) VALUES (?, ?, ?, ?)",
+                    (topic, canonical, _SIGNATURE.pack(*signature), time.time()),
+                )
+        return topic
+
+    def _find(self, canonical, signature):
+        """(id of the best equivalent topic or None, whether the canonical forms are equal)"""
+        topic_id = self._canonical.get(canonical)
+        if topic_id is not None:
+            return topic_id, True
+        shared = Counter()
+        for key in band_keys(signature):
+            shared.update(self._buckets.get(key, ()))
+        candidates = [candidate for candidate, _ in shared.most_common(MAX_CANDIDATES)]
+        self.candidates += len(candidates)
+        grams, words = shingles(canonical), markers(canonical)
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            candidate_grams, candidate_words = self._features(candidate)
+            if candidate_words != words or not aligned(canonical, self._topics[candidate][1]):
+                continue
+            score = jaccard(grams, candidate_grams)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "topics": len(self._topics),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "candidates_checked": self.candidates,
+                "pruned": self.pruned,
+                "max_topics": self.max_topics,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,196 @@
+"""
+Content-addressed upload store for Study Assistant
+Reference files are streamed to disk in blocks while being hashed, and kept
+under their SHA-256 (objects/ab/ab12...), so identical uploads are stored once
+and two users' "notes.pdf" never overwrite each other. A SQLite index records
+each stored file's size and last use, plus the requests currently referencing
+it. When the store grows past its quota, the least recently used files that no
+request is using are deleted.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class UploadStore:
+    """Deduplicating file store with per-request references and an LRU disk quota
+
+    References left behind by a request that never released them (a crashed
+    worker) stop protecting their files after ref_ttl seconds.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, ref_ttl=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ref_ttl = ref_ttl
+        self.db_path = os.path.join(root, "index.db")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self._init_db()
+
+    @classmethod
+    def from_env(cls, default_root):
+        """Create an upload store from STUDY_UPLOAD_* environment variables"""
+        return cls(
+            root=os.getenv("STUDY_UPLOAD_DIR", default_root),
+            max_bytes=int(float(os.getenv("STUDY_UPLOAD_MAX_MB", "512")) * 1024 * 1024),
+            ref_ttl=float(os.getenv("STUDY_UPLOAD_REF_TTL", "3600")),
+        )
+
+    def _connect(self):
+        """Return this thread's SQLite connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS refs (
+                ref TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs (last_used)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_sha256 ON refs (sha256)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_ref ON refs (ref)")
+
+    def path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def save(self, stream, filename, ref):
+        """Store an upload stream under its content hash, referenced by ref until release(ref)
+
+        The stream is read in blocks, hashed and written as it goes, so large
+        files are never held in memory. Returns a dict with filename, sha256,
+        size, path and whether the content was already stored.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for block in iter(lambda: stream.read(BLOCK_SIZE), b""):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            sha256 = digest.hexdigest()
+            now = time.time()
+            conn = self._connect()
+            # The reference is recorded before the file is put in place, and
+            # eviction deletes files inside its own write transaction, so a
+            # file can't be evicted between being stored and being referenced
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    """INSERT INTO blobs (sha256, size, created_at, last_used) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(sha256) DO UPDATE SET last_used = excluded.last_used""",
+                    (sha256, size, now, now),
+                )
+                conn.execute("INSERT INTO refs (ref, sha256, filename, created_at) VALUES (?, ?, ?, ?)",
+                             (ref, sha256, filename, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            path = self.path(sha256)
+            existed = os.path.exists(path)
+            if existed:
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            if existed:
+                self.deduplicated += 1
+            else:
+                self.stored += 1
+        if not existed:
+            self.evict()
+        return {"filename": filename, "sha256": sha256, "size": size, "path": path, "deduplicated": existed}
+
+    def release(self, ref):
+        """Drop a request's references; its files become eligible for eviction"""
+        self._connect().execute("DELETE FROM refs WHERE ref = ?", (ref,))
+
+    def evict(self):
+        """Delete least recently used, unreferenced files until the store fits its quota"""
+        conn = self._connect()
+        if conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0] <= self.max_bytes:
+            return 0
+        evicted = freed = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cutoff = time.time() - self.ref_ttl
+            conn.execute("DELETE FROM refs WHERE created_at < ?", (cutoff,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            rows = conn.execute(
+                """SELECT sha256, size FROM blobs
+                   WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.sha256 = blobs.sha256)
+                   ORDER BY last_used"""
+            )
+            for sha256, size in rows.fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                try:
+                    os.remove(self.path(sha256))
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+                freed += size
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.evicted += evicted
+            self.evicted_bytes += freed
+        return evicted
+
+    def stats(self):
+        conn = self._connect()
+        files, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        refs = conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        with self._lock:
+            return {
+                "files": files,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "references": refs,
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "evicted": self.evicted,
+                "evicted_bytes": self.evicted_bytes,
+            }